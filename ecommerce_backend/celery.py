@@ -8,7 +8,7 @@ import logging,os
 from . import settings
 from celery import shared_task
 from celery.schedules import crontab
-from inara import views
+from inara import blacklist, notifications, views
 from datetime import datetime, timedelta
 from .views import cancel_unpaid_orders_view
 
@@ -64,6 +64,14 @@ def setup_periodic_tasks(sender, **kwargs):
         crontab(minute="*/30"), 
         CancelOrder.s(),  
     )
+    sender.add_periodic_task(
+        crontab(minute="*/5"),
+        SendOutboxEmails.s(),
+    )
+    sender.add_periodic_task(
+        crontab(minute="15"),
+        PruneTokenBlacklist.s(),
+    )
 
 @app.task
 def debug_task(message):
@@ -126,3 +134,16 @@ def CancelOrder():
         return response  
     except Exception as e:
         celeryLogger.error(f"Error cancelling orders: {str(e)}")
+
+@app.task
+def SendOutboxEmails():
+    # sweep for mail whose after-commit dispatch never reached the broker
+    celeryLogger.info("%s" %('Send Outbox Emails initiated'))
+    sent, failed = notifications.deliver()
+    celeryLogger.info("Complete -- Send Outbox Emails: sent=%s failed=%s" %(sent, failed))
+
+@app.task
+def PruneTokenBlacklist():
+    celeryLogger.info("%s" %('Prune Token Blacklist initiated'))
+    deleted = blacklist.prune()
+    celeryLogger.info("Complete -- Prune Token Blacklist: deleted=%s" %(deleted))
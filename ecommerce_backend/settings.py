@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'rest_framework_simplejwt',
     'django.contrib.sites',
+    'django.contrib.postgres',
     
 
     # authentication
@@ -127,7 +128,7 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "dj_rest_auth.jwt_auth.JWTCookieAuthentication",
+        "inara.authentication.JWTCookieAuthentication",
     ),
     
 }
@@ -325,6 +326,9 @@ accept_content = ['json']
 task_serializer = 'json'
 result_serializer = 'json'
 timezone = 'Asia/Karachi'
+# image encoding is CPU bound: keep it off the default queue, on its own process pool
+# celery -A ecommerce_backend.tasks worker -Q images -P prefork -c <cores>
+task_routes = {'generate_image_variants': {'queue': 'images'}}
 
 # Redis Cache Configuration
 # Use Redis for caching API responses to improve performance
@@ -360,6 +364,7 @@ CACHE_TIMEOUT = {
     'nav_categories': 600,  # 10 minutes
     'general_settings': 1800,  # 30 minutes
     'sliders': 3600,  # 1 hour
+    'tagged': 86400,  # 24 hours, entries tagged via inara.caching are invalidated on change
 }
 
 LOGGING = {
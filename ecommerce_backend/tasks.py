@@ -12,7 +12,10 @@ from . import settings
 logger = logging.getLogger(__name__)
 import requests
 from django.http import JsonResponse
-from inara.models import Item,Category,TaskProgress,task_canceled,task_stopped
+from inara.models import Item,Category,CategoryItem,TaskProgress,task_canceled,task_stopped
+from inara import imagevariants as image_variants
+from inara import notifications
+from inara.core.middlewares.externalPOS.Gofrugal_RPOS7.client import RPOS7Client, POSUnreachable
 from unidecode import unidecode
 import re
 import random
@@ -232,12 +235,14 @@ class RPOS7CategoryItem(object):
 def sync_items_click():
         context = {}
         errorList = []
-        r1=requests.get("https://722157.true-order.com/WebReporter/api/v1/items",timeout=5, headers={"X-Auth-Token":env('POS_AUTH_TOKEN')})
-        if(r1.status_code==424):
+        client = RPOS7Client("https://722157.true-order.com/WebReporter/api/v1/items", env('POS_AUTH_TOKEN'), workers=int(env('POS_FETCH_WORKERS', default=4)))
+        try:
+            jsonObj1 = client.fetch()
+        except POSUnreachable:
+            client.close()
             TaskProgress.objects.filter(syncType="ITEM_SYNC",status="PROGRESS").update(cancelTask=True,status="STOPPED",statusReason="Pos is unreachable")
             logger.info("POS is not Reachable.")
             raise Ignore
-        jsonObj1 = r1.json()
         try:
             sync_items_click.update_state(state='PROGRESS', meta={'progress': 0})
             try:
@@ -246,15 +251,9 @@ def sync_items_click():
                 raise Ignore
             TaskProgress.objects.filter(syncType="ITEM_SYNC",status="PROGRESS").update(total=jsonObj1['total_pages'])
             checkIfTaskCancelled("Before Sync Process Starts")
-            for iteration in range(1,jsonObj1['total_pages']+1):
+            for iteration, jsonObj in client.pages(jsonObj1['total_pages']):
                 checkIfTaskCancelled(iteration)
                 logger.info("Item Sync Page No: %s " %(str(iteration)))
-                r=requests.get("https://722157.true-order.com/WebReporter/api/v1/items?page="+str(iteration), headers={"X-Auth-Token":env('POS_AUTH_TOKEN')})
-                if(r1.status_code==424):
-                    TaskProgress.objects.filter(syncType="CATEGORY_SYNC",status="PROGRESS").update(cancelTask=True,status="STOPPED",statusReason="POS is unreachable")
-                    logger.info("POS is not Reachable.")
-                    raise Ignore
-                jsonObj = r.json()
                 for item in jsonObj['items']:
                     # if item['appliesOnline'] == 1:
                     obj = RPOS7Item()
@@ -339,12 +338,18 @@ def sync_items_click():
                 TaskProgress.objects.filter(syncType="ITEM_SYNC",status="PROGRESS").update(progress=iteration)
             currentTime = datetime.datetime.now()  
             TaskProgress.objects.filter(syncType="ITEM_SYNC",status="PROGRESS").update(completionTime=currentTime,status="COMPLETED")
+        except POSUnreachable:
+            TaskProgress.objects.filter(syncType="ITEM_SYNC",status="PROGRESS").update(cancelTask=True,status="STOPPED",statusReason="POS is unreachable")
+            logger.info("POS is not Reachable.")
+            raise Ignore
         except Exception as e:
             print("Exception in SyncItem - RPOS7: " + str(e))
             if(TaskProgress.objects.filter(syncType="ITEM_SYNC",cancelTask=True,status="CANCELLED").exists()):
                 TaskProgress.objects.filter(syncType="ITEM_SYNC",cancelTask=True,status="CANCELLED").update(status="STOPPED",statusReason="Exception Occured")
             errorList.append({"Error":'Sync Process Error : '+str(e)})
             pass
+        finally:
+            client.close()
         
         if errorList:
             errorResponse = ', '.join(d['Error'] for d in errorList)
@@ -353,6 +358,32 @@ def sync_items_click():
 ###################################### onClick Items END #################################
 
 
+###################################### Outbound email ####################################
+OUTBOX_RETRY_DELAY = 60
+
+@app.task(name="send_outbox_emails", bind=True, max_retries=5)
+def send_outbox_emails(self, ids=None):
+    # rows that failed stay pending; retry them with exponential backoff (1, 2, 4, ... minutes)
+    sent, failed = notifications.deliver(ids)
+    celeryLogger.info("Outbox: sent=%s failed=%s" %(sent, failed))
+    if failed:
+        raise self.retry(countdown=OUTBOX_RETRY_DELAY * 2 ** self.request.retries)
+    return sent
+
+
+###################################### Image variants ####################################
+IMAGE_VARIANTS_RETRY_DELAY = 300
+
+@app.task(name="generate_image_variants", bind=True, max_retries=3)
+def generate_image_variants(self, kind, ids):
+    # CPU bound: routed to the image queue (task_routes), consumed by a prefork worker
+    failed = image_variants.generate_many(kind, ids)
+    celeryLogger.info("Image variants %s: done=%s failed=%s" %(kind, len(ids) - len(failed), len(failed)))
+    if failed:
+        raise self.retry(args=(kind, failed), countdown=IMAGE_VARIANTS_RETRY_DELAY * 2 ** self.request.retries)
+    return len(ids)
+
+
 def get_task_status(task_id):
     task = AsyncResult(task_id, app=app)
     status = task.status
@@ -1,9 +1,17 @@
+import threading
+from collections import OrderedDict
+
+from dj_rest_auth import jwt_auth
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
 from django.utils.translation import gettext_lazy as _
 from rest_framework import HTTP_HEADER_ENCODING, authentication
 
+from inara import caching
 from .exceptions import AuthenticationFailed, InvalidToken, TokenError
-from rest_framework_simplejwt.views import api_settings
+from rest_framework_simplejwt.settings import api_settings
 
 AUTH_HEADER_TYPES = api_settings.AUTH_HEADER_TYPES
 
@@ -12,6 +20,82 @@ if not isinstance(api_settings.AUTH_HEADER_TYPES, (list, tuple)):
 
 AUTH_HEADER_TYPE_BYTES = {h.encode(HTTP_HEADER_ENCODING) for h in AUTH_HEADER_TYPES}
 
+# The slim user principal: enough for authentication and the role checks in the views. It is
+# cached per process and in the shared cache under the user's version stamp (the 'user:<id>'
+# cache tag), which every User save/delete and principal_changed() move on, so a role, status
+# or password change takes effect on the next request.
+PRINCIPAL_FIELDS = ('id', 'role', 'status', 'is_active')
+PRINCIPAL_KEY = 'auth-principal:%s:%s'
+PRINCIPAL_TIMEOUT = getattr(settings, 'AUTH_PRINCIPAL_TIMEOUT', 3600)
+LOCAL_PRINCIPALS = 2048
+
+_principals = OrderedDict()
+_principals_lock = threading.Lock()
+
+
+def user_tag(user_id):
+    return 'user:%s' % user_id
+
+
+def principal_changed(*user_ids):
+    """Retire the cached principals of the given users once the current transaction commits."""
+    caching.invalidate(*[user_tag(user_id) for user_id in user_ids])
+
+
+class UserPrincipal(SimpleLazyObject):
+    """
+    request.user backed by a cached principal. The principal fields are answered without a
+    query; anything else (or using it as a User instance) loads the User row once.
+    """
+
+    def __init__(self, principal):
+        user_model = get_user_model()
+        super().__init__(lambda: user_model.objects.get(pk=principal['id']))
+        self.__dict__.update(principal)
+        self.__dict__.update(pk=principal['id'], is_authenticated=True, is_anonymous=False)
+
+    def __bool__(self):
+        return True
+
+
+def get_principal(user_id):
+    """The principal dict of user_id, or None if there is no such user."""
+    version = caching.tag_versions([user_tag(user_id)])[0]
+    with _principals_lock:
+        local = _principals.get(user_id)
+        if local is not None and local[0] == version:
+            _principals.move_to_end(user_id)
+            return local[1]
+    key = PRINCIPAL_KEY % (user_id, version)
+    principal = cache.get(key)
+    if principal is None:
+        principal = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values(*PRINCIPAL_FIELDS).first()
+        if principal is None:
+            return None
+        cache.set(key, principal, PRINCIPAL_TIMEOUT)
+    with _principals_lock:
+        _principals[user_id] = (version, principal)
+        _principals.move_to_end(user_id)
+        while len(_principals) > LOCAL_PRINCIPALS:
+            _principals.popitem(last=False)
+    return principal
+
+
+def get_cached_user(validated_token):
+    try:
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    principal = get_principal(user_id)
+    if principal is None:
+        raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+    if not principal['is_active']:
+        raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+    return UserPrincipal(principal)
+
 
 class JWTAuthentication(authentication.BaseAuthentication):
     """
@@ -28,12 +112,10 @@ class JWTAuthentication(authentication.BaseAuthentication):
 
     def authenticate(self, request):
         header = self.get_header(request)
-        print('Header ',header)
         if header is None:
             return None
 
         raw_token = self.get_raw_token(header)
-        print('raw_token ',raw_token)
         if raw_token is None:
             return None
 
@@ -110,22 +192,20 @@ class JWTAuthentication(authentication.BaseAuthentication):
 
     def get_user(self, validated_token):
         """
-        Attempts to find and return a user using the given validated token.
+        Attempts to find and return a user using the given validated token,
+        from the cached principal when its version stamp is current.
         """
-        try:
-            user_id = validated_token[api_settings.USER_ID_CLAIM]
-        except KeyError:
-            raise InvalidToken(_("Token contained no recognizable user identification"))
+        return get_cached_user(validated_token)
 
-        try:
-            user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
-        except self.user_model.DoesNotExist:
-            raise AuthenticationFailed(_("User not found"), code="user_not_found")
 
-        if not user.is_active:
-            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+class JWTCookieAuthentication(jwt_auth.JWTCookieAuthentication):
+    """
+    dj-rest-auth's header-or-cookie JWT authentication, resolving the user
+    from the cached principal.
+    """
 
-        return user
+    def get_user(self, validated_token):
+        return get_cached_user(validated_token)
 
 
 class JWTStatelessUserAuthentication(JWTAuthentication):
@@ -0,0 +1,3 @@
+# Revoked access tokens: jti store with a per-process bloom filter in front
+from .bloom import BloomFilter
+from .service import add, is_blacklisted, prune
@@ -0,0 +1,32 @@
+"""
+Fixed-size bloom filter over strings
+
+Sized for capacity keys at error_rate false positives; the k bit positions come from one
+blake2b digest by double hashing. A key that was added is always reported present.
+"""
+import hashlib
+import math
+
+
+class BloomFilter(object):
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(int(capacity), 1)
+        self.size = int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / self.capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        step = int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
@@ -0,0 +1,130 @@
+"""
+Access token blacklist
+
+Revoked access tokens are stored by jti: a TokenBlacklist row that lives until the token's own
+expiry (prune() removes it afterwards) and a cache entry with the same TTL. In front of both,
+every process keeps a bloom filter of the live jtis, so the common case of a token that was
+never revoked is answered without any I/O. The filter follows the 'token-blacklist' cache tag
+as a generation counter: it is checked at most every REFRESH_SECONDS, new rows are added
+incrementally and the whole filter is rebuilt every REBUILD_SECONDS to shed expired jtis.
+Only jtis the filter reports present are looked up in the cache, then the database.
+"""
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
+
+from inara import caching
+from inara.models import TokenBlacklist
+from .bloom import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+BLACKLIST_TAG = 'token-blacklist'
+ENTRY_KEY = 'token-blacklist:%s'
+REFRESH_SECONDS = getattr(settings, 'TOKEN_BLACKLIST_REFRESH_SECONDS', 2)
+REBUILD_SECONDS = getattr(settings, 'TOKEN_BLACKLIST_REBUILD_SECONDS', 3600)
+ERROR_RATE = 0.001
+MIN_CAPACITY = 10000
+# how long a bloom false positive is remembered as not blacklisted
+CLEAR_TIMEOUT = 300
+
+_bloom = None
+_bloomVersion = None
+_bloomLastId = 0
+_bloomBuiltAt = 0.0
+_checkedAt = 0.0
+_lock = threading.Lock()
+
+
+def _live_rows(since_id=0):
+    return (TokenBlacklist.objects.filter(id__gt=since_id, expiresAt__gt=timezone.now())
+            .values_list('id', 'jti').order_by('id'))
+
+
+def _rebuild(version, now):
+    # caller holds _lock
+    global _bloom, _bloomVersion, _bloomLastId, _bloomBuiltAt, _checkedAt
+    rows = list(_live_rows())
+    bloom = BloomFilter(max(MIN_CAPACITY, 2 * len(rows)), ERROR_RATE)
+    for rowId, jti in rows:
+        bloom.add(jti)
+    _bloom, _bloomVersion, _bloomBuiltAt, _checkedAt = bloom, version, now, now
+    _bloomLastId = rows[-1][0] if rows else 0
+
+
+def _refresh():
+    # caller holds _lock
+    global _bloomVersion, _bloomLastId, _checkedAt
+    now = time.monotonic()
+    version = caching.tag_versions([BLACKLIST_TAG])[0]
+    if _bloom is None or now - _bloomBuiltAt >= REBUILD_SECONDS:
+        return _rebuild(version, now)
+    if version != _bloomVersion:
+        rows = list(_live_rows(_bloomLastId))
+        if _bloom.count + len(rows) > _bloom.capacity:
+            return _rebuild(version, now)
+        for rowId, jti in rows:
+            _bloom.add(jti)
+            _bloomLastId = rowId
+        _bloomVersion = version
+    _checkedAt = now
+
+
+def _bloom_filter():
+    if _bloom is not None and time.monotonic() - _checkedAt < REFRESH_SECONDS:
+        return _bloom
+    with _lock:
+        if _bloom is None or time.monotonic() - _checkedAt >= REFRESH_SECONDS:
+            _refresh()
+    return _bloom
+
+
+def is_blacklisted(jti):
+    """Whether the access token with this jti was revoked."""
+    if not jti or jti not in _bloom_filter():
+        return False
+    state = cache.get(ENTRY_KEY % jti)
+    if state is not None:
+        return bool(state)
+    expiresAt = TokenBlacklist.objects.filter(jti=jti).values_list('expiresAt', flat=True).first()
+    blocked = expiresAt is not None and expiresAt > timezone.now()
+    timeout = int((expiresAt - timezone.now()).total_seconds()) if blocked else CLEAR_TIMEOUT
+    cache.set(ENTRY_KEY % jti, 1 if blocked else 0, max(timeout, 1))
+    return blocked
+
+
+def add(token):
+    """
+    Revoke an encoded access token until it expires. Returns its jti, or None when the token is
+    invalid or already expired and so needs no blacklisting.
+    """
+    try:
+        payload = UntypedToken(token).payload
+    except TokenError:
+        return None
+    jti = payload.get(api_settings.JTI_CLAIM)
+    if not jti or 'exp' not in payload:
+        return None
+    expiresAt = datetime.datetime.fromtimestamp(payload['exp'], tz=datetime.timezone.utc)
+    TokenBlacklist.objects.bulk_create([TokenBlacklist(jti=jti, expiresAt=expiresAt)], ignore_conflicts=True)
+    cache.set(ENTRY_KEY % jti, 1, max(int(payload['exp'] - time.time()), 1))
+    caching.invalidate(BLACKLIST_TAG)
+    with _lock:
+        # this process sees it at once, the others on their next generation check
+        if _bloom is not None:
+            _bloom.add(jti)
+    return jti
+
+
+def prune():
+    """Delete the rows of blacklisted tokens that have expired; returns the number removed."""
+    deleted, _ = TokenBlacklist.objects.filter(expiresAt__lte=timezone.now()).delete()
+    return deleted
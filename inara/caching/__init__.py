@@ -0,0 +1,3 @@
+# Tag-versioned cache shared by the storefront views
+from .http import cached_response, etag_by_version, etag_matches, not_modified, version_etag
+from .tags import cached, fetch, get_or_set, invalidate, item_tags, stats, tag_versions, versioned_key
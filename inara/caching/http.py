@@ -0,0 +1,136 @@
+"""
+Response-level caching
+
+cached_response stores the final gzip-compressed JSON body of a view together with its ETag and
+length, under the same tag-versioned, single-flight keys as get_or_set. A hit is answered
+straight from those bytes (or with 304 when If-None-Match matches) without unpickling Python
+objects or re-encoding JSON.
+
+etag_by_version answers conditional GETs from the tag generations alone: the ETag is derived
+from the request and the current versions of the tags the payload depends on, so a matching
+If-None-Match gets its 304 before the view queries or serializes anything.
+"""
+import gzip
+import hashlib
+import time
+from functools import wraps
+
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from .tags import get_or_set, tag_versions
+
+COMPRESS_LEVEL = 6
+
+
+def _etag(body):
+    return '"%s"' % hashlib.md5(body).hexdigest()
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(',')]
+    # weak comparison, as for GET in RFC 7232
+    return '*' in candidates or etag in candidates or 'W/' + etag in candidates
+
+
+def not_modified(etag):
+    response = HttpResponse(status=304)
+    response['ETag'] = etag
+    return response
+
+
+def _accepts_gzip(request):
+    return 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+
+def _entry(response):
+    # only complete, non-empty 200 JSON bodies are cached; the views answer errors with [] or {}
+    if response.status_code != 200 or getattr(response, 'streaming', False) or len(response.content) <= 2:
+        return None
+    body = response.content
+    return (gzip.compress(body, COMPRESS_LEVEL), _etag(body), response.get('Content-Type', 'application/json'))
+
+
+def _respond(request, entry):
+    compressed, etag, contentType = entry
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    if _accepts_gzip(request):
+        response = HttpResponse(compressed, content_type=contentType)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(compressed), content_type=contentType)
+    response['ETag'] = etag
+    response['Content-Length'] = str(len(response.content))
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def cached_response(name, tags, vary=None, timeout=None):
+    """
+    Cache the rendered response of a function view.
+
+    tags is a list or a callable receiving the request; vary, if given, receives the request
+    and returns the values that select the cached variant (e.g. the category slug):
+
+        @cached_response('getItemSearchCategory', tags=lambda request: [...], vary=lambda request: [slug])
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            parts = [str(value) for value in vary(request)] if vary else []
+            resolved = tags(request) if callable(tags) else tags
+            uncached = []
+
+            def build():
+                response = view(request, *args, **kwargs)
+                entry = _entry(response)
+                if entry is None:
+                    uncached.append(response)
+                return entry
+
+            entry = get_or_set(':'.join([name] + parts), resolved, build, timeout, cache_empty=False)
+            if entry is None:
+                return uncached[0]
+            return _respond(request, entry)
+        return wrapper
+    return decorator
+
+
+def version_etag(request, name, tags, parts=(), period=None):
+    versions = [str(version) for version in tag_versions(tags)]
+    if period:
+        # payloads that also change with the clock (scheduled publishing) rotate every period seconds
+        versions.append(str(int(time.time() // period)))
+    seed = '|'.join([name, request.get_host(), request.get_full_path()] + [str(part) for part in parts] + versions)
+    return '"v%s"' % hashlib.sha1(seed.encode('utf-8')).hexdigest()
+
+
+def etag_by_version(name, tags, vary=None, period=None):
+    """
+    Conditional GET for a function view whose payload only changes when one of tags is bumped.
+
+    tags and vary take the same forms as in cached_response. Only GET/HEAD are answered with
+    304; every 200 response gets the ETag and "Cache-Control: no-cache", so browsers and the
+    CDN revalidate instead of re-downloading.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            parts = vary(request) if vary else ()
+            resolved = tags(request) if callable(tags) else tags
+            etag = version_etag(request, name, resolved, parts, period)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            response = view(request, *args, **kwargs)
+            if response is not None and response.status_code == 200:
+                response['ETag'] = etag
+                patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return decorator
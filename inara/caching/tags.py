@@ -0,0 +1,252 @@
+"""
+Tag-versioned caching
+
+Every cached value is stored under a key that embeds the current generation of each tag it
+depends on (e.g. 'items', 'item:42', 'category:honey', 'homepage'). Bumping a tag moves those
+keys on, so stale entries are simply never read again and expire by TTL; nothing has to be
+deleted and unrelated entries survive a product edit.
+
+Rebuilds are single-flight: entries carry a soft expiry, and when one lapses (or a tag is
+bumped) only the worker holding a short cache lock recomputes while the others keep serving
+the previous value. Entries are also refreshed probabilistically a little before their soft
+expiry (XFetch), so a hot key rarely expires under load at all.
+"""
+import hashlib
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+TAG_KEY = 'tag:%s'
+VALUE_KEY = 'tce:%s:%s'
+LATEST_KEY = 'tc-latest:%s'
+LOCK_KEY = 'tc-lock:%s'
+STATS_KEY = 'tc-stats:%s:%s'
+STATS_NAMES_KEY = 'tc-stats:names'
+DEFAULT_TIMEOUT = settings.CACHE_TIMEOUT.get('tagged', 86400)
+# how long a value may still be served while another worker rebuilds it
+STALE_GRACE = settings.CACHE_TIMEOUT.get('stale_grace', 600)
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2.0
+LOCK_POLL = 0.05
+EARLY_EXPIRY_BETA = 1.0
+STATS_FLUSH_INTERVAL = 10
+EVENTS = ('hit', 'miss', 'stale', 'lock_wait')
+
+
+def _tag_key(tag):
+    return TAG_KEY % tag
+
+
+def tag_versions(tags):
+    """Current generation of each tag, initialising tags that are not in the cache yet."""
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # start from the clock, not 1, so an evicted tag can never reuse an old generation
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _short(name):
+    return name if len(name) <= 150 else hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+
+def versioned_key(name, tags):
+    versions = '.'.join(str(version) for version in tag_versions(tags))
+    return VALUE_KEY % (_short(name), versions)
+
+
+def _bump(tags):
+    for tag in tags:
+        try:
+            cache.incr(_tag_key(tag))
+        except ValueError:
+            cache.set(_tag_key(tag), int(time.time() * 1000), None)
+
+
+def invalidate(*tags):
+    """
+    Move the given tags on once the current transaction commits.
+
+    Bumping after commit keeps a concurrent request from caching pre-commit data under the
+    new generation.
+    """
+    tags = [tag for tag in tags if tag]
+    if tags:
+        transaction.on_commit(lambda: _bump(tags))
+
+
+# ---------------------------------------------------------------------------
+# hit / miss / stale / lock-wait counters
+# ---------------------------------------------------------------------------
+
+_counts = Counter()
+_counts_lock = threading.Lock()
+_last_flush = [time.monotonic()]
+_known_names = set()
+
+
+def _count(name, event):
+    base = name.split(':', 1)[0]
+    with _counts_lock:
+        _counts[(base, event)] += 1
+        if time.monotonic() - _last_flush[0] < STATS_FLUSH_INTERVAL:
+            return
+        pending = dict(_counts)
+        _counts.clear()
+        _last_flush[0] = time.monotonic()
+    _flush(pending)
+
+
+def _flush(pending):
+    # counters are kept per process and pushed to the shared cache every few seconds,
+    # so a hit costs no extra round trip
+    try:
+        names = set(base for base, event in pending)
+        if not names <= _known_names:
+            _known_names.update(cache.get(STATS_NAMES_KEY) or [])
+            _known_names.update(names)
+            cache.set(STATS_NAMES_KEY, sorted(_known_names), None)
+        for (base, event), count in pending.items():
+            key = STATS_KEY % (base, event)
+            cache.add(key, 0, None)
+            cache.incr(key, count)
+    except Exception as e:
+        logger.error("Exception in caching stats flush: %s " % (str(e)))
+
+
+def stats():
+    """Counters per cached endpoint, summed over all workers: {name: {hit, miss, stale, lock_wait}}."""
+    with _counts_lock:
+        pending = dict(_counts)
+        _counts.clear()
+        _last_flush[0] = time.monotonic()
+    if pending:
+        _flush(pending)
+    names = cache.get(STATS_NAMES_KEY) or []
+    keys = [STATS_KEY % (name, event) for name in names for event in EVENTS]
+    values = cache.get_many(keys)
+    return {name: {event: values.get(STATS_KEY % (name, event), 0) for event in EVENTS} for name in names}
+
+
+# ---------------------------------------------------------------------------
+# single-flight get_or_set
+# ---------------------------------------------------------------------------
+
+def _expiring(entry):
+    # XFetch: refresh early with a probability that grows as the soft expiry nears and with
+    # how long the value took to build
+    value, expires_at, delta = entry
+    return time.time() - delta * EARLY_EXPIRY_BETA * math.log(1.0 - random.random()) >= expires_at
+
+
+def _build(name, key, builder, timeout, cache_empty):
+    start = time.time()
+    value = builder()
+    if value or cache_empty:
+        entry = (value, start + timeout, time.time() - start)
+        cache.set_many({key: entry, LATEST_KEY % _short(name): entry}, timeout + STALE_GRACE)
+    return value
+
+
+def _release(lock, token):
+    # a build that outlived LOCK_TIMEOUT no longer owns the lock; leave the new holder's alone
+    if cache.get(lock) == token:
+        cache.delete(lock)
+
+
+def fetch(name, tags, builder, timeout=None, cache_empty=True):
+    """
+    get_or_set() that also says whether the value belongs to the current tag versions:
+    returns (value, current). current is False only for the previous generation's value,
+    served while another worker rebuilds, which callers must not keep under the new key.
+    """
+    timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+    key = versioned_key(name, tags)
+    entry = cache.get(key)
+    if entry is not None and not _expiring(entry):
+        _count(name, 'hit')
+        return entry[0], True
+
+    lock = LOCK_KEY % _short(name)
+    token = uuid.uuid4().hex
+    if cache.add(lock, token, LOCK_TIMEOUT):
+        try:
+            _count(name, 'miss')
+            return _build(name, key, builder, timeout, cache_empty), True
+        finally:
+            _release(lock, token)
+
+    if entry is not None:
+        # picked for early refresh, but someone else is already on it
+        _count(name, 'hit' if time.time() < entry[1] else 'stale')
+        return entry[0], True
+    stale = cache.get(LATEST_KEY % _short(name))
+    if stale is not None:
+        _count(name, 'stale')
+        return stale[0], False
+
+    _count(name, 'lock_wait')
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0], True
+        if cache.get(lock) is None:
+            break
+    _count(name, 'miss')
+    return _build(name, key, builder, timeout, cache_empty), True
+
+
+def get_or_set(name, tags, builder, timeout=None, cache_empty=True):
+    """
+    Cached value of builder() for name and tags; builder exceptions are not cached.
+
+    On a miss, an expired entry or a bumped tag only the worker that takes the rebuild lock
+    calls builder(); the others serve the previous value if there is one, otherwise wait up to
+    LOCK_WAIT seconds for the rebuilt value.
+    """
+    return fetch(name, tags, builder, timeout, cache_empty)[0]
+
+
+def cached(name, tags, timeout=None, cache_empty=True):
+    """
+    Decorator form of get_or_set. Positional arguments become part of the key and
+    tags may be a callable receiving the same arguments:
+
+        @cached('itemSearchCategory', tags=lambda slug: ['category:' + slug])
+        def buildItemSearchCategory(slug): ...
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args):
+            resolved = tags(*args) if callable(tags) else tags
+            key_name = ':'.join([name] + [str(arg) for arg in args])
+            return get_or_set(key_name, resolved, lambda: func(*args), timeout, cache_empty)
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def item_tags(item_ids):
+    """Tags touched by a change to the given items: the items, item lists and their categories."""
+    from inara.models import CategoryItem, Item
+    item_ids = list(item_ids)
+    itemSlugs = Item.objects.filter(id__in=item_ids).values_list('slug', flat=True)
+    slugs = CategoryItem.objects.filter(itemId__in=item_ids).values_list('categoryId__slug', flat=True).distinct()
+    return (['items'] + ['item:%s' % item_id for item_id in item_ids] + ['item-slug:%s' % slug for slug in itemSlugs if slug] +
+            ['category:%s' % slug for slug in slugs if slug])
@@ -0,0 +1,3 @@
+# Category hierarchy: cached in-process tree and the CategoryClosure table
+from .tree import CategoryTree
+from .service import breadcrumb, descendant_ids, get_tree, load_tree, rebuild_closure, refresh_closure
@@ -0,0 +1,84 @@
+"""
+Category tree service
+
+get_tree() returns a per-process CategoryTree that is rebuilt when the 'categories' cache tag
+moves on (every Category save/delete bumps it). CategoryClosure mirrors the same hierarchy in
+the database for queries that need "this category and everything under it" in SQL.
+"""
+import logging
+import threading
+
+from django.db import transaction
+
+from inara.caching import tag_versions
+from inara.models import Category, CategoryClosure
+from .tree import NODE_FIELDS, CategoryTree
+
+logger = logging.getLogger(__name__)
+
+TREE_TAG = 'categories'
+
+_tree = None
+_treeVersion = None
+_lock = threading.Lock()
+
+
+def load_tree():
+    return CategoryTree(list(Category.objects.order_by('id').values(*NODE_FIELDS)))
+
+
+def get_tree():
+    """The cached CategoryTree of this process, rebuilt after any category change."""
+    global _tree, _treeVersion
+    version = tag_versions([TREE_TAG])[0]
+    if _tree is not None and _treeVersion == version:
+        return _tree
+    with _lock:
+        if _tree is None or _treeVersion != version:
+            _tree = load_tree()
+            _treeVersion = version
+    return _tree
+
+
+def _closure_rows(tree, categoryIds):
+    rows = []
+    for categoryId in categoryIds:
+        ancestors = tree.ancestors(categoryId)
+        rows.append(CategoryClosure(ancestorId_id=categoryId, descendantId_id=categoryId, depth=0))
+        for depth, ancestorId in enumerate(reversed(ancestors), start=1):
+            rows.append(CategoryClosure(ancestorId_id=ancestorId, descendantId_id=categoryId, depth=depth))
+    return rows
+
+
+def refresh_closure(category_ids):
+    """Rewrite the closure rows of the given categories and everything below them."""
+    tree = load_tree()
+    affected = set()
+    for categoryId in category_ids:
+        if categoryId in tree:
+            affected.update(tree.subtree(categoryId))
+    if not affected:
+        return 0
+    with transaction.atomic():
+        CategoryClosure.objects.filter(descendantId__in=affected).delete()
+        rows = _closure_rows(tree, sorted(affected))
+        CategoryClosure.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def rebuild_closure():
+    tree = load_tree()
+    with transaction.atomic():
+        CategoryClosure.objects.all().delete()
+        rows = _closure_rows(tree, sorted(tree.nodes))
+        CategoryClosure.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def descendant_ids(category_id, include_self=True):
+    tree = get_tree()
+    return list(tree.subtree(category_id) if include_self else tree.descendants(category_id))
+
+
+def breadcrumb(category_id):
+    return get_tree().breadcrumb(category_id)
@@ -0,0 +1,87 @@
+"""
+In-memory category tree
+
+Built from a single query over the categories table. Ancestors, descendants and depth are
+precomputed per node, so parent/child, breadcrumb and subtree lookups are dict reads.
+"""
+NODE_FIELDS = ('id', 'parentId', 'name', 'slug', 'icon', 'status', 'isBrand', 'appliesOnline', 'priority')
+
+
+class CategoryTree(object):
+
+    def __init__(self, rows):
+        # rows: dicts with NODE_FIELDS, in the order children should be listed
+        self.nodes = {}
+        self.bySlug = {}
+        self._children = {}
+        for row in rows:
+            self.nodes[row['id']] = row
+            self.bySlug[row['slug']] = row
+        self.roots = []
+        for row in self.nodes.values():
+            parentId = row['parentId']
+            if parentId is None or parentId not in self.nodes:
+                self.roots.append(row)
+            else:
+                self._children.setdefault(parentId, []).append(row)
+        self._ancestors = {}
+        self._descendants = {}
+        for root in self.roots:
+            self._walk(root, ())
+        # rows on a parentId cycle are unreachable from any root; keep them as detached roots
+        for row in self.nodes.values():
+            if row['id'] not in self._ancestors:
+                self.roots.append(row)
+                self._walk(row, ())
+
+    def _walk(self, root, ancestors):
+        # iterative DFS: fills ancestors (root first) and the descendant ids of every node
+        stack = [(root, ancestors)]
+        order = []
+        while stack:
+            node, path = stack.pop()
+            if node['id'] in self._ancestors:
+                continue
+            self._ancestors[node['id']] = path
+            order.append(node['id'])
+            for child in reversed(self._children.get(node['id'], [])):
+                stack.append((child, path + (node['id'],)))
+        for nodeId in reversed(order):
+            descendants = []
+            for child in self._children.get(nodeId, []):
+                if self._ancestors.get(child['id'], ())[-1:] == (nodeId,):
+                    descendants.append(child['id'])
+                    descendants.extend(self._descendants.get(child['id'], ()))
+            self._descendants[nodeId] = tuple(descendants)
+
+    def __contains__(self, categoryId):
+        return categoryId in self.nodes
+
+    def get(self, categoryId):
+        return self.nodes.get(categoryId)
+
+    def by_slug(self, slug):
+        return self.bySlug.get(slug)
+
+    def children(self, categoryId):
+        return self._children.get(categoryId, [])
+
+    def ancestors(self, categoryId):
+        """Ancestor ids, root first."""
+        return self._ancestors.get(categoryId, ())
+
+    def descendants(self, categoryId):
+        """Ids of every category below categoryId, depth first."""
+        return self._descendants.get(categoryId, ())
+
+    def subtree(self, categoryId):
+        return (categoryId,) + self.descendants(categoryId)
+
+    def depth(self, categoryId):
+        return len(self._ancestors.get(categoryId, ()))
+
+    def breadcrumb(self, categoryId):
+        """Nodes from the root down to categoryId."""
+        if categoryId not in self.nodes:
+            return []
+        return [self.nodes[ancestorId] for ancestorId in self.ancestors(categoryId)] + [self.nodes[categoryId]]
@@ -6,10 +6,12 @@ import re
 import os
 from ecommerce_backend.settings import BASE_DIR
 from unidecode import unidecode
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 import requests
 import random
 from inara.core import error_codes
+from inara import caching
+from inara import categories as category_tree
 from celery.exceptions import Ignore
 import environ
 env = environ.Env()
@@ -45,14 +47,17 @@ class RPOS7Category(object):
 
 class RPOS7CategorySync(object):
 
-    def syncCategories(self):
+    def syncCategories(self, incremental=True):
         context = {}
         errorList = []
+        unchanged = 0
         r=requests.get("https://722157.true-order.com/WebReporter/api/v1/categories", headers={"X-Auth-Token":env('POS_AUTH_TOKEN')})
         if(r.status_code==424):
             logger.info("POS is not Reachable in Schedule Category Sync.")
             raise Ignore
         json_data = r.json()
+        # POS syncTs per category, used to skip rows the POS has not touched since the last run
+        syncStamps = dict(Category.objects.exclude(extPosId=0).values_list('extPosId','syncTs'))
         try:
             for categories in json_data['categories']:
                 if (categories['catName'] == 'Cat1') or (categories['catName'] == 'Cat2'):
@@ -65,7 +70,10 @@ class RPOS7CategorySync(object):
                             status = Category.INACTIVE
                             if value['catStatus'] == "Y":
                                 status = Category.ACTIVE
-                            if Category.objects.filter(extPosId=value['categoryValueId']).exists():
+                            if value['categoryValueId'] in syncStamps:
+                                if incremental and value['syncTs'] and syncStamps[value['categoryValueId']] == value['syncTs']:
+                                    unchanged += 1
+                                    continue
                                 obj.extPosParentId  = value['parentId']
                                 obj.name            = value['categoryValueName']
                                 obj.catName         = value['catName']
@@ -99,6 +107,7 @@ class RPOS7CategorySync(object):
                                 obj.status          = status
                                 try:
                                     catObject           = Category.AddCategory(obj.__dict__)
+                                    syncStamps[catObject.extPosId] = catObject.syncTs
                                 except Exception as error:
                                     print("Exception in category gofrugle " + str(error))
                                     errorList.append({"Error":str(error)})
@@ -112,10 +121,14 @@ class RPOS7CategorySync(object):
 
         except Exception as e:
             print("Exception in SyncCategory - RPOS7: " + str(e))
-            errorList.append({"Error":str(error)})
+            errorList.append({"Error":str(e)})
             pass
         if errorList:
             errorResponse = ', '.join(d['Error'] for d in errorList)
             logger.error("Exception in Category Sync: %s " %(str(errorResponse)))
+        # parentId is set with queryset .update(), which sends no post_save
+        caching.invalidate('categories')
+        transaction.on_commit(category_tree.rebuild_closure)
+        logger.info("Category Sync finished: unchanged=%s " %(str(unchanged)))
 
         return JsonResponse({'errorcode':'success'})
\ No newline at end of file
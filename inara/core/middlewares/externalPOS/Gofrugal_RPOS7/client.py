@@ -0,0 +1,66 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import logging
+logger = logging.getLogger(__name__)
+
+
+class POSUnreachable(Exception):
+    # raised when the POS answers 424 (store server offline)
+    pass
+
+
+class RPOS7Client(object):
+    # Fetches paginated WebReporter endpoints over one keep-alive session. Pages are requested
+    # by a bounded thread pool and handed back strictly in page order, so the caller can write
+    # page N to the database while pages N+1.. are still on the wire.
+
+    RETRY_STATUS    = (429, 500, 502, 503, 504)
+
+    def __init__(self, url, token, workers=4, retries=3, backoff=0.5, timeout=30):
+        self.url        = url
+        self.workers    = max(1, int(workers))
+        self.timeout    = timeout
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                      status_forcelist=self.RETRY_STATUS, allowed_methods=frozenset(['GET']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update({"X-Auth-Token": token})
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def fetch(self, page=None):
+        params = {'page': page} if page else None
+        r = self.session.get(self.url, params=params, timeout=self.timeout)
+        if r.status_code == 424:
+            raise POSUnreachable("POS is not Reachable.")
+        r.raise_for_status()
+        return r.json()
+
+    def pages(self, totalPages, start=1):
+        # yields (pageNo, json) in order; at most 2 x workers pages are buffered ahead of the consumer
+        window = deque()
+        nextPage = start
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rpos7-fetch') as executor:
+            try:
+                while window or nextPage <= totalPages:
+                    while nextPage <= totalPages and len(window) < self.workers*2:
+                        window.append((nextPage, executor.submit(self.fetch, nextPage)))
+                        nextPage += 1
+                    pageNo, future = window.popleft()
+                    yield pageNo, future.result()
+            finally:
+                # consumer stopped early (error, cancelled task): drop pages not yet started
+                for pageNo, future in window:
+                    future.cancel()
@@ -7,10 +7,15 @@ import os
 from ecommerce_backend.settings import BASE_DIR
 import requests
 from unidecode import unidecode
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 import random
+import time
+import hashlib
 from datetime import datetime, timedelta
 from celery.exceptions import Ignore
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+from inara.core.middlewares.externalPOS.Gofrugal_RPOS7.client import RPOS7Client, POSUnreachable
+from inara import caching, listing, search
 import environ
 env = environ.Env()
 environ.Env.read_env(os.path.join(BASE_DIR, '.env'))
@@ -77,7 +82,13 @@ class RPOS7CategoryItem(object):
 
 class RPOS7ItemSync(object):
 
-    def syncItems(self):
+    ITEMS_URL       = "https://722157.true-order.com/WebReporter/api/v1/items"
+    BATCH_SIZE      = 500
+    FETCH_WORKERS   = int(env('POS_FETCH_WORKERS', default=4))
+
+    def syncItems(self, batched=True, incremental=True):
+        if batched:
+            return self.syncItemsBatched(incremental=incremental)
         context = {}
         errorList = []
         r1=requests.get("https://722157.true-order.com/WebReporter/api/v1/items", headers={"X-Auth-Token":env('POS_AUTH_TOKEN')})
@@ -189,4 +200,182 @@ class RPOS7ItemSync(object):
             errorResponse = ', '.join(d['Error'] for d in errorList)
             logger.error("Exception in Item Sync: %s " %(str(errorResponse)))
 
-        return JsonResponse({'errorcode':'success'})
\ No newline at end of file
+        return JsonResponse({'errorcode':'success'})
+
+    def _mapItem(self, item, categories, errorList):
+        # map a POS item to Item field values and its Cat1/Cat2 categories
+        status = Item.INACTIVE
+        if item['status'] == "R" and item['appliesOnline'] == 1:
+            status = Item.ACTIVE
+        fields = {
+            'name'          : item['itemName'],
+            'sku'           : item['itemId'],
+            'description'   : item['detailedDescription'],
+            'weightGrams'   : item['weightGrams'],
+            'appliesOnline' : item['appliesOnline'],
+            'manufacturer'  : item['manufacturer'],
+            'length'        : item['length'],
+            'height'        : item['height'],
+            'weight'        : item['weight'],
+            'width'         : item['width'],
+            'aliasCode'     : item['itemId'],
+            'status'        : status,
+        }
+        cat1 = cat2 = None
+        for value in item['stock']:
+            fields['stock']     = value['stock']
+            fields['mrp']       = value['mrp']
+            fields['salePrice'] = value['salePrice']
+            fields['author']    = value['others'].split('author":"')[1].split('"')[0].strip()
+            fields['isbn']      = value['others'].split('isbn":"')[1].split('"')[0].strip()
+            for catName in ("Cat1", "Cat2"):
+                if value[catName]:
+                    category = categories.get((value[catName], catName))
+                    if category is None:
+                        errorList.append({"Error":'Item ID = '+str(item['itemId'])+' item Name = '+item['itemName']+', Error: '+catName+' "'+str(value[catName])+'" does not exist'})
+                    elif catName == "Cat1":
+                        cat1 = category
+                    else:
+                        cat2 = category
+        # normalise to the python types the model holds so unchanged rows compare equal
+        for field, value in fields.items():
+            fields[field] = Item._meta.get_field(field).to_python(value)
+        return fields, cat1, cat2
+
+    def _uniqueSlug(self, name, takenSlugs):
+        itemSlug = re.sub(r'[\W_]+', '-', unidecode(name).lower())
+        while itemSlug in takenSlugs:
+            itemSlug = itemSlug+str(random.randint(0,9))
+        return itemSlug
+
+    def _rowHash(self, item):
+        # fingerprint of the raw POS row; an unchanged hash means nothing to write
+        return hashlib.sha1(json.dumps(item, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def syncItemsBatched(self, incremental=True):
+        # Batched variant of syncItems: item hashes, categories and slugs are loaded once per run
+        # and every POS page is written with bulk_create/bulk_update in a single transaction.
+        # With incremental=True rows whose POS hash matches Item.syncHash are skipped outright:
+        # no UPDATE and no history row.
+        errorList = []
+        summary = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0, 'pages': []}
+        client = RPOS7Client(self.ITEMS_URL, env('POS_AUTH_TOKEN'), workers=self.FETCH_WORKERS)
+        try:
+            jsonObj1 = client.fetch()
+        except POSUnreachable:
+            client.close()
+            logger.info("POS is not Reachable in Schedule Item Sync.")
+            raise Ignore
+
+        knownHashes     = dict(Item.objects.values_list('extPosId', 'syncHash'))
+        categories      = {(cat.name, cat.catName): cat for cat in Category.objects.filter(catName__in=["Cat1", "Cat2"])}
+        takenSlugs      = set(Item.objects.values_list('slug', flat=True))
+        try:
+            with client:
+                for iteration, jsonObj in client.pages(jsonObj1['total_pages']):
+                    pageStats = self._writePage(iteration, jsonObj['items'], knownHashes, categories, takenSlugs, errorList, incremental)
+                    for key in ('created', 'updated', 'unchanged', 'failed'):
+                        summary[key] += pageStats[key]
+                    summary['pages'].append(pageStats)
+        except POSUnreachable:
+            logger.info("POS is not Reachable in Schedule Item Sync.")
+            raise Ignore
+        except Exception as e:
+            print("Exception in SyncItem - RPOS7: " + str(e))
+            errorList.append({"Error":'Sync Process Error : '+str(e)})
+
+        logger.info("Item Sync finished: created=%s updated=%s unchanged=%s failed=%s pages=%s" %(summary['created'], summary['updated'], summary['unchanged'], summary['failed'], len(summary['pages'])))
+        if errorList:
+            errorResponse = ', '.join(d['Error'] for d in errorList)
+            logger.error("Exception in Item Sync: %s " %(str(errorResponse)))
+
+        return JsonResponse({'errorcode':'success', 'created':summary['created'], 'updated':summary['updated'],
+                             'unchanged':summary['unchanged'], 'failed':summary['failed'], 'pages':summary['pages'], 'errors':len(errorList)})
+
+    def _writePage(self, pageNo, items, knownHashes, categories, takenSlugs, errorList, incremental=True):
+        start       = time.monotonic()
+        pending     = {}
+        unchanged   = 0
+        for item in items:
+            rowHash = self._rowHash(item)
+            if incremental and knownHashes.get(item['itemId']) == rowHash:
+                unchanged += 1
+                continue
+            # a later duplicate of the same POS id within the page wins
+            pending[item['itemId']] = (item, rowHash)
+
+        existing    = {obj.extPosId: obj for obj in Item.objects.filter(extPosId__in=list(pending))} if pending else {}
+        toCreate    = []
+        toUpdate    = []
+        hashOnly    = []
+        links       = []
+        updateFields = set()
+        pageSlugs   = set()
+        for extPosId, (item, rowHash) in pending.items():
+            try:
+                fields, cat1, cat2 = self._mapItem(item, categories, errorList)
+            except Exception as error:
+                errorList.append({"Error":'Item ID = '+str(item['itemId'])+' item Name = '+str(item['itemName'])+', Error: '+str(error)})
+                continue
+
+            obj = existing.get(extPosId)
+            if obj is not None:
+                changed = [field for field, value in fields.items() if getattr(obj, field) != value]
+                obj.syncHash = rowHash
+                if changed:
+                    for field in changed:
+                        setattr(obj, field, fields[field])
+                    toUpdate.append(obj)
+                    updateFields.update(changed)
+                else:
+                    # POS touched fields we do not map; remember the hash without a history row
+                    hashOnly.append(obj)
+                    unchanged += 1
+                continue
+
+            obj = Item(**fields)
+            obj.extPosId        = extPosId
+            obj.slug            = self._uniqueSlug(item['itemName'], takenSlugs | pageSlugs)
+            obj.isNewArrival    = 1
+            obj.newArrivalTill  = datetime.now() + timedelta(days = 7)
+            obj.syncHash        = rowHash
+            pageSlugs.add(obj.slug)
+            toCreate.append(obj)
+            if cat1:
+                links.append(CategoryItem(categoryId=cat1, itemId=obj, level=0))
+            if cat2:
+                links.append(CategoryItem(categoryId=cat2, itemId=obj, level=1))
+
+        try:
+            with transaction.atomic():
+                bulk_create_with_history(toCreate, Item, batch_size=self.BATCH_SIZE)
+                CategoryItem.objects.bulk_create(links, batch_size=self.BATCH_SIZE)
+                if toUpdate:
+                    bulk_update_with_history(toUpdate, Item, sorted(updateFields)+['syncHash'], batch_size=self.BATCH_SIZE)
+                if hashOnly:
+                    Item.objects.bulk_update(hashOnly, ['syncHash'], batch_size=self.BATCH_SIZE)
+        except Exception as error:
+            errorList.append({"Error":'Page = '+str(pageNo)+', Error: '+str(error)})
+            stats = {'page': pageNo, 'created': 0, 'updated': 0, 'unchanged': unchanged, 'failed': len(toCreate)+len(toUpdate)+len(hashOnly),
+                     'seconds': round(time.monotonic()-start, 3)}
+            logger.error("Item Sync Page No: %s failed: %s " %(str(pageNo), str(error)))
+            return stats
+
+        for obj in toCreate+toUpdate+hashOnly:
+            knownHashes[obj.extPosId] = obj.syncHash
+        if toCreate or toUpdate:
+            # bulk writes send no post_save, so keep the search documents in step here
+            try:
+                search.refresh_documents([obj.pk for obj in toCreate+toUpdate])
+            except Exception as error:
+                logger.error("Search document refresh failed for page %s: %s " %(str(pageNo), str(error)))
+            try:
+                listing.refresh_items([obj.pk for obj in toCreate+toUpdate])
+            except Exception as error:
+                logger.error("Listing refresh failed for page %s: %s " %(str(pageNo), str(error)))
+            caching.invalidate(*caching.item_tags([obj.pk for obj in toCreate+toUpdate]))
+        takenSlugs.update(pageSlugs)
+        stats = {'page': pageNo, 'created': len(toCreate), 'updated': len(toUpdate), 'unchanged': unchanged, 'failed': 0,
+                 'seconds': round(time.monotonic()-start, 3)}
+        logger.info("Item Sync Page No: %s created=%s updated=%s unchanged=%s in %ss" %(str(pageNo), stats['created'], stats['updated'], stats['unchanged'], stats['seconds']))
+        return stats
@@ -0,0 +1,3 @@
+# Facet engine: bitset indexes per listing scope, filtered pages with facet counts
+from .index import FacetIndex
+from .service import catalogue_index, category_index, category_page, filters_from_params, search_page
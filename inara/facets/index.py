@@ -0,0 +1,172 @@
+"""
+Columnar facet index over one set of listing rows
+
+Rows are stored as parallel arrays in listing order, and every filterable attribute is a
+bitset (a Python int, bit n = row n): one per manufacturer, one per price bucket and one each
+for in-stock, new arrival and featured. A query ANDs the bitsets of the selected filters,
+counts every facet against the bitsets of the *other* filters (so selecting a manufacturer
+still shows the counts of its siblings) and walks one precomputed order for the page, all
+without touching the database.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+BUCKETS = 10
+MANUFACTURER_LIMIT = 50
+
+# rows handed to FacetIndex carry these keys; 'id' is what the caller loads the page by
+ROW_FIELDS = ('id', 'itemId', 'salePrice', 'manufacturer', 'stock', 'isNewArrival', 'isFeatured',
+              'sortKey', 'featuredKey', 'priceKey')
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def _bitset(positions, size):
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bytes(buffer), 'little')
+
+
+def _step(low, high):
+    # 1/2/5 x 10^n bucket width giving at most BUCKETS buckets
+    span = high - low + 1
+    magnitude = 1
+    while True:
+        for factor in (1, 2, 5):
+            if span / (factor * magnitude) <= BUCKETS:
+                return factor * magnitude
+        magnitude *= 10
+
+
+class FacetIndex(object):
+
+    def __init__(self, rows):
+        # rows: dicts with ROW_FIELDS, already in the default listing order
+        rows = list(rows)
+        self.size = len(rows)
+        self.rowIds = array('q', [row['id'] for row in rows])
+        self.itemIds = array('q', [row['itemId'] for row in rows])
+        self.positions = {itemId: position for position, itemId in enumerate(self.itemIds)}
+        self.all = (1 << self.size) - 1
+
+        manufacturers = {}
+        inStock, newArrival, featured, priced = [], [], [], []
+        for position, row in enumerate(rows):
+            name = (row['manufacturer'] or '').strip()
+            if name:
+                manufacturers.setdefault(name, []).append(position)
+            if row['stock'] is not None and row['stock'] > 0:
+                inStock.append(position)
+            if row['isNewArrival']:
+                newArrival.append(position)
+            if row['isFeatured']:
+                featured.append(position)
+            if row['salePrice'] is not None:
+                priced.append((row['salePrice'], position))
+        self.manufacturers = {name: _bitset(positions, self.size) for name, positions in manufacturers.items()}
+        self.inStock = _bitset(inStock, self.size)
+        self.newArrival = _bitset(newArrival, self.size)
+        self.featured = _bitset(featured, self.size)
+
+        # price range filters bisect the sorted prices; the histogram has one bitset per bucket
+        priced.sort()
+        self.prices = array('q', [price for price, position in priced])
+        self.pricePositions = array('q', [position for price, position in priced])
+        self.buckets = []
+        if priced:
+            low, high = self.prices[0], self.prices[-1]
+            step = _step(low, high)
+            start = (low // step) * step
+            while start <= high:
+                first = bisect_left(self.prices, start)
+                last = bisect_left(self.prices, start + step)
+                self.buckets.append((start, start + step, _bitset(self.pricePositions[first:last], self.size)))
+                start += step
+
+        self.orders = {
+            'default': array('q', range(self.size)),
+            'featured': array('q', sorted(range(self.size), key=lambda position: rows[position]['featuredKey'])),
+            'price_asc': array('q', sorted(range(self.size), key=lambda position: rows[position]['priceKey'])),
+        }
+
+    def __len__(self):
+        return self.size
+
+    def _price_bits(self, low, high):
+        first = 0 if low is None else bisect_left(self.prices, low)
+        last = len(self.prices) if high is None else bisect_right(self.prices, high)
+        return _bitset(self.pricePositions[first:last], self.size)
+
+    def _walk(self, order):
+        if order == 'price_desc':
+            return reversed(self.orders['price_asc'])
+        return self.orders.get(order, self.orders['default'])
+
+    def query(self, filters, order='default', offset=0, limit=9, ranked_ids=None):
+        """
+        Filter, count and page in one pass.
+
+        filters: dict with any of price_min, price_max, manufacturers (a set), in_stock,
+        new_arrival, featured. ranked_ids restricts the rows to those items and, unless an
+        explicit price order is asked for, lists them in the given (relevance) order.
+        Returns {'ids': row ids of the page, 'count': matches, 'facets': {...}}.
+        """
+        base = self.all
+        if ranked_ids is not None:
+            ranked = [self.positions[itemId] for itemId in ranked_ids if itemId in self.positions]
+            base = _bitset(ranked, self.size)
+
+        price = self.all
+        if filters.get('price_min') is not None or filters.get('price_max') is not None:
+            price = self._price_bits(filters.get('price_min'), filters.get('price_max'))
+        manufacturer = self.all
+        if filters.get('manufacturers'):
+            manufacturer = 0
+            for name in filters['manufacturers']:
+                manufacturer |= self.manufacturers.get(name, 0)
+        inStock = self.inStock if filters.get('in_stock') else self.all
+        newArrival = self.newArrival if filters.get('new_arrival') else self.all
+        featured = self.featured if filters.get('featured') else self.all
+
+        flags = base & inStock & newArrival & featured
+        withoutPrice = flags & manufacturer
+        withoutManufacturer = flags & price
+        matched = withoutPrice & price
+
+        manufacturerCounts = []
+        for name, bits in self.manufacturers.items():
+            count = popcount(withoutManufacturer & bits)
+            if count:
+                manufacturerCounts.append({'value': name, 'count': count})
+        manufacturerCounts.sort(key=lambda facet: (-facet['count'], facet['value']))
+
+        others = base & manufacturer & price
+        facets = {
+            'manufacturer': manufacturerCounts[:MANUFACTURER_LIMIT],
+            'priceRange': {'min': self.prices[0], 'max': self.prices[-1]} if self.prices else None,
+            'price': [{'from': low, 'to': high, 'count': popcount(withoutPrice & bits)} for low, high, bits in self.buckets],
+            'inStock': popcount(others & newArrival & featured & self.inStock),
+            'newArrival': popcount(others & inStock & featured & self.newArrival),
+            'featured': popcount(others & inStock & newArrival & self.featured),
+        }
+
+        if ranked_ids is not None and order not in ('price_asc', 'price_desc'):
+            walk = ranked
+        else:
+            walk = self._walk(order)
+        selected = matched.to_bytes((self.size + 7) // 8 or 1, 'little')
+        page = []
+        skipped = 0
+        for position in walk:
+            if not selected[position >> 3] >> (position & 7) & 1:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            page.append(self.rowIds[position])
+            if len(page) >= limit:
+                break
+        return {'ids': page, 'count': popcount(matched), 'facets': facets}
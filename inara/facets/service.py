@@ -0,0 +1,149 @@
+"""
+Facet indexes for category listings and the catalogue search
+
+A FacetIndex is built per scope: one category, one category with everything below it, or the
+whole active catalogue for search results. Indexes are stored in the shared cache under the
+tags of their source rows, so an item change (which rewrites its category_listing rows and
+bumps 'listing:<category id>') makes the next request rebuild them, and each worker keeps the
+unpickled index of its busiest scopes until their version moves on.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from django.conf import settings
+
+from inara.caching import fetch, versioned_key
+from inara.listing import listing_queryset
+from inara.listing.keys import featured_key, price_key, sort_key
+from inara.models import Item
+from .index import ROW_FIELDS, FacetIndex
+
+logger = logging.getLogger(__name__)
+
+# unpickled indexes kept per worker
+LOCAL_LIMIT = getattr(settings, 'FACET_LOCAL_INDEXES', 64)
+CHUNK_SIZE = 2000
+# the catalogue index only follows its facet fields (see catalogue_index); stock quantities,
+# which just order in-stock items among themselves, catch up when it expires
+CATALOGUE_TIMEOUT = getattr(settings, 'FACET_CATALOGUE_TIMEOUT', 3600)
+
+CATALOGUE_FIELDS = ('id', 'salePrice', 'manufacturer', 'stock', 'isNewArrival', 'isFeatured', 'newArrivalTill')
+
+_local = OrderedDict()
+_lock = threading.Lock()
+
+
+def _get_index(name, tags, builder, timeout=None):
+    key = versioned_key(name, tags)
+    with _lock:
+        entry = _local.get(name)
+        if entry is not None and entry[0] == key and (entry[2] is None or time.monotonic() < entry[2]):
+            _local.move_to_end(name)
+            return entry[1]
+    index, current = fetch(name, tags, builder, timeout)
+    if not current:
+        # the previous generation, served while another worker rebuilds: not ours to keep
+        return index
+    with _lock:
+        _local[name] = (key, index, None if timeout is None else time.monotonic() + timeout)
+        _local.move_to_end(name)
+        while len(_local) > LOCAL_LIMIT:
+            _local.popitem(last=False)
+    return index
+
+
+def category_index(category_id, include_descendants=False):
+    """FacetIndex over the listing rows of a category (or its whole subtree), in page order."""
+    if include_descendants:
+        name, tags = 'facets:tree:%s' % category_id, ['listing', 'categories']
+    else:
+        name, tags = 'facets:category:%s' % category_id, ['listing:%s' % category_id]
+
+    def build():
+        rows = listing_queryset(category_id, include_descendants=include_descendants).values(*ROW_FIELDS)
+        return FacetIndex(rows.iterator(chunk_size=CHUNK_SIZE))
+
+    return _get_index(name, tags, build)
+
+
+def _catalogue_row(row):
+    item = SimpleNamespace(**row)
+    return dict(row, itemId=row['id'], sortKey=sort_key(item), featuredKey=featured_key(item), priceKey=price_key(item))
+
+
+def catalogue_index():
+    """
+    FacetIndex over every active item, used to filter and count search results. It is tagged
+    'catalogue', which listing.refresh_items bumps only when an item's price, manufacturer,
+    flags, new arrival date, in-stock state or presence changes, so stock commits that keep an
+    item in stock don't rebuild it; their effect on the default order waits for the timeout.
+    """
+    def build():
+        rows = [_catalogue_row(row) for row in
+                Item.objects.filter(status=Item.ACTIVE).values(*CATALOGUE_FIELDS).iterator(chunk_size=CHUNK_SIZE)]
+        rows.sort(key=lambda row: row['sortKey'])
+        return FacetIndex(rows)
+
+    return _get_index('facets:catalogue', ['catalogue'], build, CATALOGUE_TIMEOUT)
+
+
+def _flag(value):
+    return str(value).lower() in ('1', 'true')
+
+
+def _price(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def filters_from_params(params):
+    """
+    Facet filters from the query string, or None when the request asks for none of them
+    (the listing then pages exactly as before). Recognised: price_min, price_max,
+    manufacturer (repeated or comma separated), in_stock, new_arrival, featured, facets=1.
+    """
+    keys = ('price_min', 'price_max', 'manufacturer', 'in_stock', 'new_arrival', 'featured', 'facets')
+    if not any(key in params for key in keys):
+        return None
+    values = params.getlist('manufacturer') if hasattr(params, 'getlist') else [params.get('manufacturer', '')]
+    manufacturers = set()
+    for value in values:
+        manufacturers.update(name.strip() for name in (value or '').split(',') if name.strip())
+    return {
+        'price_min': _price(params.get('price_min')),
+        'price_max': _price(params.get('price_max')),
+        'manufacturers': manufacturers,
+        'in_stock': _flag(params.get('in_stock', '')),
+        'new_arrival': _flag(params.get('new_arrival', '')),
+        'featured': _flag(params.get('featured', '')),
+    }
+
+
+def _offset(page, page_size):
+    try:
+        page = max(int(page), 1)
+    except (TypeError, ValueError):
+        page = 1
+    return (page - 1) * page_size
+
+
+def category_page(category_id, filters, order='default', page=1, page_size=9, include_descendants=False):
+    """{'ids': listing row ids of the page, 'count', 'facets'} for a filtered category listing."""
+    page_size = int(page_size)
+    index = category_index(category_id, include_descendants)
+    return index.query(filters, order, _offset(page, page_size), page_size)
+
+
+def search_page(filters, item_ids=None, order='default', page=1, page_size=9):
+    """
+    The same for the catalogue: item_ids are the ranked search hits (None lists every active
+    item), and without a price order the hits keep their relevance order.
+    """
+    page_size = int(page_size)
+    index = catalogue_index()
+    return index.query(filters, order, _offset(page, page_size), page_size, ranked_ids=item_ids)
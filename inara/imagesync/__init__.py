@@ -0,0 +1,3 @@
+# Object storage -> Item / ItemGallery image reconciliation
+from .keys import InvalidKey, parse_key
+from .service import get_watermark, list_changes, reconcile
@@ -0,0 +1,28 @@
+"""
+Object storage image keys
+
+An item's main image is stored as <prefix><extPosId>.<ext> and its gallery images as
+<prefix><extPosId>_<suffix>.<ext>, extPosId being the POS id of the item.
+"""
+
+
+class InvalidKey(ValueError):
+    pass
+
+
+def stem(name):
+    # the key without its extension; names never contain a dot before it
+    return name.split('.', 1)[0]
+
+
+def parse_key(key, prefix):
+    """(extPosId, gallery suffix or None for the main image) of an image key under prefix."""
+    name = key[len(prefix):] if key.startswith(prefix) else ''
+    if not name or '/' in name or '(' in name:
+        raise InvalidKey(key)
+    extPosId, separator, suffix = stem(name).partition('_')
+    try:
+        extPosId = int(extPosId)
+    except ValueError:
+        raise InvalidKey(key)
+    return extPosId, (suffix if separator else None)
@@ -0,0 +1,190 @@
+"""
+Object storage image reconciliation
+
+reconcile() lists the image and deleted-image prefixes concurrently, keeping only the keys
+modified since the watermark plus the earlier failures that are due for a retry. Keys are then
+applied a listing page at a time: one extPosId__in query resolves the page's items, one query
+loads their gallery rows, and the changes go out as bulk updates, creates and deletes. Keys
+that can't be applied are recorded in ImageSyncFailure instead of holding the watermark back,
+so every run only looks at what changed since the previous one. Applied images are queued for
+their WebP/AVIF variants (inara.imagevariants).
+"""
+import datetime
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from inara import caching, imagevariants, listing
+from inara.models import Configuration, ImageSyncFailure, Item, ItemGallery
+from .keys import InvalidKey, parse_key, stem
+
+logger = logging.getLogger(__name__)
+
+ITEM_PREFIX = 'idris/asset/'
+DELETE_PREFIX = 'deleted/idris/asset/'
+DEFAULT_IMAGE = 'idris/asset/default-item-image.jpg'
+WATERMARK = 'last_sync_time_item_images'
+EPOCH = datetime.datetime(1900, 3, 2, 0, 0, 0, tzinfo=datetime.timezone.utc)
+PAGE_SIZE = 1000
+MAX_ATTEMPTS = getattr(settings, 'IMAGE_SYNC_MAX_ATTEMPTS', 5)
+
+
+def get_watermark():
+    value = Configuration.objects.filter(name=WATERMARK).values_list('value', flat=True).first()
+    if value is None:
+        Configuration.objects.create(name=WATERMARK, value=EPOCH.isoformat())
+        return EPOCH
+    return datetime.datetime.fromisoformat(value)
+
+
+def _list(client, bucket, prefix, since, retry):
+    found = []
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'] != prefix and (obj['LastModified'] > since or obj['Key'] in retry):
+                found.append((obj['Key'], obj['LastModified']))
+    return found
+
+
+def list_changes(client, bucket, prefixes, since, retry=frozenset()):
+    """[(key, last modified)] per prefix, for the keys changed after since or listed in retry."""
+    with ThreadPoolExecutor(max_workers=len(prefixes)) as pool:
+        futures = [pool.submit(_list, client, bucket, prefix, since, retry) for prefix in prefixes]
+        return [future.result() for future in futures]
+
+
+def _resolve(batch, prefix, action, failures):
+    # [(key, item id, gallery suffix)] for the keys of batch whose item exists
+    parsed = []
+    for key, modified in batch:
+        try:
+            extPosId, suffix = parse_key(key, prefix)
+        except InvalidKey:
+            failures[key] = (action, ImageSyncFailure.INVALID_NAME, None, modified)
+            continue
+        parsed.append((key, modified, extPosId, suffix))
+    items = {}
+    shared = set()
+    for itemId, extPosId in Item.objects.filter(extPosId__in={row[2] for row in parsed}).values_list('id', 'extPosId'):
+        if extPosId in items:
+            shared.add(extPosId)
+        items[extPosId] = itemId
+    resolved = []
+    for key, modified, extPosId, suffix in parsed:
+        if extPosId not in items:
+            failures[key] = (action, ImageSyncFailure.ITEM_NOT_FOUND, None, modified)
+        elif extPosId in shared:
+            failures[key] = (action, ImageSyncFailure.ERROR, "Several items have extPosId %s" % extPosId, modified)
+        else:
+            resolved.append((key, items[extPosId], suffix))
+    return resolved
+
+
+def _changed(item_ids):
+    # bulk writes send no post_save: refresh the listing rows and cached pages ourselves
+    item_ids = list(item_ids)
+    if item_ids:
+        caching.invalidate(*caching.item_tags(item_ids))
+        transaction.on_commit(lambda: listing.refresh_items(item_ids))
+
+
+def _with_images(model, images):
+    # full instances with their new image: the history rows copy every field
+    rows = model.objects.in_bulk(list(images))
+    for rowId, image in images.items():
+        rows[rowId].image = image
+    return list(rows.values())
+
+
+def _apply_upserts(batch, failures):
+    rows = _resolve(batch, ITEM_PREFIX, ImageSyncFailure.UPSERT, failures)
+    main = {itemId: key for key, itemId, suffix in rows if suffix is None}
+    gallery = [(key, itemId) for key, itemId, suffix in rows if suffix is not None]
+    existing = {}
+    for galleryId, image in (ItemGallery.objects.filter(itemId__in={itemId for key, itemId in gallery})
+                             .order_by('id').values_list('id', 'image')):
+        existing.setdefault(stem(image or ''), galleryId)
+    updates, creates = {}, {}
+    for key, itemId in gallery:
+        galleryId = existing.get(stem(key))
+        if galleryId is not None:
+            updates[galleryId] = key
+        else:
+            # a later extension of the same image replaces the earlier one
+            creates[stem(key)] = ItemGallery(itemId_id=itemId, image=key)
+    with transaction.atomic():
+        bulk_update_with_history(_with_images(Item, main), Item, ['image'], batch_size=500)
+        bulk_update_with_history(_with_images(ItemGallery, updates), ItemGallery, ['image'], batch_size=500)
+        created = bulk_create_with_history(list(creates.values()), ItemGallery, batch_size=500)
+        _changed(set(main) | {itemId for key, itemId in gallery})
+        imagevariants.queue('item', list(main))
+        imagevariants.queue('gallery', list(updates) + [row.id for row in created])
+    return len(rows)
+
+
+def _apply_deletes(batch, failures):
+    rows = _resolve(batch, DELETE_PREFIX, ImageSyncFailure.DELETE, failures)
+    main = {itemId for key, itemId, suffix in rows if suffix is None}
+    gallery = {(itemId, os.path.basename(key)) for key, itemId, suffix in rows if suffix is not None}
+    galleryIds = [galleryId for galleryId, itemId, image in
+                  ItemGallery.objects.filter(itemId__in={itemId for itemId, name in gallery}).values_list('id', 'itemId', 'image')
+                  if (itemId, os.path.basename(image or '')) in gallery]
+    with transaction.atomic():
+        if main:
+            bulk_update_with_history(_with_images(Item, dict.fromkeys(main, DEFAULT_IMAGE)), Item, ['image'], batch_size=500)
+            imagevariants.queue('item', list(main))
+        if galleryIds:
+            ItemGallery.objects.filter(id__in=galleryIds).delete()
+        _changed(main | {itemId for itemId, name in gallery})
+    return len(rows)
+
+
+def _apply(apply, batch, action, failures):
+    try:
+        return apply(batch, failures)
+    except Exception as e:
+        logger.error("Exception in image reconciliation: %s " %(str(e)))
+        for key, modified in batch:
+            failures.setdefault(key, (action, ImageSyncFailure.ERROR, str(e), modified))
+        return 0
+
+
+def _record(failures, previous):
+    now = timezone.now()
+    rows = [ImageSyncFailure(key=key, action=action, reason=reason, detail=detail, lastModified=modified,
+                             attempts=previous.get(key, 0) + 1, updatedAt=now)
+            for key, (action, reason, detail, modified) in failures.items()]
+    ImageSyncFailure.objects.bulk_create(rows, batch_size=500, update_conflicts=True, unique_fields=['key'],
+                                         update_fields=['action', 'reason', 'detail', 'attempts', 'lastModified', 'updatedAt'])
+
+
+def reconcile(client, bucket):
+    """
+    Apply the image changes in bucket since the last run and move the watermark on. Returns
+    {'applied': keys applied, 'failures': {key: (action, reason, detail, last modified)},
+    'resolved': earlier failures cleared}.
+    """
+    started = timezone.now()
+    since = get_watermark()
+    previous = dict(ImageSyncFailure.objects.filter(attempts__lt=MAX_ATTEMPTS).values_list('key', 'attempts'))
+    deleted, upserted = list_changes(client, bucket, [DELETE_PREFIX, ITEM_PREFIX], since, frozenset(previous))
+    failures = {}
+    applied = 0
+    # deletions first, so an image removed and uploaded again ends up present
+    for changes, apply, action in ((deleted, _apply_deletes, ImageSyncFailure.DELETE),
+                                   (upserted, _apply_upserts, ImageSyncFailure.UPSERT)):
+        for start in range(0, len(changes), PAGE_SIZE):
+            applied += _apply(apply, changes[start:start + PAGE_SIZE], action, failures)
+    # retried successfully, or no longer in storage
+    resolved = [key for key in previous if key not in failures]
+    for start in range(0, len(resolved), PAGE_SIZE):
+        ImageSyncFailure.objects.filter(key__in=resolved[start:start + PAGE_SIZE]).delete()
+    _record(failures, previous)
+    Configuration.objects.filter(name=WATERMARK).update(value=started.isoformat())
+    logger.info("Image reconciliation since %s: applied=%s failed=%s resolved=%s" % (since, applied, len(failures), len(resolved)))
+    return {'applied': applied, 'failures': failures, 'resolved': len(resolved)}
@@ -0,0 +1,2 @@
+# Responsive WebP/AVIF renditions of item and gallery images
+from .service import current, dispatch, generate, generate_many, queue, render
@@ -0,0 +1,190 @@
+"""
+Responsive image variants
+
+Listing and product pages used to download the original Item / ItemGallery upload, often
+several MB. generate() renders a row's image once per IMAGE_VARIANT_WIDTHS width (never
+upscaling) in every IMAGE_VARIANT_FORMATS format and stores
+
+    {'source': image name, 'digest': ..., 'files': [...], 'webp': {'320': url, ...}, 'avif': {...}}
+
+in its imageVariants column; serializers expose the URLs through current(). Variant names
+carry a digest of the source bytes, so a re-uploaded image gets new URLs and cached copies
+never go stale, and identical sources (the default image) share one set of files.
+
+queue() hands row ids to the generate_image_variants Celery task once the current transaction
+commits. Encoding is CPU bound, so the task is routed to the IMAGE_VARIANTS_QUEUE queue served
+by a prefork (process pool) worker. With IMAGE_VARIANTS_ASYNC = False the variants are rendered
+in-process after commit instead.
+"""
+import hashlib
+import io
+import logging
+import os
+
+import boto3
+import environ
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, features
+
+from inara import caching, listing
+from inara.models import Item, ItemGallery
+
+logger = logging.getLogger(__name__)
+env = environ.Env()
+
+WIDTHS = tuple(getattr(settings, 'IMAGE_VARIANT_WIDTHS', (160, 320, 640, 1024)))
+FORMATS = tuple(getattr(settings, 'IMAGE_VARIANT_FORMATS', ('webp', 'avif')))
+SAVE_OPTIONS = {
+    'webp': {'quality': 80, 'method': 6},
+    'avif': {'quality': 55, 'speed': 6},
+}
+DIRECTORY = getattr(settings, 'IMAGE_VARIANTS_DIRECTORY', 'variants')
+TASK_BATCH = 50
+
+MODELS = {'item': Item, 'gallery': ItemGallery}
+
+_client = None
+
+
+def _async():
+    return getattr(settings, 'IMAGE_VARIANTS_ASYNC', True)
+
+
+def formats():
+    return [fmt for fmt in FORMATS if features.check(fmt)]
+
+
+def current(name, variants):
+    """{format: {width: url}} of variants when they were rendered from image name, else None."""
+    if not name or not variants or variants.get('source') != name:
+        return None
+    return {fmt: variants[fmt] for fmt in FORMATS if fmt in variants}
+
+
+def _bucket_client():
+    global _client
+    if _client is None:
+        _client = boto3.client("s3", aws_access_key_id=env('AWS_ACCESS_KEY_ID'),
+                               aws_secret_access_key=env('AWS_SECRET_ACCESS_KEY'), endpoint_url=env('AWS_S3_CUSTOM_DOMAIN'))
+    return _client
+
+
+def _read(name):
+    if default_storage.exists(name):
+        with default_storage.open(name, 'rb') as source:
+            return source.read()
+    # keys applied by the object storage sync (inara.imagesync) only exist in the bucket
+    return _bucket_client().get_object(Bucket=env('AWS_STORAGE_BUCKET_NAME'), Key=name)['Body'].read()
+
+
+def _prepare(data):
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if image.mode not in ('RGB', 'RGBA'):
+        hasAlpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if hasAlpha else 'RGB')
+    return image
+
+
+def render(name, data):
+    """Write the variants of image name (its bytes in data) to storage and return their description."""
+    digest = hashlib.sha1(data).hexdigest()[:12]
+    image = _prepare(data)
+    stem = os.path.splitext(os.path.basename(name))[0]
+    widths = [width for width in WIDTHS if width < image.width]
+    if len(widths) < len(WIDTHS):
+        # too small for the larger widths: its own width stands in for them
+        widths.append(image.width)
+    variants = {'source': name, 'digest': digest, 'files': []}
+    for width in widths:
+        resized = image
+        if width != image.width:
+            resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS, reducing_gap=3.0)
+        for fmt in formats():
+            path = '%s/%s-%s-%s.%s' % (DIRECTORY, stem, digest, width, fmt)
+            if not default_storage.exists(path):
+                buffer = io.BytesIO()
+                resized.save(buffer, fmt.upper(), **SAVE_OPTIONS.get(fmt, {}))
+                path = default_storage.save(path, ContentFile(buffer.getvalue()))
+            variants['files'].append(path)
+            variants.setdefault(fmt, {})[str(width)] = default_storage.url(path)
+    return variants
+
+
+def _release(variants, kept):
+    # files are named after the content digest and shared by every row rendered from the same
+    # bytes; they go once no row's variants point at that digest any more (the row being
+    # rendered already holds its new ones, so a re-uploaded key does not keep its old files)
+    stale = [path for path in (variants or {}).get('files', []) if path not in kept]
+    if not stale:
+        return
+    digest = variants.get('digest')
+    if any(model.objects.filter(imageVariants__digest=digest).exists() for model in MODELS.values()):
+        return
+    for path in stale:
+        default_storage.delete(path)
+
+
+def _changed(kind, pk):
+    if kind == 'gallery':
+        itemIds = list(ItemGallery.objects.filter(id=pk, itemId__isnull=False).values_list('itemId_id', flat=True))
+    else:
+        itemIds = [pk]
+    if itemIds:
+        caching.invalidate(*caching.item_tags(itemIds))
+    if kind == 'item':
+        transaction.on_commit(lambda: listing.refresh_items(itemIds))
+
+
+def generate(kind, pk):
+    """Render the variants of one Item ('item') or ItemGallery ('gallery') row; returns them."""
+    model = MODELS[kind]
+    row = model.objects.filter(id=pk).values('image', 'imageVariants').first()
+    if row is None or not row['image']:
+        return None
+    name, previous = row['image'], row['imageVariants']
+    data = _read(name)
+    if previous and previous.get('source') == name and previous.get('digest') == hashlib.sha1(data).hexdigest()[:12]:
+        return previous
+    variants = render(name, data)
+    # the image may have been replaced while this one was rendering; its own run takes over
+    if not model.objects.filter(id=pk, image=name).update(imageVariants=variants):
+        return None
+    _changed(kind, pk)
+    _release(previous, set(variants['files']))
+    return variants
+
+
+def generate_many(kind, ids):
+    """Render the variants of every row in ids; returns the ids that failed."""
+    failed = []
+    for pk in ids:
+        try:
+            generate(kind, pk)
+        except Exception as e:
+            logger.error("Exception in image variants of %s %s: %s " % (kind, pk, str(e)))
+            failed.append(pk)
+    return failed
+
+
+def dispatch(kind, ids):
+    """Hand rows to the worker; if the broker is down they keep serving the original image."""
+    ids = list(ids)
+    if not _async():
+        generate_many(kind, ids)
+        return
+    try:
+        from ecommerce_backend.tasks import generate_image_variants
+        for start in range(0, len(ids), TASK_BATCH):
+            generate_image_variants.delay(kind, ids[start:start + TASK_BATCH])
+    except Exception as e:
+        logger.error("Exception in image variants dispatch: %s " % (str(e)))
+
+
+def queue(kind, ids):
+    """Render the variants of the given rows once the current transaction commits."""
+    ids = [pk for pk in ids if pk]
+    if ids:
+        transaction.on_commit(lambda: dispatch(kind, ids))
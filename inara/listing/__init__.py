@@ -0,0 +1,3 @@
+# Category listing read model: maintenance and keyset paging
+from .service import (ORDERINGS, decode_cursor, encode_cursor, listing_count, listing_queryset, page, rebuild,
+                      refresh_items)
@@ -0,0 +1,52 @@
+"""
+Sort keys for the category listing read model
+
+Each key is a fixed-width string whose ascending order equals the listing order, with the item
+id appended so keys are unique and can be used directly as keyset cursors. NULLs in descending
+columns sort first and NULL prices sort last ascending, as Postgres orders them in the
+ORDER BY clauses the listing views used before.
+"""
+TIME_MAX = 9999999999
+DECIMAL_OFFSET = 10 ** 13
+PRICE_OFFSET = 10 ** 11
+
+
+def _id(item_id):
+    return '%019d' % item_id
+
+
+def _desc_time(value):
+    if value is None:
+        return '0' * 10
+    return '%010d' % (TIME_MAX - min(max(int(value.timestamp()), 0), TIME_MAX))
+
+
+def _desc_flag(value):
+    return '0' if value else '1'
+
+
+def _desc_decimal(value):
+    if value is None:
+        return '0' * 14
+    return '%014d' % (DECIMAL_OFFSET - int(round(value * 100)))
+
+
+def _asc_price(value):
+    if value is None:
+        return '9' * 12
+    return '%012d' % (PRICE_OFFSET + value)
+
+
+def sort_key(item):
+    """-newArrivalTill, -isFeatured, -stock: the category page order."""
+    return _desc_time(item.newArrivalTill) + _desc_flag(item.isFeatured) + _desc_decimal(item.stock) + _id(item.id)
+
+
+def featured_key(item):
+    """-isFeatured, -newArrivalTill, -stock: the homepage section order."""
+    return _desc_flag(item.isFeatured) + _desc_time(item.newArrivalTill) + _desc_decimal(item.stock) + _id(item.id)
+
+
+def price_key(item):
+    """salePrice ascending; read backwards for price_desc."""
+    return _asc_price(item.salePrice) + _id(item.id)
@@ -0,0 +1,183 @@
+"""
+Category listing read model
+
+CategoryListing holds one narrow row per (category, item) for every active CategoryItem link
+to an active item. Rows are rebuilt per item whenever the item or its links change (signals,
+POS sync), and category pages read them with a single range scan on (categoryId, key).
+"""
+import base64
+import binascii
+import logging
+
+from django.db import connection, transaction
+from django.db.models import Min
+
+from inara import caching
+from inara.models import CategoryClosure, CategoryItem, CategoryListing, Item
+from .keys import featured_key, price_key, sort_key
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2000
+
+LISTING_FIELDS = ('extPosId', 'sku', 'slug', 'name', 'description', 'mrp', 'salePrice', 'discount', 'stock',
+                  'stockCheckQty', 'weight', 'image', 'imageVariants', 'status', 'appliesOnline', 'isNewArrival', 'isFeatured',
+                  'newArrivalTill', 'manufacturer', 'aliasCode', 'metaTitle', 'metaDescription', 'timestamp')
+
+# sort option -> (key column, descending)
+ORDERINGS = {
+    'default': ('sortKey', False),
+    'featured': ('featuredKey', False),
+    'price_asc': ('priceKey', False),
+    'price_desc': ('priceKey', True),
+}
+
+
+def _build_rows(item_ids):
+    links = {}
+    for categoryId, itemId in (CategoryItem.objects
+                               .filter(itemId__in=item_ids, status=CategoryItem.ACTIVE, categoryId__isnull=False)
+                               .values_list('categoryId_id', 'itemId_id').distinct()):
+        links.setdefault(itemId, []).append(categoryId)
+    rows = []
+    for item in Item.objects.filter(id__in=list(links), status=Item.ACTIVE).only('id', *LISTING_FIELDS):
+        values = {field: getattr(item, field) for field in LISTING_FIELDS}
+        keys = {'sortKey': sort_key(item), 'featuredKey': featured_key(item), 'priceKey': price_key(item)}
+        for categoryId in links[item.id]:
+            rows.append(CategoryListing(categoryId_id=categoryId, itemId_id=item.id, **keys, **values))
+    return rows
+
+
+ROW_FIELDS = ('categoryId_id', 'itemId_id', 'sortKey', 'featuredKey', 'priceKey') + LISTING_FIELDS
+IMAGE = ROW_FIELDS.index('image')
+
+
+def _comparable(values):
+    # keyed by (category, item); an empty image may be stored as NULL or ''
+    return values[:2], values[:IMAGE] + (values[IMAGE] or None,) + values[IMAGE + 1:]
+
+
+# what the catalogue facet index (inara.facets) reads of an item; stock only as in stock or not
+CATALOGUE_FIELDS = ('salePrice', 'manufacturer', 'isNewArrival', 'isFeatured', 'newArrivalTill')
+
+
+def _catalogue_values(rows):
+    # {item id: catalogue facet values} from listing rows in ROW_FIELDS order
+    positions = [ROW_FIELDS.index(field) for field in CATALOGUE_FIELDS]
+    stock = ROW_FIELDS.index('stock')
+    return {values[1]: tuple(values[position] for position in positions) + (values[stock] is not None and values[stock] > 0,)
+            for values in rows}
+
+
+def _row_values(row):
+    return _comparable(tuple(getattr(row, field).name if field == 'image' else getattr(row, field) for field in ROW_FIELDS))
+
+
+def refresh_items(item_ids):
+    """Rebuild the listing rows of the given items; returns the number of rows written."""
+    item_ids = list(set(item_ids))
+    if not item_ids:
+        return 0
+    with transaction.atomic():
+        # row locks serialise concurrent refreshes of the same item (no-op on SQLite)
+        list(Item.objects.select_for_update().filter(id__in=item_ids).values_list('id', flat=True))
+        stale = CategoryListing.objects.filter(itemId__in=item_ids)
+        current = dict(_comparable(values) for values in stale.values_list(*ROW_FIELDS))
+        rows = _build_rows(item_ids)
+        if current and current == dict(_row_values(row) for row in rows):
+            # nothing the listing shows has changed (gallery, reservations...): keep
+            # the rows and the facet indexes built from them
+            return 0
+        categoryIds = {categoryId for categoryId, _ in current}
+        stale.delete()
+        CategoryListing.objects.bulk_create(rows, batch_size=1000)
+        categoryIds.update(row.categoryId_id for row in rows)
+        # facet indexes are tagged with the listing rows they were built from
+        tags = ['listing'] + ['listing:%s' % categoryId for categoryId in categoryIds]
+        before = _catalogue_values(current.values())
+        after = _catalogue_values(_row_values(row)[1] for row in rows)
+        # the catalogue index only moves with its own fields; items without listing rows on
+        # either side can't be compared and count as changed
+        if before != after or not set(item_ids) <= set(before) | set(after):
+            tags.append('catalogue')
+        caching.invalidate(*tags)
+    return len(rows)
+
+
+def rebuild():
+    """Rebuild the whole read model in item id chunks; returns the number of rows written."""
+    count = 0
+    lastId = 0
+    while True:
+        ids = list(Item.objects.filter(id__gt=lastId).order_by('id').values_list('id', flat=True)[:CHUNK_SIZE])
+        if not ids:
+            break
+        count += refresh_items(ids)
+        lastId = ids[-1]
+    return count
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(key.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Key of an opaque cursor, or None when it is missing or malformed (first page)."""
+    if not cursor:
+        return None
+    try:
+        return base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+
+
+def _subtree_rows(category_id, online_only):
+    subtree = CategoryClosure.objects.filter(ancestorId_id=category_id).values('descendantId')
+    queryset = CategoryListing.objects.filter(categoryId__in=subtree)
+    if online_only:
+        queryset = queryset.filter(appliesOnline=1)
+    return queryset
+
+
+def listing_queryset(category_id, order='default', online_only=False, include_descendants=False):
+    """
+    Listing rows of a category in display order. With include_descendants the rows of every
+    category below it are merged, one row per item, in the same single statement.
+    """
+    column, descending = ORDERINGS.get(order, ORDERINGS['default'])
+    ordering = '-' + column if descending else column
+    if not include_descendants:
+        queryset = CategoryListing.objects.filter(categoryId_id=category_id)
+        if online_only:
+            queryset = queryset.filter(appliesOnline=1)
+        return queryset.order_by(ordering)
+    queryset = _subtree_rows(category_id, online_only)
+    if connection.vendor == 'postgresql':
+        # keys are unique per item, so DISTINCT ON the sort key drops the duplicate category rows
+        return queryset.order_by(ordering).distinct(column)
+    firstRows = queryset.values('itemId').annotate(firstId=Min('id')).values('firstId')
+    return CategoryListing.objects.filter(id__in=firstRows).order_by(ordering)
+
+
+def listing_count(category_id, online_only=False, include_descendants=False):
+    if not include_descendants:
+        return listing_queryset(category_id, online_only=online_only).count()
+    return _subtree_rows(category_id, online_only).values('itemId').distinct().count()
+
+
+def page(category_id, order='default', cursor=None, limit=9, online_only=False, include_descendants=False):
+    """
+    One keyset page of a category listing: (rows, next_cursor). next_cursor is None on the
+    last page.
+    """
+    column, descending = ORDERINGS.get(order, ORDERINGS['default'])
+    queryset = listing_queryset(category_id, order, online_only, include_descendants)
+    after = decode_cursor(cursor)
+    if after is not None:
+        queryset = queryset.filter(**{column + ('__lt' if descending else '__gt'): after})
+    rows = list(queryset[:limit + 1])
+    nextCursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        nextCursor = encode_cursor(getattr(rows[-1], column))
+    return rows, nextCursor
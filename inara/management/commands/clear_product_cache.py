@@ -1,23 +1,31 @@
 """
 Management command to clear product cache.
-Run: python manage.py clear_product_cache
+Run: python manage.py clear_product_cache [--tag items --tag homepage] [--all]
 """
 from django.core.management.base import BaseCommand
 from django.core.cache import cache
+from inara import caching
+
+PRODUCT_TAGS = ['items', 'categories', 'homepage', 'bundles', 'site_settings', 'reviews', 'sliders']
 
 class Command(BaseCommand):
-    help = 'Clears all product-related cache entries'
+    help = 'Invalidates product-related cache entries by bumping their cache tags'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tag', action='append', dest='tags', help='Only invalidate the given tag (repeatable)')
+        parser.add_argument('--all', action='store_true', help='Flush the whole cache backend, including sessions and locks')
 
     def handle(self, *args, **options):
-        self.stdout.write(self.style.WARNING('Clearing product cache...'))
-        
-        # Clear all cache entries with the prefix
         try:
-            # If using Redis, we can clear specific keys
-            # For now, clear all cache (you can make this more specific)
-            cache.clear()
+            if options['all']:
+                self.stdout.write(self.style.WARNING('Flushing the whole cache...'))
+                cache.clear()
+            else:
+                tags = options['tags'] or PRODUCT_TAGS
+                self.stdout.write(self.style.WARNING('Invalidating cache tags: %s' % ', '.join(tags)))
+                # run outside a transaction, so the bump happens immediately
+                caching.invalidate(*tags)
             self.stdout.write(self.style.SUCCESS('Product cache cleared successfully!'))
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error clearing cache: {str(e)}'))
             self.stdout.write(self.style.WARNING('You may need to restart Redis or clear cache manually'))
-
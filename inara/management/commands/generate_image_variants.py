@@ -0,0 +1,32 @@
+"""
+Management command to render the WebP/AVIF variants of item and gallery images.
+Run: python manage.py generate_image_variants [--all] [--async]
+"""
+from django.core.management.base import BaseCommand
+
+from inara import imagevariants
+from inara.imagevariants.service import MODELS, TASK_BATCH
+
+
+class Command(BaseCommand):
+    help = 'Renders the image variants of every Item and ItemGallery row that has none yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-check every row, not only the ones without variants')
+        parser.add_argument('--async', dest='background', action='store_true', help='Queue the rows on the Celery workers')
+
+    def handle(self, *args, **options):
+        for kind, model in MODELS.items():
+            queryset = model.objects.exclude(image__isnull=True).exclude(image='')
+            if not options['all']:
+                queryset = queryset.filter(imageVariants__isnull=True)
+            ids = list(queryset.order_by('id').values_list('id', flat=True))
+            self.stdout.write(self.style.SUCCESS('%s: %s rows' % (kind, len(ids))))
+            failed = 0
+            for start in range(0, len(ids), TASK_BATCH):
+                batch = ids[start:start + TASK_BATCH]
+                if options['background']:
+                    imagevariants.dispatch(kind, batch)
+                else:
+                    failed += len(imagevariants.generate_many(kind, batch))
+            self.stdout.write(self.style.SUCCESS('%s: done, %s failed' % (kind, failed)))
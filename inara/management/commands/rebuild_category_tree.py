@@ -0,0 +1,16 @@
+"""
+Management command to rebuild the category closure table.
+Run: python manage.py rebuild_category_tree
+"""
+from django.core.management.base import BaseCommand
+
+from inara import categories
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds CategoryClosure from Category.parentId'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Rebuilding category closure...'))
+        count = categories.rebuild_closure()
+        self.stdout.write(self.style.SUCCESS('Wrote %s closure rows' % count))
@@ -0,0 +1,16 @@
+"""
+Management command to (re)build the category listing read model.
+Run: python manage.py rebuild_listings
+"""
+from django.core.management.base import BaseCommand
+
+from inara import listing
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the CategoryListing rows of every item'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Rebuilding category listings...'))
+        count = listing.rebuild()
+        self.stdout.write(self.style.SUCCESS('Wrote %s listing rows' % count))
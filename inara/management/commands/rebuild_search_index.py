@@ -0,0 +1,16 @@
+"""
+Management command to (re)build the item search documents.
+Run: python manage.py rebuild_search_index
+"""
+from django.core.management.base import BaseCommand
+
+from inara import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the search document of every item'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Rebuilding search documents (%s backend)...' % search.backend()))
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Indexed %s items' % count))
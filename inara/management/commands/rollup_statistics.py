@@ -0,0 +1,26 @@
+"""
+Management command to backfill the daily sales rollups behind the admin dashboard.
+Run: python manage.py rollup_statistics [--from 2024-01-01] [--to 2024-12-31]
+"""
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from inara import rollups
+
+
+def _date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the DailySales and DailyItemSales rows from the orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='first', type=_date, default=None, help='First day (YYYY-MM-DD), default the oldest order')
+        parser.add_argument('--to', dest='last', type=_date, default=None, help='Last day (YYYY-MM-DD), default today')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Rolling up daily sales...'))
+        count = rollups.rebuild(options['first'], options['last'])
+        self.stdout.write(self.style.SUCCESS('Wrote %s days' % count))
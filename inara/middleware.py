@@ -1,6 +1,7 @@
 from django.utils.deprecation import MiddlewareMixin
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import UntypedToken
-from inara.models import TokenBlacklist
+from inara import blacklist
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.renderers import JSONRenderer
@@ -11,14 +12,14 @@ class TokenBlacklistMiddleware(MiddlewareMixin):
 
     def process_request(self, request):
         try:
-            token = request.headers['Authorization'].split()[1]
-            UntypedToken(token)
+            token = UntypedToken(request.headers['Authorization'].split()[1])
         except KeyError:
             return None
         except Exception:
             return None
 
-        if TokenBlacklist.objects.filter(token=token).exists():
+        # answered from the per-process bloom filter unless the jti might be revoked
+        if blacklist.is_blacklisted(token.get(api_settings.JTI_CLAIM)):
             response = Response({'error': 'Invalid token. Please log in again.'}, status=status.HTTP_401_UNAUTHORIZED)
             response.accepted_renderer = JSONRenderer()
             response.accepted_media_type = "application/json"
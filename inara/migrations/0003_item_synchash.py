@@ -0,0 +1,23 @@
+# Generated by Django 4.1 on 2026-10-16 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0002_blogpost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalitem',
+            name='syncHash',
+            field=models.CharField(max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='syncHash',
+            field=models.CharField(max_length=40, null=True),
+        ),
+    ]
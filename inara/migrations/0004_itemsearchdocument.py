@@ -0,0 +1,52 @@
+# Generated by Django 4.1 on 2026-10-16 19:28
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class AddPostgresIndex(migrations.AddIndex):
+    # GIN indexes only exist on Postgres; SQLite dev databases keep the model state only.
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0003_item_synchash'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='ItemSearchDocument',
+            fields=[
+                ('itemId', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='inara.item')),
+                ('title', models.CharField(max_length=150)),
+                ('body', models.CharField(max_length=500, null=True)),
+                ('document', models.TextField()),
+                ('searchVector', django.contrib.postgres.search.SearchVectorField(null=True)),
+                ('updatedAt', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'item_search_document',
+            },
+        ),
+        AddPostgresIndex(
+            model_name='itemsearchdocument',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['searchVector'], name='item_search_vector_idx'),
+        ),
+        AddPostgresIndex(
+            model_name='itemsearchdocument',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['document'], name='item_search_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
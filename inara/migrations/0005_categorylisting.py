@@ -0,0 +1,106 @@
+# Generated by Django 4.1 on 2026-10-16 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from inara.listing.keys import featured_key, price_key, sort_key
+
+LISTING_FIELDS = ('extPosId', 'sku', 'slug', 'name', 'description', 'mrp', 'salePrice', 'discount', 'stock',
+                  'stockCheckQty', 'weight', 'image', 'status', 'appliesOnline', 'isNewArrival', 'isFeatured',
+                  'newArrivalTill', 'manufacturer', 'aliasCode', 'metaTitle', 'metaDescription', 'timestamp')
+
+
+def populate_listings(apps, schema_editor):
+    # initial fill of the read model; later changes are applied by inara.listing
+    Item = apps.get_model('inara', 'Item')
+    CategoryItem = apps.get_model('inara', 'CategoryItem')
+    CategoryListing = apps.get_model('inara', 'CategoryListing')
+    links = {}
+    for categoryId, itemId in (CategoryItem.objects.filter(status=1, categoryId__isnull=False, itemId__isnull=False)
+                               .values_list('categoryId_id', 'itemId_id').distinct()):
+        links.setdefault(itemId, []).append(categoryId)
+    rows = []
+    for item in Item.objects.filter(id__in=list(links), status=1).only('id', *LISTING_FIELDS).iterator(chunk_size=2000):
+        values = {field: getattr(item, field) for field in LISTING_FIELDS}
+        keys = {'sortKey': sort_key(item), 'featuredKey': featured_key(item), 'priceKey': price_key(item)}
+        for categoryId in links[item.id]:
+            rows.append(CategoryListing(categoryId_id=categoryId, itemId_id=item.id, **keys, **values))
+        if len(rows) >= 2000:
+            CategoryListing.objects.bulk_create(rows)
+            rows = []
+    CategoryListing.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0004_itemsearchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryListing',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('sortKey', models.CharField(max_length=64)),
+                ('featuredKey', models.CharField(max_length=64)),
+                ('priceKey', models.CharField(max_length=64)),
+                ('extPosId', models.IntegerField()),
+                ('sku', models.CharField(max_length=100)),
+                ('slug', models.CharField(max_length=150)),
+                ('name', models.CharField(max_length=150)),
+                ('description', models.CharField(max_length=2000, null=True)),
+                ('mrp', models.IntegerField(null=True)),
+                ('salePrice', models.IntegerField(null=True)),
+                ('discount', models.IntegerField(default=0)),
+                ('stock', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('stockCheckQty', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('weight', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('image', models.ImageField(null=True, upload_to='item_image')),
+                ('status', models.IntegerField(default=1)),
+                ('appliesOnline', models.IntegerField(default=0)),
+                ('isNewArrival', models.IntegerField(default=0)),
+                ('isFeatured', models.IntegerField(default=0)),
+                ('newArrivalTill', models.DateTimeField(null=True)),
+                ('manufacturer', models.CharField(max_length=150, null=True)),
+                ('aliasCode', models.CharField(max_length=100, null=True)),
+                ('metaTitle', models.CharField(max_length=150, null=True)),
+                ('metaDescription', models.CharField(max_length=500, null=True)),
+                ('timestamp', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'category_listing',
+            },
+        ),
+        migrations.AddField(
+            model_name='categorylisting',
+            name='categoryId',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listings', to='inara.category'),
+        ),
+        migrations.AddField(
+            model_name='categorylisting',
+            name='itemId',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listings', to='inara.item'),
+        ),
+        migrations.AddIndex(
+            model_name='categorylisting',
+            index=models.Index(fields=['categoryId', 'sortKey'], name='listing_cat_sort_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='categorylisting',
+            index=models.Index(fields=['categoryId', 'featuredKey'], name='listing_cat_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='categorylisting',
+            index=models.Index(fields=['categoryId', 'priceKey'], name='listing_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='categorylisting',
+            index=models.Index(fields=['itemId'], name='listing_item_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='categorylisting',
+            constraint=models.UniqueConstraint(fields=('categoryId', 'itemId'), name='listing_cat_item_uniq'),
+        ),
+        migrations.RunPython(populate_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1 on 2026-10-16 19:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0005_categorylisting'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['-newArrivalTill', '-isFeatured', '-stock', 'id'], name='item_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-timestamp', 'id'], name='order_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.1 on 2026-10-16 19:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_closure(apps, schema_editor):
+    # initial fill; later changes are applied by inara.categories
+    Category = apps.get_model('inara', 'Category')
+    CategoryClosure = apps.get_model('inara', 'CategoryClosure')
+    parents = dict(Category.objects.values_list('id', 'parentId_id'))
+    rows = []
+    for categoryId in parents:
+        rows.append(CategoryClosure(ancestorId_id=categoryId, descendantId_id=categoryId, depth=0))
+        seen = {categoryId}
+        parentId, depth = parents[categoryId], 1
+        while parentId is not None and parentId in parents and parentId not in seen:
+            rows.append(CategoryClosure(ancestorId_id=parentId, descendantId_id=categoryId, depth=depth))
+            seen.add(parentId)
+            parentId, depth = parents[parentId], depth + 1
+    CategoryClosure.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0006_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('depth', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'category_closure',
+            },
+        ),
+        migrations.AddField(
+            model_name='categoryclosure',
+            name='ancestorId',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='closure_descendants', to='inara.category'),
+        ),
+        migrations.AddField(
+            model_name='categoryclosure',
+            name='descendantId',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='closure_ancestors', to='inara.category'),
+        ),
+        migrations.AddIndex(
+            model_name='categoryclosure',
+            index=models.Index(fields=['descendantId', 'depth'], name='closure_desc_depth_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='categoryclosure',
+            constraint=models.UniqueConstraint(fields=('ancestorId', 'descendantId'), name='closure_anc_desc_uniq'),
+        ),
+        migrations.RunPython(populate_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.1 on 2026-10-16 19:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0007_categoryclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailOutbox',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('ORDER_CONFIRMATION', 'ORDER_CONFIRMATION'), ('ORDER_ALERT', 'ORDER_ALERT')], max_length=30)),
+                ('subject', models.CharField(max_length=255)),
+                ('fromEmail', models.CharField(max_length=150)),
+                ('recipients', models.TextField()),
+                ('body', models.TextField(default='')),
+                ('htmlBody', models.TextField(blank=True, null=True)),
+                ('status', models.IntegerField(choices=[(1, 'PENDING'), (2, 'SENT'), (3, 'FAILED')], default=1)),
+                ('attempts', models.IntegerField(default=0)),
+                ('lastError', models.TextField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sentAt', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'email_outbox',
+            },
+        ),
+        migrations.AddField(
+            model_name='emailoutbox',
+            name='orderId',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='emails', to='inara.order'),
+        ),
+        migrations.AddIndex(
+            model_name='emailoutbox',
+            index=models.Index(fields=['status', 'id'], name='email_outbox_status_idx'),
+        ),
+    ]
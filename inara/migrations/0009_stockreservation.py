@@ -0,0 +1,55 @@
+# Generated by Django 4.1 on 2026-10-16 19:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0008_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('qty', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('status', models.IntegerField(choices=[(1, 'ACTIVE'), (2, 'RELEASED'), (3, 'COMMITTED')], default=1)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'stock_reservation',
+            },
+        ),
+        migrations.AddField(
+            model_name='historicalitem',
+            name='reservedStock',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='reservedStock',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='stockreservation',
+            name='itemId',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='inara.item'),
+        ),
+        migrations.AddField(
+            model_name='stockreservation',
+            name='orderId',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='inara.order'),
+        ),
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['orderId', 'status'], name='reservation_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['status', 'timestamp'], name='reservation_expiry_idx'),
+        ),
+    ]
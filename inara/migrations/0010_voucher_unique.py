@@ -0,0 +1,51 @@
+# Generated by Django 4.1 on 2026-10-16 19:55
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def dedupe_vouchers(apps, schema_editor):
+    # the lookups used .get(), so duplicates were never usable; keep the first of each
+    Voucher = apps.get_model('inara', 'Voucher')
+    UserVoucher = apps.get_model('inara', 'UserVoucher')
+    duplicates = (UserVoucher.objects.values('user', 'voucher').annotate(first=Min('id'), rows=Count('id'))
+                  .filter(rows__gt=1))
+    for row in duplicates:
+        rows = UserVoucher.objects.filter(user=row['user'], voucher=row['voucher'])
+        used = rows.filter(isused=True).exists()
+        rows.exclude(id=row['first']).delete()
+        UserVoucher.objects.filter(id=row['first']).update(isused=used)
+    maxLength = Voucher._meta.get_field('code').max_length
+    taken = set(Voucher.objects.values_list('code', flat=True))
+    codes = Voucher.objects.values('code').annotate(first=Min('id'), rows=Count('id')).filter(rows__gt=1)
+    for row in codes:
+        for voucher in Voucher.objects.filter(code=row['code']).exclude(id=row['first']):
+            # '<code>-<id>', cut to fit, counting on while another voucher already has it
+            suffix, attempt = '-%s' % voucher.id, 1
+            code = voucher.code[:maxLength - len(suffix)] + suffix
+            while code in taken:
+                attempt += 1
+                suffix = '-%s-%s' % (voucher.id, attempt)
+                code = voucher.code[:maxLength - len(suffix)] + suffix
+            taken.add(code)
+            voucher.code = code
+            voucher.save(update_fields=['code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0009_stockreservation'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_vouchers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='uservoucher',
+            constraint=models.UniqueConstraint(fields=('user', 'voucher'), name='uservoucher_user_voucher_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='voucher',
+            constraint=models.UniqueConstraint(fields=('code',), name='voucher_code_uniq'),
+        ),
+    ]
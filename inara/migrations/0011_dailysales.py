@@ -0,0 +1,48 @@
+# Generated by Django 4.1 on 2026-10-16 19:56
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0010_voucher_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyItemSales',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('itemSku', models.CharField(max_length=100)),
+                ('itemName', models.CharField(max_length=150, null=True)),
+                ('salePrice', models.DecimalField(decimal_places=2, max_digits=10, null=True)),
+                ('qty', models.IntegerField(default=0)),
+                ('lines', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'daily_item_sales',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField(unique=True)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('orders', models.IntegerField(default=0)),
+                ('items', models.IntegerField(default=0)),
+                ('placedOrders', models.IntegerField(default=0)),
+                ('updatetime', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'daily_sales',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyitemsales',
+            constraint=models.UniqueConstraint(fields=('day', 'itemSku'), name='dailyitem_day_sku_uniq'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.1 on 2026-10-16 20:05
+
+import base64
+import datetime
+import json
+
+from django.db import migrations, models
+
+
+def _claims(token):
+    try:
+        payload = token.split('.')[1]
+        return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return {}
+
+
+def populate_jti(apps, schema_editor):
+    # rows were stored as the encoded token; keep the still valid ones by jti, drop the rest
+    TokenBlacklist = apps.get_model('inara', 'TokenBlacklist')
+    now = datetime.datetime.now(datetime.timezone.utc)
+    seen = set()
+    for row in TokenBlacklist.objects.order_by('id').iterator():
+        claims = _claims(row.token)
+        jti, exp = claims.get('jti'), claims.get('exp')
+        expiresAt = datetime.datetime.fromtimestamp(exp, tz=datetime.timezone.utc) if isinstance(exp, (int, float)) else None
+        if not jti or jti in seen or expiresAt is None or expiresAt <= now:
+            row.delete()
+            continue
+        seen.add(jti)
+        row.jti = jti
+        row.expiresAt = expiresAt
+        row.save(update_fields=['jti', 'expiresAt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0011_dailysales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tokenblacklist',
+            name='jti',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='tokenblacklist',
+            name='expiresAt',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(populate_jti, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='tokenblacklist',
+            name='token',
+        ),
+        migrations.AlterField(
+            model_name='tokenblacklist',
+            name='jti',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='tokenblacklist',
+            name='expiresAt',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='tokenblacklist',
+            index=models.Index(fields=['expiresAt'], name='token_blacklist_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1 on 2026-10-16 20:06
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0012_tokenblacklist_jti'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageSyncFailure',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=500, unique=True)),
+                ('action', models.IntegerField(choices=[(1, 'UPSERT'), (2, 'DELETE')], default=1)),
+                ('reason', models.CharField(max_length=100)),
+                ('detail', models.TextField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=1)),
+                ('lastModified', models.DateTimeField(null=True)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updatedAt', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'image_sync_failure',
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1 on 2026-10-16 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inara', '0013_imagesyncfailure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categorylisting',
+            name='imageVariants',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='historicalitem',
+            name='imageVariants',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='historicalitemgallery',
+            name='imageVariants',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='imageVariants',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='itemgallery',
+            name='imageVariants',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
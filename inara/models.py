@@ -15,6 +15,9 @@ from django.contrib.auth.models import AbstractBaseUser, UserManager, AbstractUs
 from django.db import IntegrityError
 from django.contrib.auth.hashers import make_password
 from simple_history.models import HistoricalRecords
+from django_cleanup import cleanup
+from django.contrib.postgres.search import SearchVectorField
+from django.contrib.postgres.indexes import GinIndex
 
 
 ################### AUTH USER ##########################################
@@ -261,6 +264,8 @@ class Item(models.Model):
     slug                        = models.CharField(max_length=150, unique=True)
     sku                         = models.CharField(max_length=100, unique=True,null=False)
     image                       = models.ImageField(upload_to='item_image', default='idris/asset/default-item-image.jpg', null=True)
+    # WebP/AVIF renditions of image, written by inara.imagevariants
+    imageVariants               = models.JSONField(null=True, blank=True)
     description                 = models.CharField(max_length=2000, null=True)
     appliesOnline               = models.IntegerField(null=False, default=0)
     weightGrams                 = models.CharField(max_length=150, null=True)
@@ -273,10 +278,13 @@ class Item(models.Model):
     width                       = models.DecimalField(max_digits=12, decimal_places=2, null=True)
     stock                       = models.DecimalField(max_digits=12, decimal_places=2, null=True)
     stockCheckQty               = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    # units held by open StockReservation rows (inara.stock); available = stock - reservedStock
+    reservedStock               = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
     mrp                         = models.IntegerField(null=True)
     salePrice                   = models.IntegerField(null=True)
     discount                    = models.IntegerField(default=0)
     extTimestamp                = models.DateTimeField(null=True)
+    syncHash                    = models.CharField(max_length=40, null=True)
     # timestamp                   = models.DateTimeField(max_length=100, null=True)
     author                      = models.CharField(max_length=100, null=True)
     isbn                        = models.CharField(max_length=100, null=True)
@@ -310,6 +318,7 @@ class Item(models.Model):
             models.Index(fields=['isNewArrival', 'newArrivalTill'], name='item_newarr_idx'),
             models.Index(fields=['status', 'isFeatured', 'newArrivalTill'], name='item_order_idx'),
             models.Index(fields=['sku'], name='item_sku_idx'),
+            models.Index(fields=['-newArrivalTill', '-isFeatured', '-stock', 'id'], name='item_keyset_idx'),
         ]
     
     def AddItem(mapping):
@@ -336,6 +345,90 @@ class Item(models.Model):
 
         return obj
 
+class ItemSearchDocument(models.Model):
+    # Precomputed search text per item, maintained by inara.search. On Postgres searchVector
+    # holds the weighted tsvector (name 'A', author/manufacturer/isbn/sku 'B').
+    itemId                      = models.OneToOneField(Item, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    title                       = models.CharField(max_length=150)
+    body                        = models.CharField(max_length=500, null=True)
+    document                    = models.TextField()
+    searchVector                = SearchVectorField(null=True)
+    updatedAt                   = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "item_search_document"
+        indexes = [
+            GinIndex(fields=['searchVector'], name='item_search_vector_idx'),
+            GinIndex(fields=['document'], name='item_search_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
+
+class CategoryClosure(models.Model):
+    # Transitive closure of Category.parentId, maintained by inara.categories: one row per
+    # (ancestor, descendant) pair including the depth-0 self row, so "everything under X" is a
+    # single indexed lookup on ancestorId.
+    id                          = models.BigAutoField(primary_key=True)
+    ancestorId                  = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='closure_descendants')
+    descendantId                = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='closure_ancestors')
+    depth                       = models.IntegerField(null=False, default=0)
+
+    class Meta:
+        db_table = "category_closure"
+        constraints = [
+            models.UniqueConstraint(fields=['ancestorId', 'descendantId'], name='closure_anc_desc_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['descendantId', 'depth'], name='closure_desc_depth_idx'),
+        ]
+
+@cleanup.ignore
+class CategoryListing(models.Model):
+    # Read model for category pages, maintained by inara.listing: one row per active item per
+    # active CategoryItem link, holding only the listing columns. Its image is the item's own
+    # file, so django_cleanup must not delete it with the row. The *Key columns are unique,
+    # ascending-sortable strings (see inara.listing.keys) so a page is one range scan on
+    # (categoryId, key) with keyset pagination.
+    id                          = models.BigAutoField(primary_key=True)
+    categoryId                  = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='listings')
+    itemId                      = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='listings')
+    sortKey                     = models.CharField(max_length=64)
+    featuredKey                 = models.CharField(max_length=64)
+    priceKey                    = models.CharField(max_length=64)
+    extPosId                    = models.IntegerField(null=False)
+    sku                         = models.CharField(max_length=100)
+    slug                        = models.CharField(max_length=150)
+    name                        = models.CharField(max_length=150)
+    description                 = models.CharField(max_length=2000, null=True)
+    mrp                         = models.IntegerField(null=True)
+    salePrice                   = models.IntegerField(null=True)
+    discount                    = models.IntegerField(default=0)
+    stock                       = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    stockCheckQty               = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    weight                      = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    image                       = models.ImageField(upload_to='item_image', null=True)
+    imageVariants               = models.JSONField(null=True, blank=True)
+    status                      = models.IntegerField(null=False, default=Item.ACTIVE)
+    appliesOnline               = models.IntegerField(null=False, default=0)
+    isNewArrival                = models.IntegerField(null=False, default=0)
+    isFeatured                  = models.IntegerField(null=False, default=0)
+    newArrivalTill              = models.DateTimeField(null=True)
+    manufacturer                = models.CharField(max_length=150, null=True)
+    aliasCode                   = models.CharField(max_length=100, null=True)
+    metaTitle                   = models.CharField(max_length=150, null=True)
+    metaDescription             = models.CharField(max_length=500, null=True)
+    timestamp                   = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = "category_listing"
+        constraints = [
+            models.UniqueConstraint(fields=['categoryId', 'itemId'], name='listing_cat_item_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['categoryId', 'sortKey'], name='listing_cat_sort_idx'),
+            models.Index(fields=['categoryId', 'featuredKey'], name='listing_cat_featured_idx'),
+            models.Index(fields=['categoryId', 'priceKey'], name='listing_cat_price_idx'),
+            models.Index(fields=['itemId'], name='listing_item_idx'),
+        ]
+
 class ItemGallery(models.Model):
     ACTIVE      = 1
     INACTIVE    = 2
@@ -345,6 +438,7 @@ class ItemGallery(models.Model):
     id                  = models.BigAutoField(primary_key=True)
     itemId              = models.ForeignKey(Item,on_delete=models.PROTECT, null=True, blank=True)
     image               = models.ImageField(upload_to='item_images/', default='item_images/default-item-image.jpg', null=True)
+    imageVariants       = models.JSONField(null=True, blank=True)
     # timeStamp             = models.DateTimeField(default=timezone.now, null=True)
     status              = models.IntegerField(null=False, choices=status_choice, default=ACTIVE)
     history = CustomHistoricalRecords()
@@ -640,6 +734,9 @@ class Order(models.Model):
 
     class Meta:
         db_table = "order"
+        indexes = [
+            models.Index(fields=['-timestamp', 'id'], name='order_keyset_idx'),
+        ]
 
     def AddOrder(name, email, phone, phone2, city, address, totalBill,deliveryFee,posStatus):
         try:
@@ -673,7 +770,88 @@ class OrderDescription(models.Model):
     
     class Meta:
         db_table = "order_description"
-    
+
+class StockReservation(models.Model):
+    # Stock held for an order between placement and confirmation, maintained by inara.stock.
+    # ACTIVE rows are counted in Item.reservedStock; confirming the order turns them into a
+    # stock decrement (COMMITTED), cancelling or expiry gives the units back (RELEASED).
+    ACTIVE      = 1
+    RELEASED    = 2
+    COMMITTED   = 3
+    status_choice = ((ACTIVE, "ACTIVE"), (RELEASED, "RELEASED"), (COMMITTED, "COMMITTED"))
+
+    id                  = models.BigAutoField(primary_key=True)
+    orderId             = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    itemId              = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='reservations')
+    qty                 = models.DecimalField(max_digits=12, decimal_places=2)
+    status              = models.IntegerField(null=False, choices=status_choice, default=ACTIVE)
+    timestamp           = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "stock_reservation"
+        indexes = [
+            models.Index(fields=['orderId', 'status'], name='reservation_order_idx'),
+            models.Index(fields=['status', 'timestamp'], name='reservation_expiry_idx'),
+        ]
+
+class EmailOutbox(models.Model):
+    # Outbound mail queue, maintained by inara.notifications: rows are written in the same
+    # transaction as the order they belong to and delivered by the send_outbox_emails task
+    # after commit, so checkout never waits on SMTP.
+    PENDING   = 1
+    SENT      = 2
+    FAILED    = 3
+    status_choice = ((PENDING, "PENDING"), (SENT, "SENT"), (FAILED, "FAILED"))
+
+    ORDER_CONFIRMATION = "ORDER_CONFIRMATION"
+    ORDER_ALERT        = "ORDER_ALERT"
+    kind_choice = ((ORDER_CONFIRMATION, "ORDER_CONFIRMATION"), (ORDER_ALERT, "ORDER_ALERT"))
+
+    id                  = models.BigAutoField(primary_key=True)
+    kind                = models.CharField(null=False, choices=kind_choice, max_length=30)
+    orderId             = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, related_name='emails')
+    subject             = models.CharField(null=False, max_length=255)
+    fromEmail           = models.CharField(null=False, max_length=150)
+    recipients          = models.TextField(null=False)
+    body                = models.TextField(null=False, default='')
+    htmlBody            = models.TextField(null=True, blank=True)
+    status              = models.IntegerField(null=False, choices=status_choice, default=PENDING)
+    attempts            = models.IntegerField(null=False, default=0)
+    lastError           = models.TextField(null=True, blank=True)
+    timestamp           = models.DateTimeField(default=timezone.now)
+    sentAt              = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = "email_outbox"
+        indexes = [
+            models.Index(fields=['status', 'id'], name='email_outbox_status_idx'),
+        ]
+
+class ImageSyncFailure(models.Model):
+    # Object storage keys the image reconciliation (inara.imagesync) could not apply. The sync
+    # watermark moves on regardless; these keys are retried on the following runs until they
+    # succeed, which deletes the row, or MAX_ATTEMPTS is reached.
+    UPSERT    = 1
+    DELETE    = 2
+    action_choice = ((UPSERT, "UPSERT"), (DELETE, "DELETE"))
+
+    INVALID_NAME   = "INVALID_NAME"
+    ITEM_NOT_FOUND = "ITEM_NOT_FOUND"
+    ERROR          = "ERROR"
+
+    id                  = models.BigAutoField(primary_key=True)
+    key                 = models.CharField(max_length=500, unique=True)
+    action              = models.IntegerField(null=False, choices=action_choice, default=UPSERT)
+    reason              = models.CharField(max_length=100)
+    detail              = models.TextField(null=True, blank=True)
+    attempts            = models.IntegerField(default=1)
+    lastModified        = models.DateTimeField(null=True)
+    timestamp           = models.DateTimeField(default=timezone.now)
+    updatedAt           = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "image_sync_failure"
+
 
     ##################### Zuhoor Model 11/23/22 ###############################
 
@@ -785,12 +963,17 @@ class Individual_BoxOrder(models.Model):
 ########## Token Blacklist Model ##########
 
 class TokenBlacklist(models.Model):
-    token = models.CharField(max_length=500)
+    # Revoked access tokens by jti, kept until the token expires; read through inara.blacklist
+    jti = models.CharField(max_length=255, unique=True)
+    expiresAt = models.DateTimeField()
     blacklisted_at = models.DateTimeField(auto_now_add=True)
     class Meta:
         db_table = "token_blacklist"
+        indexes = [
+            models.Index(fields=['expiresAt'], name='token_blacklist_expiry_idx'),
+        ]
     def __str__(self):
-        return self.token
+        return self.jti
 
 class DynamicText(models.Model):
     ACTIVE    = 1
@@ -973,6 +1156,39 @@ class DashboardStatistics(models.Model):
         db_table = "dashboard_statistics"
 
 
+class DailySales(models.Model):
+    # Per-day sales rollup read by the admin dashboard, maintained by inara.rollups: a day is
+    # recomputed from its own orders whenever one of them is placed or changes, and the
+    # rollup_statistics command backfills history. Only CONFIRMED orders count as sales.
+    id                  = models.BigAutoField(primary_key=True)
+    day                 = models.DateField(unique=True)
+    revenue             = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders              = models.IntegerField(default=0)
+    items               = models.IntegerField(default=0)
+    placedOrders        = models.IntegerField(default=0)
+    updatetime          = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "daily_sales"
+
+
+class DailyItemSales(models.Model):
+    # Units of one SKU sold on one day by CONFIRMED orders; see DailySales.
+    id                  = models.BigAutoField(primary_key=True)
+    day                 = models.DateField()
+    itemSku             = models.CharField(max_length=100)
+    itemName            = models.CharField(max_length=150, null=True)
+    salePrice           = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    qty                 = models.IntegerField(default=0)
+    lines               = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = "daily_item_sales"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'itemSku'], name='dailyitem_day_sku_uniq'),
+        ]
+
+
 
 
 class ProductReview(models.Model):
@@ -1006,6 +1222,9 @@ class Voucher(models.Model):
 
     class Meta:
         db_table = "voucher"
+        constraints = [
+            models.UniqueConstraint(fields=['code'], name='voucher_code_uniq'),
+        ]
 
 
 class UserVoucher(models.Model):
@@ -1017,6 +1236,9 @@ class UserVoucher(models.Model):
     isused=models.BooleanField(default=False)
     class Meta:
         db_table = "uservoucher"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'voucher'], name='uservoucher_user_voucher_uniq'),
+        ]
 
 
 
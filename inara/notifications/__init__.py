@@ -0,0 +1,2 @@
+# Outbound email queue: EmailOutbox rows written with the order, delivered after commit
+from .service import deliver, dispatch, enqueue, pending_count
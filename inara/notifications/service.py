@@ -0,0 +1,120 @@
+"""
+Outbound email queue
+
+enqueue() writes an EmailOutbox row inside the caller's transaction and hands its id to the
+send_outbox_emails Celery task once that transaction commits; a rolled back order therefore
+never mails anybody, and the request never waits on SMTP. deliver() sends pending rows in
+batches over one SMTP connection, records failures on the row and leaves them pending until
+EMAIL_OUTBOX_MAX_ATTEMPTS is reached.
+
+With EMAIL_OUTBOX_ASYNC = False (development, tests with the locmem email backend) the rows
+are delivered in-process right after commit instead of going through the broker.
+"""
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from inara.models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50)
+MAX_ATTEMPTS = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+
+
+def _async():
+    return getattr(settings, 'EMAIL_OUTBOX_ASYNC', True)
+
+
+def enqueue(kind, subject, recipients, body, html_body=None, from_email=None, order=None):
+    """Queue one message; it is sent after the current transaction commits."""
+    recipients = [email.strip() for email in recipients if email and email.strip()]
+    if not recipients:
+        return None
+    row = EmailOutbox.objects.create(kind=kind, orderId=order, subject=subject[:255],
+                                     fromEmail=from_email or settings.DEFAULT_FROM_EMAIL,
+                                     recipients=','.join(recipients), body=body or '', htmlBody=html_body)
+    transaction.on_commit(lambda: dispatch([row.id]))
+    return row
+
+
+def dispatch(ids=None):
+    """Hand rows to the worker; if the broker is down they stay pending for the periodic sweep."""
+    if not _async():
+        deliver(ids)
+        return
+    try:
+        from ecommerce_backend.tasks import send_outbox_emails
+        send_outbox_emails.delay(ids)
+    except Exception as e:
+        logger.error("Exception in outbox dispatch: %s " % (str(e)))
+
+
+def _message(row, connection):
+    message = EmailMultiAlternatives(subject=row.subject, body=row.body, from_email=row.fromEmail,
+                                     to=row.recipients.split(','), connection=connection)
+    if row.htmlBody:
+        message.attach_alternative(row.htmlBody, "text/html")
+    return message
+
+
+def _send_batch(ids, limit):
+    with transaction.atomic():
+        # concurrent workers skip each other's rows instead of sending them twice
+        rows = EmailOutbox.objects.select_for_update(skip_locked=True).filter(status=EmailOutbox.PENDING)
+        if ids is not None:
+            rows = rows.filter(id__in=ids)
+        rows = list(rows.order_by('id')[:limit])
+        if not rows:
+            return 0, 0
+        sent = failed = 0
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+            for row in rows:
+                try:
+                    connection.send_messages([_message(row, connection)])
+                    row.status = EmailOutbox.SENT
+                    row.sentAt = timezone.now()
+                    row.lastError = None
+                    sent += 1
+                except Exception as e:
+                    row.lastError = str(e)
+                    failed += 1
+        except Exception as e:
+            # no connection: every row of the batch counts as a failed attempt
+            for row in rows:
+                row.lastError = str(e)
+            failed = len(rows)
+        finally:
+            connection.close()
+        for row in rows:
+            row.attempts += 1
+            if row.status != EmailOutbox.SENT and row.attempts >= MAX_ATTEMPTS:
+                row.status = EmailOutbox.FAILED
+                logger.error("Email %s to %s given up after %s attempts: %s " % (row.id, row.recipients, row.attempts, row.lastError))
+        EmailOutbox.objects.bulk_update(rows, ['status', 'attempts', 'lastError', 'sentAt'])
+    return sent, failed
+
+
+def deliver(ids=None, batch_size=BATCH_SIZE):
+    """
+    Send pending rows (only the given ids, if any) batch by batch; returns (sent, failed).
+    Failed rows stay pending for the next attempt unless they ran out of attempts.
+    """
+    sent = failed = 0
+    while True:
+        batchSent, batchFailed = _send_batch(ids, batch_size)
+        sent += batchSent
+        failed += batchFailed
+        # stop on an empty batch, and on a failing one so a dead SMTP server is not hammered
+        if not batchSent or batchFailed:
+            break
+    return sent, failed
+
+
+def pending_count():
+    return EmailOutbox.objects.filter(status=EmailOutbox.PENDING).count()
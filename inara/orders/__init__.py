@@ -0,0 +1,2 @@
+# Order placement: priced, bulk-written orders in a single transaction
+from .service import OrderValidationError, order_number, place_order, price_lines
@@ -0,0 +1,143 @@
+"""
+Order placement
+
+place_order() writes an order in one transaction with the same handful of queries whatever
+the cart size: one SELECT pricing every cart line against Item, the Order INSERT with its
+order number already set, one bulk INSERT of the OrderDescription lines and the customer's
+shipping detail lookup, plus the single guarded UPDATE that reserves the order's stock
+(inara.stock). Anything that fails rolls the whole order back.
+"""
+import datetime
+import logging
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django.db import connection, transaction
+
+from inara import stock
+from inara.models import Item, Order, OrderDescription, User, UserShippingDetail
+
+logger = logging.getLogger(__name__)
+
+
+class OrderValidationError(Exception):
+
+    def __init__(self, message, skus=()):
+        super().__init__(message)
+        self.message = message
+        self.skus = list(skus)
+
+
+def order_number(order_id, date=None):
+    date = date or datetime.date.today()
+    return date.strftime("%Y""%m""%d") + str(order_id)
+
+
+def _reserve_order_id():
+    # Postgres hands out the id before the INSERT, so orderNo goes in with the row
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'))", [connection.ops.quote_name(Order._meta.db_table)])
+        return cursor.fetchone()[0]
+
+
+def _decimal(value):
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def _allowed_prices(item):
+    # Item.discount is a percentage the storefront takes off the price it shows (getItemDetail)
+    prices = set()
+    for value in (item['salePrice'], item['mrp']):
+        if value is None:
+            continue
+        value = Decimal(value)
+        prices.add(value)
+        if item['discount']:
+            discounted = value * (100 - item['discount']) / 100
+            prices.add(discounted.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+            prices.add(discounted.quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    return prices
+
+
+def price_lines(cart_list):
+    """
+    Unsaved OrderDescription lines for the cart, priced from Item in one query, and the
+    quantity per item id. The price a cart line was shown at must be the item's current sale
+    price or MRP, with or without the item's discount.
+    """
+    skus = [str(cart['sku']) for cart in cart_list]
+    items = {item['sku']: item for item in
+             Item.objects.filter(sku__in=set(skus), status=Item.ACTIVE).values('id', 'sku', 'name', 'mrp', 'salePrice', 'discount')}
+    lines = []
+    quantities = {}
+    unknown = []
+    changed = []
+    for sku, cart in zip(skus, cart_list):
+        item = items.get(sku)
+        qty = int(cart['qty'])
+        if item is None or qty < 1:
+            unknown.append(sku)
+            continue
+        price = _decimal(cart['price'])
+        if price not in _allowed_prices(item):
+            changed.append(sku)
+            continue
+        lines.append(OrderDescription(item_type=OrderDescription.PRODUCT, itemSku=sku, itemName=item['name'] or cart.get('name'),
+                                      itemUnit='each', itemMinQty=1, mrp=item['mrp'], salePrice=item['salePrice'],
+                                      itemIndPrice=price, itemTotalPrice=price * qty, itemQty=qty, isStockManaged=True))
+        quantities[item['id']] = quantities.get(item['id'], 0) + qty
+    if unknown:
+        raise OrderValidationError("Items no longer available", unknown)
+    if changed:
+        raise OrderValidationError("Item prices have changed, please review your cart", changed)
+    return lines, quantities
+
+
+def _shipping_detail(userid, city, address):
+    user = User.objects.filter(id=userid).first()
+    if user is not None and UserShippingDetail.objects.filter(user=user, area=city, city=city, address=address).exists():
+        return None
+    return UserShippingDetail.objects.create(user=user, area=city, city=city, address=address)
+
+
+def place_order(userid, valueDict, cartList, totalPrice, deliveryFee):
+    """
+    Create the order, its lines, its stock reservation and the shipping detail atomically;
+    returns (order, lines, shipping detail). totalPrice, the client's total, is only logged
+    when it disagrees with the bill computed from the priced lines.
+    """
+    lines, quantities = price_lines(cartList)
+    if not lines:
+        raise OrderValidationError("Cart is empty")
+    # the bill is what the checked lines add up to (plus delivery, which the rollups subtract
+    # again), never the client's figure
+    totalBill = sum(line.itemTotalPrice for line in lines) + (_decimal(deliveryFee) or 0)
+    if _decimal(totalPrice) != totalBill:
+        logger.info("Order: cart total %s differs from the priced total %s " % (totalPrice, totalBill))
+    with transaction.atomic():
+        orderId = _reserve_order_id()
+        order = Order(id=orderId, custId=userid, custName=valueDict['name'], custEmail=valueDict['email'], custPhone=valueDict['phone'],
+                      cust_phone2=valueDict['phone2'], custCity=valueDict['city'], shippingAddress=valueDict['address'],
+                      shippingCity=valueDict['city'], totalBill=totalBill, deliveryCharges=deliveryFee, discountedBill=totalBill,
+                      paymentMethod='COD', totalItems=sum(line.itemQty for line in lines))
+        if orderId is not None:
+            order.orderNo = order_number(orderId)
+            order.save(force_insert=True)
+        else:
+            # no sequence to draw from: the number needs the id the INSERT assigned
+            order.save(force_insert=True)
+            order.orderNo = order_number(order.pk)
+            Order.objects.filter(id=order.pk).update(orderNo=order.orderNo)
+        for line in lines:
+            line.order = order
+        OrderDescription.objects.bulk_create(lines)
+        try:
+            stock.reserve(order, quantities)
+        except stock.InsufficientStock as e:
+            raise OrderValidationError("Some items are out of stock", e.skus)
+        shipping = _shipping_detail(userid, valueDict['city'], valueDict['address'])
+    return order, lines, shipping
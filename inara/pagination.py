@@ -0,0 +1,151 @@
+"""
+Opt-in keyset (cursor) pagination for the admin list endpoints
+
+KeysetPaginationMixin sits in front of a PageNumberPagination class. Without a cursor query
+parameter the endpoint pages exactly as before; with ?cursor= (empty for the first page) it
+seeks past the last row of the previous page on keyset_ordering instead of COUNT(*) + OFFSET,
+and reports a cached total, so page 500 costs the same as page 1.
+
+NULLs follow the Postgres defaults (last ascending, first descending) on every backend, and the
+ordering must end in a unique column (id) so the position of a row is unambiguous.
+"""
+import base64
+import datetime
+import decimal
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, Q
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+COUNT_KEY = 'pagecount:%s'
+COUNT_TIMEOUT = 60
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date, decimal.Decimal)):
+        return str(value)
+    return value
+
+
+def encode_cursor(values):
+    payload = json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, length):
+    """Values of a cursor, or None when it is missing or malformed (first page)."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def _parse_ordering(ordering):
+    return [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+
+def order_by_keyset(queryset, ordering):
+    terms = []
+    for field, descending in _parse_ordering(ordering):
+        terms.append(F(field).desc(nulls_first=True) if descending else F(field).asc(nulls_last=True))
+    return queryset.order_by(*terms)
+
+
+def _after(field, descending, value):
+    if descending:
+        return Q(**{field + '__isnull': False}) if value is None else Q(**{field + '__lt': value})
+    if value is None:
+        return None
+    return Q(**{field + '__gt': value}) | Q(**{field + '__isnull': True})
+
+
+def _equal(field, value):
+    return Q(**{field + '__isnull': True}) if value is None else Q(**{field: value})
+
+
+def seek(queryset, ordering, values):
+    """Rows strictly after the row with the given ordering values."""
+    condition = Q(pk__in=[])
+    prefix = Q()
+    for (field, descending), value in zip(_parse_ordering(ordering), values):
+        after = _after(field, descending, value)
+        if after is not None:
+            condition |= prefix & after
+        prefix &= _equal(field, value)
+    return queryset.filter(condition)
+
+
+def cached_count(queryset, timeout=COUNT_TIMEOUT):
+    """
+    Row count of a queryset, cached per SQL statement for timeout seconds. On Postgres an
+    unfiltered table uses the planner estimate instead of scanning.
+    """
+    sql, params = queryset.query.sql_with_params()
+    key = COUNT_KEY % hashlib.sha1(('%s|%s' % (sql, params)).encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is not None:
+        return count
+    count = None
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            if row and row[0] >= 0:
+                count = row[0]
+    if count is None:
+        count = queryset.order_by().count()
+    cache.set(key, count, timeout)
+    return count
+
+
+class KeysetPaginationMixin(object):
+    cursor_query_param = 'cursor'
+    keyset_ordering = ('-id',)
+    keyset_page_size = 20
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        size = self.get_page_size(request) or self.keyset_page_size
+        self.count = cached_count(queryset)
+        values = decode_cursor(request.query_params.get(self.cursor_query_param), len(self.keyset_ordering))
+        queryset = order_by_keyset(queryset, self.keyset_ordering)
+        if values is not None:
+            queryset = seek(queryset, self.keyset_ordering, values)
+        rows = list(queryset[:size + 1])
+        self.next_cursor = None
+        if len(rows) > size:
+            rows = rows[:size]
+            last = rows[-1]
+            self.next_cursor = encode_cursor([getattr(last, field) for field, descending in _parse_ordering(self.keyset_ordering)])
+        return rows
+
+    def get_next_link(self):
+        if self.keyset:
+            if self.next_cursor is None:
+                return None
+            return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+        return super().get_next_link()
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('cursor', self.next_cursor),
+            ('results', data),
+        ]))
@@ -0,0 +1,2 @@
+# Daily sales rollups behind the admin dashboard
+from .service import dashboard, orders_changed, rebuild, refresh_days
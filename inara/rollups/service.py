@@ -0,0 +1,145 @@
+"""
+Daily sales rollups
+
+DailySales and DailyItemSales hold one row per day (and per day and SKU) of CONFIRMED sales.
+A day is always recomputed whole from its own orders, a timestamp range scan, so the rows stay
+right however an order was edited: orders_changed() schedules that for the days of the orders
+touched by a request, rebuild() backfills history, and dashboard() answers the admin
+statistics from the rollups alone, in time proportional to the number of days.
+"""
+import datetime
+import logging
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, Max, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from inara.models import DailyItemSales, DailySales, Order, OrderDescription
+
+logger = logging.getLogger(__name__)
+
+CHUNK_DAYS = 31
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def _start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def _runs(days):
+    # consecutive days collapse into (first, last) ranges
+    runs = []
+    for day in sorted(set(days)):
+        if runs and runs[-1][1] + ONE_DAY == day:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def _refresh_range(first, last):
+    orders = Order.objects.filter(timestamp__gte=_start(first), timestamp__lt=_start(last + ONE_DAY))
+    confirmed = orders.filter(status=Order.CONFIRMED)
+    lines = OrderDescription.objects.filter(order__in=confirmed, isDeleted=False).annotate(day=TruncDate('order__timestamp'))
+    zero = Value(0, output_field=DecimalField(max_digits=14, decimal_places=2))
+
+    placed = dict(orders.annotate(day=TruncDate('timestamp')).values('day').annotate(n=Count('id')).values_list('day', 'n'))
+    sales = {row['day']: row for row in confirmed.annotate(day=TruncDate('timestamp')).values('day').annotate(
+        revenue=Coalesce(Sum('totalBill'), zero) - Coalesce(Sum('deliveryCharges'), zero), orders=Count('id'))}
+    items = dict(lines.values('day').annotate(n=Sum('itemQty')).values_list('day', 'n'))
+    skus = list(lines.filter(item_type=OrderDescription.PRODUCT).values('day', 'itemSku').annotate(
+        qty=Sum('itemQty'), lines=Count('id'), itemName=Max('itemName'), salePrice=Max('salePrice')))
+
+    now = timezone.now()
+    rows = []
+    day = first
+    while day <= last:
+        sale = sales.get(day, {})
+        rows.append(DailySales(day=day, revenue=sale.get('revenue') or 0, orders=sale.get('orders') or 0,
+                               items=items.get(day) or 0, placedOrders=placed.get(day) or 0, updatetime=now))
+        day += ONE_DAY
+    with transaction.atomic():
+        DailySales.objects.bulk_create(rows, update_conflicts=True, unique_fields=['day'],
+                                       update_fields=['revenue', 'orders', 'items', 'placedOrders', 'updatetime'])
+        DailyItemSales.objects.bulk_create([DailyItemSales(**row) for row in skus], update_conflicts=True,
+                                           unique_fields=['day', 'itemSku'], update_fields=['itemName', 'salePrice', 'qty', 'lines'],
+                                           batch_size=1000)
+        # SKUs that no longer sold on these days
+        sold = {(row['day'], row['itemSku']) for row in skus}
+        stale = [rowId for rowId, day, sku in DailyItemSales.objects.filter(day__gte=first, day__lte=last)
+                 .values_list('id', 'day', 'itemSku') if (day, sku) not in sold]
+        if stale:
+            DailyItemSales.objects.filter(id__in=stale).delete()
+    return len(rows)
+
+
+def refresh_days(days):
+    """Recompute the rollup rows of the given dates from their orders."""
+    return sum(_refresh_range(first, last) for first, last in _runs(day for day in days if day))
+
+
+def orders_changed(order_ids):
+    """Refresh the days of the given orders once the current transaction commits."""
+    order_ids = list(order_ids)
+    if not order_ids:
+        return
+
+    def refresh():
+        days = Order.objects.filter(id__in=order_ids).annotate(day=TruncDate('timestamp')).values_list('day', flat=True)
+        try:
+            refresh_days(set(days))
+        except Exception as e:
+            logger.error("Exception in orders_changed: %s " %(str(e)))
+
+    transaction.on_commit(refresh)
+
+
+def rebuild(first=None, last=None):
+    """Backfill the rollups from first to last (defaults: the first order, today); returns the days written."""
+    if first is None:
+        oldest = Order.objects.filter(timestamp__isnull=False).order_by('timestamp').values_list('timestamp', flat=True).first()
+        if oldest is None:
+            return 0
+        first = timezone.localdate(oldest)
+    last = last or timezone.localdate()
+    count = 0
+    while first <= last:
+        end = min(first + datetime.timedelta(days=CHUNK_DAYS - 1), last)
+        count += _refresh_range(first, end)
+        first = end + ONE_DAY
+    return count
+
+
+def _totals(first=None):
+    rows = DailySales.objects.all() if first is None else DailySales.objects.filter(day__gte=first)
+    totals = rows.aggregate(revenue=Sum('revenue'), orders=Sum('orders'), items=Sum('items'), placed=Sum('placedOrders'))
+    totals['orders'] = totals['orders'] or 0
+    return totals
+
+
+def dashboard(now=None):
+    """The admin dashboard sales figures, read from the rollups."""
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    month = _totals(today.replace(day=1))
+    last30 = _totals(timezone.localdate(now - datetime.timedelta(days=30)))
+    week = _totals(timezone.localdate(now - datetime.timedelta(days=7)))
+    total = _totals()
+    mostSold = (DailyItemSales.objects.values('itemSku')
+                .annotate(itemName=Max('itemName'), salePrice=Max('salePrice'), total_quantity_sold=Sum('qty'), item_count=Sum('lines'))
+                .order_by('-total_quantity_sold')[:5])
+    return {
+        "current_month_sale": month['revenue'],
+        "current_monthorder": month['orders'],
+        "monthly_sales": last30['revenue'],
+        "monthy_saleitem": last30['items'],
+        "monthly_order": last30['orders'],
+        "total_weekly_sale": week['revenue'],
+        "weekly_saleitem": week['items'],
+        "weekly_saleorder": week['orders'],
+        "total_sale": total['revenue'],
+        "total_saleItem": total['items'],
+        "total_order": total['placed'] or 0,
+        "mostsold_item": list(mostSold),
+    }
@@ -0,0 +1,5 @@
+# Item search: indexed search documents, ranking API and the in-memory fallback engine
+from .engine import InMemorySearchEngine, tokenize
+from .suggest import SuggestIndex
+from .service import (backend, refresh_documents, remove_documents, refresh_categories, remove_categories,
+                      search_item_ids, items_in_order, rebuild_index, get_engine, get_suggest_index, suggest)
@@ -0,0 +1,145 @@
+"""
+In-process search engine used when the database has no full-text support (SQLite/dev)
+
+Holds an inverted index (token -> {item id: field weight}) and a trigram index over the
+token vocabulary, so misspelt and partially typed words still find candidates without
+touching the database.
+"""
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from operator import itemgetter
+
+from unidecode import unidecode
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# relative weight of each indexed field, mirrors the 'A'/'B' weights of the Postgres document
+FIELD_WEIGHTS = {
+    'name': 1.0,
+    'author': 0.6,
+    'manufacturer': 0.6,
+    'isbn': 0.8,
+    'sku': 0.8,
+}
+
+
+def tokenize(text):
+    """Lower-cased, accent-stripped alphanumeric tokens of text."""
+    if not text:
+        return []
+    return TOKEN_RE.findall(unidecode(str(text)).lower())
+
+
+def trigrams(token):
+    """pg_trgm style trigrams: the token padded with two leading and one trailing blank."""
+    padded = '  ' + token + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InMemorySearchEngine(object):
+    PREFIX_EXPANSIONS = 50
+    MIN_TRIGRAM_SIMILARITY = 0.4
+    MATCH_BONUS = 10.0
+
+    def __init__(self):
+        self.generation = None
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._trigrams = defaultdict(set)
+        self._vocabulary = []
+        self._documents = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, item_id, fields):
+        """Index (or re-index) one item. fields maps FIELD_WEIGHTS keys to text."""
+        weights = {}
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS.get(field, 0.5)
+            for token in tokenize(text):
+                if weights.get(token, 0) < weight:
+                    weights[token] = weight
+        with self._lock:
+            self._remove(item_id)
+            for token, weight in weights.items():
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = {}
+                    for gram in trigrams(token):
+                        self._trigrams[gram].add(token)
+                    position = bisect_left(self._vocabulary, token)
+                    self._vocabulary.insert(position, token)
+                postings[item_id] = weight
+            self._documents[item_id] = tuple(weights)
+
+    def remove(self, item_id):
+        with self._lock:
+            self._remove(item_id)
+
+    def _remove(self, item_id):
+        # tokens stay in the vocabulary; empty posting lists simply score nothing
+        for token in self._documents.pop(item_id, ()):
+            self._postings[token].pop(item_id, None)
+
+    def _expand(self, token, is_last):
+        """Candidate vocabulary tokens for a query token with their similarity (0..1]."""
+        candidates = {}
+        if token in self._postings:
+            candidates[token] = 1.0
+        if is_last:
+            # the last word is usually still being typed: treat it as a prefix
+            position = bisect_left(self._vocabulary, token)
+            for candidate in self._vocabulary[position:position + self.PREFIX_EXPANSIONS]:
+                if not candidate.startswith(token):
+                    break
+                candidates.setdefault(candidate, 0.9)
+        if candidates:
+            return candidates
+        # no exact or prefix hit: fall back to misspelling tolerant trigram matches
+        grams = trigrams(token)
+        shared = defaultdict(int)
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                shared[candidate] += 1
+        for candidate, count in shared.items():
+            similarity = count / float(len(grams) + len(trigrams(candidate)) - count)
+            if similarity >= self.MIN_TRIGRAM_SIMILARITY:
+                candidates[candidate] = similarity * 0.8
+        return candidates
+
+    def search(self, text, limit=None):
+        """
+        Item ids ranked by relevance.
+
+        Items matching every query word come first, then items matching fewer words;
+        within a tier items are ordered by summed field-weighted similarity.
+        """
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        # every matched word adds MATCH_BONUS, so items matching more words always rank higher
+        scores = defaultdict(float)
+        with self._lock:
+            for index, token in enumerate(tokens):
+                candidates = self._expand(token, index == len(tokens) - 1)
+                if len(candidates) == 1:
+                    (candidate, similarity), = candidates.items()
+                    best = {item_id: similarity * weight for item_id, weight in self._postings[candidate].items()}
+                else:
+                    best = {}
+                    for candidate, similarity in candidates.items():
+                        for item_id, weight in self._postings[candidate].items():
+                            score = similarity * weight
+                            if best.get(item_id, 0) < score:
+                                best[item_id] = score
+                for item_id, score in best.items():
+                    scores[item_id] += score + self.MATCH_BONUS
+        if limit:
+            ranked = heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+        else:
+            ranked = sorted(scores.items(), key=itemgetter(1), reverse=True)
+        return [item_id for item_id, score in ranked]
@@ -0,0 +1,294 @@
+"""
+Search document maintenance and ranking for items
+
+Postgres: one ItemSearchDocument row per item with a weighted tsvector (GIN) and a normalised
+text column (GIN trigram), ranked by ts_rank + trigram similarity in a single indexed query.
+Anything else (SQLite/dev): the per-process InMemorySearchEngine.
+
+Every document change bumps the shared search generation and records the changed ids in the
+cache under that generation. A worker whose in-process index is behind reloads just those ids
+and applies them in place; it only rebuilds from scratch when the change log has a gap
+(evicted entries, cache flush, a full reindex).
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from inara.models import Item, ItemSearchDocument, Category
+from .engine import FIELD_WEIGHTS, InMemorySearchEngine, tokenize
+from . import suggest as suggest_index
+
+logger = logging.getLogger(__name__)
+
+RESULT_LIMIT = getattr(settings, 'SEARCH_RESULT_LIMIT', 1000)
+GENERATION_KEY = 'search:generation'
+CHANGE_KEY = 'search:changes:%s'
+# change log entries outlive any realistic gap between two requests of a worker
+CHANGE_TTL = getattr(settings, 'SEARCH_CHANGE_TTL', 24 * 3600)
+# further behind than this a rebuild is cheaper than replaying the log
+MAX_CATCH_UP = 1000
+CHUNK_SIZE = 2000
+
+DOCUMENT_FIELDS = ('id', 'name', 'slug', 'author', 'manufacturer', 'isbn', 'sku', 'status')
+CATEGORY_FIELDS = ('id', 'name', 'slug', 'status', 'isBrand')
+
+_engine = None
+_suggest = None
+_lock = threading.RLock()
+
+
+def backend():
+    """'postgres' or 'memory'; SEARCH_BACKEND in settings overrides the vendor default."""
+    configured = getattr(settings, 'SEARCH_BACKEND', None)
+    if configured:
+        return configured
+    return 'postgres' if connection.vendor == 'postgresql' else 'memory'
+
+
+def _generation():
+    return cache.get(GENERATION_KEY, 0)
+
+
+def _bump_generation():
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+        return 1
+
+
+def _publish(items=(), categories=(), rebuild=False):
+    """Record a change for the other workers; returns its generation."""
+    generation = _bump_generation()
+    cache.set(CHANGE_KEY % generation, {'items': list(items), 'categories': list(categories), 'rebuild': rebuild}, CHANGE_TTL)
+    return generation
+
+
+def _changes(since, generation):
+    """(item ids, category ids) changed after generation since, or None when they can't be replayed."""
+    if since is None or not since < generation <= since + MAX_CATCH_UP:
+        return None
+    keys = [CHANGE_KEY % number for number in range(since + 1, generation + 1)]
+    found = cache.get_many(keys)
+    if len(found) != len(keys):
+        return None
+    items, categories = set(), set()
+    for change in found.values():
+        if change['rebuild']:
+            return None
+        items.update(change['items'])
+        categories.update(change['categories'])
+    return items, categories
+
+
+def _item_rows(item_ids):
+    return {row['id']: row for row in Item.objects.filter(id__in=list(item_ids)).values(*DOCUMENT_FIELDS)}
+
+
+def _category_rows(category_ids):
+    return {row['id']: row for row in Category.objects.filter(id__in=list(category_ids)).values(*CATEGORY_FIELDS)}
+
+
+def _apply_to_engine(engine, item_ids, rows):
+    for item_id in item_ids:
+        row = rows.get(item_id)
+        if row is not None and row['status'] == Item.ACTIVE:
+            engine.add(item_id, _engine_fields(row))
+        else:
+            engine.remove(item_id)
+
+
+def _apply_to_suggest(index, item_ids, item_rows, category_ids, category_rows):
+    for item_id in item_ids:
+        entry = suggest_index.item_entry(item_rows[item_id]) if item_id in item_rows else None
+        if entry:
+            index.add(*entry)
+        else:
+            index.remove(suggest_index.PRODUCT, item_id)
+    for category_id in category_ids:
+        entry = suggest_index.category_entry(category_rows[category_id]) if category_id in category_rows else None
+        # isBrand may have flipped, so the other kind is dropped
+        for kind in (suggest_index.CATEGORY, suggest_index.BRAND):
+            if entry is None or entry[0] != kind:
+                index.remove(kind, category_id)
+        if entry:
+            index.add(*entry)
+
+
+def _document(row):
+    title = row['name'] or ''
+    body = ' '.join(str(row[field]) for field in ('author', 'manufacturer', 'isbn', 'sku') if row[field])
+    return title, body[:500], ' '.join(tokenize(title + ' ' + body))
+
+
+def _engine_fields(row):
+    return {field: row[field] for field in ('name', 'author', 'manufacturer', 'isbn', 'sku')}
+
+
+def refresh_documents(item_ids=None):
+    """
+    Rebuild the search documents of the given items (all items when item_ids is None).
+
+    Called from Item post_save and after every POS sync page, which writes in bulk and
+    therefore sends no signals.
+    """
+    queryset = Item.objects.all() if item_ids is None else Item.objects.filter(id__in=list(item_ids))
+    rows = list(queryset.values(*DOCUMENT_FIELDS).order_by('id'))
+    for start in range(0, len(rows), CHUNK_SIZE):
+        chunk = rows[start:start + CHUNK_SIZE]
+        existing = set(ItemSearchDocument.objects.filter(itemId__in=[row['id'] for row in chunk]).values_list('itemId', flat=True))
+        toCreate, toUpdate = [], []
+        for row in chunk:
+            title, body, document = _document(row)
+            searchDocument = ItemSearchDocument(itemId_id=row['id'], title=title, body=body, document=document, updatedAt=timezone.now())
+            (toUpdate if row['id'] in existing else toCreate).append(searchDocument)
+        ItemSearchDocument.objects.bulk_create(toCreate)
+        ItemSearchDocument.objects.bulk_update(toUpdate, ['title', 'body', 'document', 'updatedAt'])
+        if connection.vendor == 'postgresql':
+            ItemSearchDocument.objects.filter(itemId__in=[row['id'] for row in chunk]).update(
+                searchVector=SearchVector('title', weight='A', config='simple') + SearchVector('body', weight='B', config='simple'))
+
+    itemIds = [row['id'] for row in rows]
+    generation = _publish(items=itemIds, rebuild=item_ids is None)
+    _apply_local(generation, itemIds, {row['id']: row for row in rows})
+    return len(rows)
+
+
+def remove_documents(item_ids):
+    ItemSearchDocument.objects.filter(itemId__in=list(item_ids)).delete()
+    generation = _publish(items=item_ids)
+    _apply_local(generation, item_ids, {})
+
+
+def refresh_categories(category_ids):
+    """Re-index categories/brands for suggestions after they were saved."""
+    generation = _publish(categories=category_ids)
+    _apply_local(generation, (), {}, category_ids, _category_rows(category_ids))
+
+
+def remove_categories(category_ids):
+    generation = _publish(categories=category_ids)
+    _apply_local(generation, (), {}, category_ids, {})
+
+
+def _build_engine(generation):
+    engine = InMemorySearchEngine()
+    rows = Item.objects.filter(status=Item.ACTIVE).values(*DOCUMENT_FIELDS)
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        engine.add(row['id'], _engine_fields(row))
+    engine.generation = generation
+    return engine
+
+
+def _apply_local(generation, item_ids, item_rows, category_ids=(), category_rows=None):
+    # this worker's own change: apply it directly unless other changes came in between
+    with _lock:
+        if _engine is not None and _engine.generation == generation - 1:
+            _apply_to_engine(_engine, item_ids, item_rows)
+            _engine.generation = generation
+        if _suggest is not None and _suggest.generation == generation - 1:
+            _apply_to_suggest(_suggest, item_ids, item_rows, category_ids, category_rows or {})
+            _suggest.generation = generation
+
+
+def get_engine():
+    """The per-process engine, brought up to date with the changes made by other processes."""
+    global _engine
+    generation = _generation()
+    engine = _engine
+    if engine is not None and engine.generation == generation:
+        return engine
+    with _lock:
+        if _engine is not None and _engine.generation != generation:
+            changes = _changes(_engine.generation, generation)
+            if changes is None:
+                _engine = None
+            else:
+                _apply_to_engine(_engine, changes[0], _item_rows(changes[0]))
+                _engine.generation = generation
+        if _engine is None:
+            started = time.monotonic()
+            _engine = _build_engine(generation)
+            logger.info("Search engine rebuilt: %s items in %.2fs" % (len(_engine), time.monotonic() - started))
+        return _engine
+
+
+def get_suggest_index():
+    """The per-process suggestion index, brought up to date with the changes made by other processes."""
+    global _suggest
+    generation = _generation()
+    index = _suggest
+    if index is not None and index.generation == generation:
+        return index
+    with _lock:
+        if _suggest is not None and _suggest.generation != generation:
+            changes = _changes(_suggest.generation, generation)
+            if changes is None:
+                _suggest = None
+            else:
+                itemIds, categoryIds = changes
+                _apply_to_suggest(_suggest, itemIds, _item_rows(itemIds), categoryIds, _category_rows(categoryIds))
+                _suggest.generation = generation
+        if _suggest is None:
+            started = time.monotonic()
+            _suggest = suggest_index.build_index(generation)
+            logger.info("Suggest index rebuilt: %s entries in %.2fs" % (len(_suggest), time.monotonic() - started))
+        return _suggest
+
+
+def suggest(prefix, limit=8):
+    """Top product, category and brand names starting (at any word) with prefix."""
+    return get_suggest_index().lookup(prefix, limit)
+
+
+def _postgres_search(text, limit):
+    tokens = tokenize(text)
+    if not tokens:
+        return []
+    normalised = ' '.join(tokens)
+    # every word must match, the last one as a prefix because it is usually still being typed
+    query = SearchQuery(' & '.join(tokens[:-1] + [tokens[-1] + ':*']), search_type='raw', config='simple')
+    documents = ItemSearchDocument.objects.filter(itemId__status=Item.ACTIVE).filter(
+        Q(searchVector=query) | Q(document__trigram_word_similar=normalised)
+    ).annotate(
+        # similarity per field, so a short name is not diluted by a long author/isbn tail
+        similarity=Greatest(
+            TrigramSimilarity('title', normalised) * Value(FIELD_WEIGHTS['name']),
+            TrigramSimilarity('itemId__sku', normalised) * Value(FIELD_WEIGHTS['sku']),
+            TrigramSimilarity('itemId__author', normalised) * Value(FIELD_WEIGHTS['author']),
+        ),
+        rank=SearchRank(F('searchVector'), query) + F('similarity'),
+    ).order_by('-rank', 'itemId')
+    return list(documents.values_list('itemId', flat=True)[:limit])
+
+
+def search_item_ids(text, limit=RESULT_LIMIT):
+    """Ids of active items matching text, best match first."""
+    if backend() == 'postgres':
+        return _postgres_search(text, limit)
+    return get_engine().search(text, limit)
+
+
+def items_in_order(item_ids, queryset=None):
+    """Load items for a page of ids, keeping the ranking order."""
+    queryset = Item.objects.all() if queryset is None else queryset
+    items = queryset.in_bulk(list(item_ids))
+    return [items[item_id] for item_id in item_ids if item_id in items]
+
+
+def rebuild_index():
+    """Full rebuild of every search document; used by the rebuild_search_index command."""
+    global _engine, _suggest
+    count = refresh_documents()
+    with _lock:
+        _engine = _build_engine(_generation()) if backend() == 'memory' else None
+        _suggest = None
+    return count
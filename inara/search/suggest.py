@@ -0,0 +1,167 @@
+"""
+Typeahead suggestions for product names, categories and brands
+
+A sorted array of (word-suffix key, kind, id) tuples held per process: every label is indexed
+once per word, so "hon" finds "Pure Chitrali Honey". A lookup bisects the prefix range and
+ranks all of it, never touching the database. Wide ranges (short prefixes) keep their ranked
+top list, which add() updates in place and remove() drops only when it held the removed row.
+Rows are inserted/removed as items and categories change (see inara.search.service).
+"""
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from inara.models import Item, Category
+from .engine import tokenize
+
+PRODUCT = 'product'
+CATEGORY = 'category'
+BRAND = 'brand'
+KINDS = (PRODUCT, CATEGORY, BRAND)
+
+
+class SuggestIndex(object):
+    # prefix ranges up to this many entries are ranked on every lookup, wider ones are cached
+    SCAN_LIMIT = 400
+    # largest limit a lookup may ask for
+    MAX_LIMIT = 20
+    MAX_CACHED = 2000
+
+    def __init__(self):
+        self.generation = None
+        self._lock = threading.RLock()
+        self._entries = []
+        self._labels = {}
+        self._keys = {}
+        # prefix -> {kind: [rank, ...]} holding the best MAX_LIMIT ranks of each kind
+        self._top = OrderedDict()
+
+    def __len__(self):
+        return len(self._labels)
+
+    @staticmethod
+    def _keys_for(label):
+        words = tokenize(label)
+        return [' '.join(words[position:]) for position in range(len(words))]
+
+    @staticmethod
+    def _rank(key, keys, label, ref_id):
+        # labels that start with the prefix beat mid-label matches, then shorter labels
+        return (0 if key == keys[0] else 1, len(label), ref_id)
+
+    def add(self, kind, ref_id, label, slug, bulk=False):
+        keys = self._keys_for(label)
+        with self._lock:
+            if self._labels.get((kind, ref_id)) == (label, slug, keys[0] if keys else ''):
+                return
+            self._remove(kind, ref_id)
+            for key in keys:
+                if bulk:
+                    self._entries.append((key, kind, ref_id))
+                else:
+                    insort(self._entries, (key, kind, ref_id))
+                    self._promote(key, kind, self._rank(key, keys, label, ref_id))
+            self._labels[(kind, ref_id)] = (label, slug, keys[0] if keys else '')
+            self._keys[(kind, ref_id)] = keys
+
+    def finish_bulk(self):
+        with self._lock:
+            self._entries.sort()
+            self._top.clear()
+
+    def remove(self, kind, ref_id):
+        with self._lock:
+            self._remove(kind, ref_id)
+
+    def _remove(self, kind, ref_id):
+        for key in self._keys.pop((kind, ref_id), ()):
+            position = bisect_left(self._entries, (key, kind, ref_id))
+            if position < len(self._entries) and self._entries[position] == (key, kind, ref_id):
+                del self._entries[position]
+            for end in range(1, len(key) + 1):
+                top = self._top.get(key[:end])
+                if top is not None and any(rank[-1] == ref_id for rank in top[kind]):
+                    # the next best row is unknown, rank the range again on the next lookup
+                    del self._top[key[:end]]
+        self._labels.pop((kind, ref_id), None)
+
+    def _promote(self, key, kind, rank):
+        for end in range(1, len(key) + 1):
+            top = self._top.get(key[:end])
+            if top is None:
+                continue
+            ranks = top[kind]
+            current = next((other for other in ranks if other[-1] == rank[-1]), None)
+            if current is not None:
+                if current <= rank:
+                    continue
+                ranks.remove(current)
+            insort(ranks, rank)
+            del ranks[self.MAX_LIMIT:]
+
+    def _ranked(self, start, end):
+        best = {}
+        for position in range(start, end):
+            key, kind, ref_id = self._entries[position]
+            label = self._labels[(kind, ref_id)][0]
+            rank = self._rank(key, self._keys[(kind, ref_id)], label, ref_id)
+            if (kind, ref_id) not in best or rank < best[(kind, ref_id)]:
+                best[(kind, ref_id)] = rank
+        top = {kind: [] for kind in KINDS}
+        for (kind, ref_id), rank in best.items():
+            top[kind].append(rank)
+        for kind in KINDS:
+            top[kind].sort()
+            del top[kind][self.MAX_LIMIT:]
+        return top
+
+    def lookup(self, prefix, limit=8):
+        """{'product': [...], 'category': [...], 'brand': [...]} for a typed prefix, best first."""
+        result = {kind: [] for kind in KINDS}
+        key = ' '.join(tokenize(prefix))
+        if not key:
+            return result
+        limit = min(limit, self.MAX_LIMIT)
+        with self._lock:
+            start = bisect_left(self._entries, (key,))
+            # keys are lower-case ascii, so every key starting with the prefix sorts before this
+            end = bisect_left(self._entries, (key + '\x7f',))
+            if end - start <= self.SCAN_LIMIT:
+                top = self._ranked(start, end)
+            else:
+                top = self._top.get(key)
+                if top is None:
+                    top = self._top[key] = self._ranked(start, end)
+                    if len(self._top) > self.MAX_CACHED:
+                        self._top.popitem(last=False)
+                else:
+                    self._top.move_to_end(key)
+            for kind in KINDS:
+                for rank in top[kind][:limit]:
+                    label, slug, full_key = self._labels[(kind, rank[-1])]
+                    result[kind].append({'id': rank[-1], 'name': label, 'slug': slug})
+        return result
+
+
+def item_entry(item):
+    """(kind, id, label, slug) for an item, or None when it must not be suggested."""
+    if item['status'] != Item.ACTIVE:
+        return None
+    return PRODUCT, item['id'], item['name'], item['slug']
+
+
+def category_entry(category):
+    if category['status'] != Category.ACTIVE:
+        return None
+    return (BRAND if category['isBrand'] else CATEGORY), category['id'], category['name'], category['slug']
+
+
+def build_index(generation):
+    index = SuggestIndex()
+    for row in Item.objects.filter(status=Item.ACTIVE).values('id', 'name', 'slug', 'status').iterator(chunk_size=2000):
+        index.add(*item_entry(row), bulk=True)
+    for row in Category.objects.filter(status=Category.ACTIVE).values('id', 'name', 'slug', 'status', 'isBrand'):
+        index.add(*category_entry(row), bulk=True)
+    index.finish_bulk()
+    index.generation = generation
+    return index
@@ -10,6 +10,7 @@ from rest_framework.exceptions import ValidationError
 from allauth.account import app_settings
 from dj_rest_auth.serializers import PasswordResetSerializer
 import os
+from inara import imagevariants
 
 UserModel = get_user_model()
 
@@ -193,10 +194,11 @@ class ItemSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'extPosId', 'sku', 'slug', 'name', 'description', 
             'mrp', 'salePrice', 'discount', 'stock', 'stockCheckQty',
-            'weight', 'image', 'status', 'appliesOnline', 'isNewArrival',
+            'weight', 'image', 'imageVariants', 'status', 'appliesOnline', 'isNewArrival',
             'isFeatured', 'newArrivalTill', 'manufacturer', 'aliasCode',
             'metaTitle', 'metaDescription', 'timestamp'
         ]
+        read_only_fields = ['imageVariants']
         # depth = 2
     
     def to_representation(self, instance):
@@ -205,6 +207,23 @@ class ItemSerializer(serializers.ModelSerializer):
         # Ensure image returns the full URL when reading
         if instance.image:
             representation['image'] = instance.image.url
+        # {format: {width: url}}, None until the variants of the current image are rendered
+        representation['imageVariants'] = imagevariants.current(instance.image.name, instance.imageVariants)
+        return representation
+
+class CategoryListingSerializer(serializers.ModelSerializer):
+    # Same payload as ItemSerializer, read from the CategoryListing read model
+    id = serializers.IntegerField(source='itemId_id', read_only=True)
+
+    class Meta:
+        model = CategoryListing
+        fields = ItemSerializer.Meta.fields
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        if instance.image:
+            representation['image'] = instance.image.url
+        representation['imageVariants'] = imagevariants.current(instance.image.name, instance.imageVariants)
         return representation
 
 class UserSerializer(serializers.ModelSerializer):
@@ -230,8 +249,14 @@ class ItemGallerySerializer(serializers.ModelSerializer):
     class Meta:
         model = ItemGallery
         fields = '__all__'
+        read_only_fields = ['imageVariants']
         # depth = 2
 
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        representation['imageVariants'] = imagevariants.current(instance.image.name, instance.imageVariants)
+        return representation
+
 class BundleSerializer(serializers.ModelSerializer):
     # image = serializers.SerializerMethodField('get_image_url')
     class Meta:
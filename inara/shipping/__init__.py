@@ -0,0 +1,3 @@
+# Shipping quotes: cached courier rate tables per city type
+from .rates import RateTable
+from .service import UnknownCity, cart_weight, get_rates, load_rates, quotes
@@ -0,0 +1,43 @@
+"""
+In-memory courier rate tables
+
+One RateTable per (city type, courier), built from its active CourierConfiguration rows: the
+weight slabs sorted ascending for bisect, the 1 kg base price and the per-kg add-on price used
+above the last slab.
+"""
+import math
+from bisect import bisect_right
+
+
+class RateTable(object):
+
+    def __init__(self, courierId, courierName):
+        self.courierId = courierId
+        self.courierName = courierName
+        self.weights = []
+        self.prices = []
+        self.base = None
+        self.addOn = None
+
+    def add(self, weight, price, addOn):
+        if addOn:
+            self.addOn = price
+            return
+        if weight is None:
+            return
+        weight = float(weight)
+        if weight == 1:
+            self.base = price
+        # slabs arrive ordered by weight
+        self.weights.append(weight)
+        self.prices.append(price)
+
+    def quote(self, totalWeight):
+        """Price for totalWeight kg, or None when the table has no slab or add-on for it."""
+        # first slab strictly heavier than the parcel
+        index = bisect_right(self.weights, totalWeight)
+        if index < len(self.weights):
+            return self.prices[index]
+        if self.base is None or self.addOn is None:
+            return None
+        return self.base + self.addOn * math.ceil(totalWeight - 1)
@@ -0,0 +1,80 @@
+"""
+Shipping quotes
+
+get_rates() returns the per-process snapshot of every active courier rate table, grouped by
+city type, together with the city name -> city type map. It is rebuilt when the 'shipping'
+cache tag moves on, which every City, Courier and CourierConfiguration save/delete does. A
+quote is then one slug__in query for the cart weights and a bisect per courier.
+"""
+import logging
+import threading
+
+from inara.caching import tag_versions
+from inara.models import City, CourierConfiguration, Item
+from .rates import RateTable
+
+logger = logging.getLogger(__name__)
+
+SHIPPING_TAG = 'shipping'
+
+_rates = None
+_ratesVersion = None
+_lock = threading.Lock()
+
+
+class UnknownCity(Exception):
+    pass
+
+
+def load_rates():
+    tables = {}
+    rows = (CourierConfiguration.objects.filter(status=CourierConfiguration.ACTIVE)
+            .values('cityType', 'weight', 'price', 'addOn', 'courier_id', 'courier__name', 'couriername')
+            .order_by('cityType', 'courier_id', 'weight'))
+    for row in rows:
+        key = (row['cityType'], row['courier_id'])
+        if key not in tables:
+            tables[key] = RateTable(row['courier_id'], row['courier__name'] or row['couriername'])
+        tables[key].add(row['weight'], row['price'], row['addOn'])
+    byCityType = {}
+    for (cityType, courierId), table in tables.items():
+        byCityType.setdefault(cityType, []).append(table)
+    cities = dict(City.objects.values_list('name', 'type'))
+    return {'tables': byCityType, 'cities': cities}
+
+
+def get_rates():
+    """The cached rate snapshot of this process, rebuilt after any shipping configuration change."""
+    global _rates, _ratesVersion
+    version = tag_versions([SHIPPING_TAG])[0]
+    if _rates is not None and _ratesVersion == version:
+        return _rates
+    with _lock:
+        if _rates is None or _ratesVersion != version:
+            _rates = load_rates()
+            _ratesVersion = version
+    return _rates
+
+
+def cart_weight(cart):
+    """Total cart weight in kg; items are stored in grams and loaded in one query."""
+    quantities = {}
+    for line in cart:
+        quantities[line['slug']] = quantities.get(line['slug'], 0) + float(line['qty'])
+    weights = Item.objects.filter(slug__in=list(quantities)).values_list('slug', 'weight')
+    grams = sum(float(weight or 0) * quantities[slug] for slug, weight in weights)
+    return grams / 1000
+
+
+def quotes(city, totalWeight):
+    """[{'courierId', 'courier', 'shippingCharges'}] for every courier serving the city, cheapest first."""
+    rates = get_rates()
+    if city not in rates['cities']:
+        raise UnknownCity("Unknown city %s" % city)
+    result = []
+    for table in rates['tables'].get(rates['cities'][city], []):
+        price = table.quote(totalWeight)
+        if price is not None:
+            result.append({'courierId': table.courierId, 'courier': table.courierName, 'shippingCharges': price})
+    result.sort(key=lambda quote: quote['shippingCharges'])
+    return result
@@ -1,11 +1,39 @@
+import logging
 import os
 
 from django.conf import settings
-from django.core.mail import send_mail
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
-from .models import Order
+from . import caching, categories, listing, notifications, rollups, search
+from .models import (
+    BlogPost,
+    Bundle,
+    BundleItem,
+    Category,
+    CategoryItem,
+    City,
+    Country,
+    Courier,
+    CourierConfiguration,
+    EmailOutbox,
+    FooterColumnItem,
+    Individual_BoxOrder,
+    Item,
+    ItemGallery,
+    Order,
+    ProductReview,
+    SectionSequence,
+    SiteImage,
+    SiteSettings,
+    User,
+    UserVoucher,
+    Voucher,
+)
+
+logger = logging.getLogger(__name__)
 
 
 def _get_order_alert_recipients():
@@ -38,10 +66,162 @@ def send_new_order_notification(sender, instance, created, **kwargs):
         f"Timestamp: {instance.timestamp}\n"
     )
 
-    send_mail(
-        subject=subject,
-        message=body,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=recipients,
-        fail_silently=False,
-    )
+    # queued with the order and sent by the outbox worker after commit
+    notifications.enqueue(EmailOutbox.ORDER_ALERT, subject, recipients, body,
+                          from_email=settings.DEFAULT_FROM_EMAIL, order=instance)
+
+
+def _refresh_search_document(item_id):
+    try:
+        search.refresh_documents([item_id])
+    except Exception as e:
+        logger.error("Exception in refresh_search_document: %s " % (str(e)))
+
+
+@receiver(post_save, sender=Item)
+def refresh_item_search_document(sender, instance, **kwargs):
+    transaction.on_commit(lambda: _refresh_search_document(instance.id))
+
+
+@receiver(post_delete, sender=Item)
+def remove_item_search_document(sender, instance, **kwargs):
+    item_id = instance.id
+    transaction.on_commit(lambda: search.remove_documents([item_id]))
+
+
+@receiver(post_delete, sender=Item)
+def remove_item_from_catalogue(sender, instance, **kwargs):
+    # a deleted item leaves no listing rows for refresh_items to compare
+    caching.invalidate("catalogue")
+
+
+def _refresh_listing(item_ids):
+    try:
+        listing.refresh_items(item_ids)
+    except Exception as e:
+        logger.error("Exception in refresh_listing: %s " % (str(e)))
+
+
+@receiver(post_save, sender=Item)
+def refresh_item_listing(sender, instance, **kwargs):
+    item_id = instance.id
+    transaction.on_commit(lambda: _refresh_listing([item_id]))
+
+
+@receiver(post_save, sender=CategoryItem)
+@receiver(post_delete, sender=CategoryItem)
+def refresh_category_item_listing(sender, instance, **kwargs):
+    item_id = instance.itemId_id
+    if item_id:
+        transaction.on_commit(lambda: _refresh_listing([item_id]))
+
+
+def _refresh_closure(category_id):
+    try:
+        categories.refresh_closure([category_id])
+    except Exception as e:
+        logger.error("Exception in refresh_closure: %s " % (str(e)))
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_closure(sender, instance, **kwargs):
+    category_id = instance.id
+    transaction.on_commit(lambda: _refresh_closure(category_id))
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_suggestions(sender, instance, **kwargs):
+    category_id = instance.id
+    transaction.on_commit(lambda: search.refresh_categories([category_id]))
+
+
+@receiver(post_delete, sender=Category)
+def remove_category_suggestions(sender, instance, **kwargs):
+    category_id = instance.id
+    transaction.on_commit(lambda: search.remove_categories([category_id]))
+
+
+# ---------------------------------------------------------------------------
+# Tag-versioned cache invalidation
+# ---------------------------------------------------------------------------
+
+CACHE_TAGS_BY_MODEL = {
+    Bundle: ("bundles",),
+    BundleItem: ("bundles",),
+    SectionSequence: ("homepage",),
+    Individual_BoxOrder: ("homepage",),
+    SiteSettings: ("site_settings",),
+    SiteImage: ("site_settings",),
+    FooterColumnItem: ("site_settings",),
+    ProductReview: ("reviews",),
+    BlogPost: ("blogs",),
+    Country: ("countries",),
+    City: ("shipping",),
+    Courier: ("shipping",),
+    CourierConfiguration: ("shipping",),
+    Voucher: ("vouchers",),
+}
+
+
+@receiver(post_save, sender=Order)
+def refresh_order_rollup(sender, instance, **kwargs):
+    rollups.orders_changed([instance.id])
+
+
+@receiver(post_delete, sender=Order)
+def refresh_deleted_order_rollup(sender, instance, **kwargs):
+    if instance.timestamp:
+        day = timezone.localdate(instance.timestamp)
+        transaction.on_commit(lambda: rollups.refresh_days([day]))
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def invalidate_item_cache(sender, instance, **kwargs):
+    # the slug tag is added explicitly, a deleted item is no longer there to look it up
+    caching.invalidate(*caching.item_tags([instance.id]), "item-slug:%s" % instance.slug)
+
+
+@receiver(post_save, sender=ItemGallery)
+@receiver(post_delete, sender=ItemGallery)
+def invalidate_item_gallery_cache(sender, instance, **kwargs):
+    if instance.itemId_id:
+        caching.invalidate(*caching.item_tags([instance.itemId_id]))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    caching.invalidate("categories", "category:%s" % instance.slug)
+
+
+@receiver(post_save, sender=CategoryItem)
+@receiver(post_delete, sender=CategoryItem)
+def invalidate_category_item_cache(sender, instance, **kwargs):
+    tags = ["items", "item:%s" % instance.itemId_id]
+    slug = Category.objects.filter(id=instance.categoryId_id).values_list("slug", flat=True).first()
+    if slug:
+        tags.append("category:%s" % slug)
+    caching.invalidate(*tags)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def retire_user_principal(sender, instance, **kwargs):
+    # role, status, is_active or password may have changed: retire the cached principal
+    caching.invalidate("user:%s" % instance.id)
+
+
+@receiver(post_save, sender=UserVoucher)
+@receiver(post_delete, sender=UserVoucher)
+def invalidate_user_voucher_cache(sender, instance, **kwargs):
+    caching.invalidate("user-vouchers:%s" % instance.user_id)
+
+
+def invalidate_model_cache(sender, instance, **kwargs):
+    caching.invalidate(*CACHE_TAGS_BY_MODEL[sender])
+
+
+for model in CACHE_TAGS_BY_MODEL:
+    post_save.connect(invalidate_model_cache, sender=model, dispatch_uid="cache_tags_save_%s" % model.__name__)
+    post_delete.connect(invalidate_model_cache, sender=model, dispatch_uid="cache_tags_delete_%s" % model.__name__)
@@ -0,0 +1,2 @@
+# Streaming sitemap shards with a sitemap index
+from .service import entries, publish, write_sitemaps
@@ -0,0 +1,195 @@
+"""
+Sitemap generation
+
+entries() streams every URL of the storefront with .iterator(), items and categories
+carrying their real last modification (the latest history row, else the item's timestamp).
+write_sitemaps() writes them straight to disk in shards of at most SHARD_SIZE URLs plus a
+sitemap_index.xml, hashing each file as it goes, and publish() uploads only the files whose
+hash differs from the one stored in the object's metadata by the previous run. The files are
+written to a temporary directory; the index points at the shards where publish() puts them,
+the bucket's public URL plus S3_PREFIX.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from xml.sax.saxutils import escape
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from ecommerce_backend.settings import HostDomain
+
+from inara.models import Bundle, Category, Item
+
+logger = logging.getLogger(__name__)
+
+SHARD_SIZE = getattr(settings, 'SITEMAP_SHARD_SIZE', 50000)
+CHUNK_SIZE = 2000
+SHARD_NAME = 'sitemap-%s.xml'
+INDEX_NAME = 'sitemap_index.xml'
+S3_PREFIX = getattr(settings, 'SITEMAP_S3_PREFIX', os.path.dirname(settings.DEFAULT_SITEMAP_S3))
+
+SCHEMA = ('xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+          'xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9 '
+          'http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd" '
+          'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"')
+HEADER = "<?xml version='1.0' encoding='utf-8'?>\n"
+
+# (path, changefreq, priority)
+LEADING_PAGES = (('', 'daily', '1.0'), ('login', 'weekly', '0.6'))
+TRAILING_PAGES = (('signup', 'weekly', '0.6'), ('return-policy', 'weekly', '0.6'), ('about-us', 'weekly', '0.6'),
+                  ('privacy-policy', 'weekly', '0.6'), ('contact-us', 'weekly', '0.6'))
+
+
+def _last_changed(model):
+    # latest history row of each object; the history table is indexed on id
+    return Subquery(model.history.model.objects.filter(id=OuterRef('id')).order_by('-history_date').values('history_date')[:1])
+
+
+def _slugs(queryset, lastmod):
+    return queryset.annotate(lastmod=lastmod).order_by('id').values_list('slug', 'lastmod').iterator(chunk_size=CHUNK_SIZE)
+
+
+def entries(base_url=None):
+    """Yield (loc, lastmod datetime or None, changefreq, priority) for every sitemap URL, in a stable order."""
+    base_url = base_url or HostDomain
+    for path, changefreq, priority in LEADING_PAGES:
+        yield base_url + path, None, changefreq, priority
+    sections = (
+        ('product/', _slugs(Item.objects.filter(status=Item.ACTIVE, appliesOnline=1), Coalesce(_last_changed(Item), 'timestamp'))),
+        ('category/', _slugs(Category.objects.filter(status=Category.ACTIVE, isBrand=False), _last_changed(Category))),
+        ('bundle/', _slugs(Bundle.objects.filter(status=Bundle.ACTIVE), _last_changed(Bundle))),
+        ('brand/', _slugs(Category.objects.filter(status=Category.ACTIVE, isBrand=True), _last_changed(Category))),
+    )
+    for prefix, rows in sections:
+        for slug, lastmod in rows:
+            yield base_url + prefix + slug, lastmod, 'weekly', '0.8'
+    for path, changefreq, priority in TRAILING_PAGES:
+        yield base_url + path, None, changefreq, priority
+
+
+class _Writer(object):
+    # one XML file written incrementally, hashed as it is written
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        self.file = open(path, 'w', encoding='utf-8')
+        self.digest = hashlib.sha256()
+        self.count = 0
+        self.lastmod = None
+        self.write('%s<%s %s>' % (HEADER, root, SCHEMA))
+
+    def write(self, text):
+        self.file.write(text)
+        self.digest.update(text.encode('utf-8'))
+
+    def add(self, tag, loc, lastmod=None, changefreq=None, priority=None):
+        parts = ['<%s><loc>%s</loc>' % (tag, escape(loc))]
+        if lastmod is not None:
+            parts.append('<lastmod>%s</lastmod>' % lastmod.strftime('%Y-%m-%d'))
+            self.lastmod = lastmod if self.lastmod is None else max(self.lastmod, lastmod)
+        if changefreq:
+            parts.append('<changefreq>%s</changefreq>' % changefreq)
+        if priority:
+            parts.append('<priority>%s</priority>' % priority)
+        parts.append('</%s>' % tag)
+        self.write(''.join(parts))
+        self.count += 1
+
+    def close(self):
+        self.write('</%s>\n' % self.root)
+        self.file.close()
+        return self.digest.hexdigest()
+
+    def discard(self):
+        # a failed run leaves no open handle behind
+        if not self.file.closed:
+            self.file.close()
+
+
+def write_sitemaps(directory, shard_url, shard_size=SHARD_SIZE, rows=None):
+    """
+    Write the sitemap shards and their index into directory without holding the URLs in
+    memory; the index lists each shard as shard_url + its file name. Returns
+    [(file name, sha256)] with the index last.
+    """
+    written = []
+    shards = []
+    shard = index = None
+    try:
+        for loc, lastmod, changefreq, priority in (entries() if rows is None else rows):
+            if shard is None or shard.count >= shard_size:
+                if shard is not None:
+                    written.append((os.path.basename(shard.path), shard.close()))
+                    shards.append(shard)
+                shard = _Writer(os.path.join(directory, SHARD_NAME % (len(shards) + 1)), 'urlset')
+            shard.add('url', loc, lastmod, changefreq, priority)
+        if shard is not None:
+            written.append((os.path.basename(shard.path), shard.close()))
+            shards.append(shard)
+
+        index = _Writer(os.path.join(directory, INDEX_NAME), 'sitemapindex')
+        for shard in shards:
+            index.add('sitemap', shard_url + os.path.basename(shard.path), shard.lastmod)
+        written.append((INDEX_NAME, index.close()))
+    finally:
+        for writer in (shard, index):
+            if writer is not None:
+                writer.discard()
+    return written
+
+
+def _key(prefix, name):
+    return '%s/%s' % (prefix, name) if prefix else name
+
+
+def _remote_hash(client, bucket, key):
+    # None when the object is missing or predates the hash metadata
+    try:
+        return client.head_object(Bucket=bucket, Key=key).get('Metadata', {}).get('sha256')
+    except ClientError:
+        return None
+
+
+def _exists(client, bucket, key):
+    try:
+        client.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError:
+        return False
+
+
+def _upload(client, bucket, path, key, digest):
+    client.upload_file(Filename=path, Bucket=bucket, Key=key,
+                       ExtraArgs={'ACL': 'public-read', 'ContentType': 'application/xml', 'Metadata': {'sha256': digest}})
+
+
+def publish(client, bucket, bucket_url=None, prefix=S3_PREFIX):
+    """
+    Regenerate the sitemaps and upload the files that changed since the last run; the index
+    also replaces the legacy single sitemap at DEFAULT_SITEMAP_S3. bucket_url is the bucket's
+    public URL (AWS_BASE_URL), which the shard URLs in the index start with. Returns the
+    uploaded keys.
+    """
+    if bucket_url is None:
+        bucket_url = getattr(settings, 'SITEMAP_BUCKET_URL', os.environ.get('AWS_BASE_URL', ''))
+    uploaded = []
+    with tempfile.TemporaryDirectory(prefix='sitemap-') as directory:
+        written = write_sitemaps(directory, bucket_url + _key(prefix, ''))
+        targets = [(name, digest, _key(prefix, name)) for name, digest in written]
+        targets.append((INDEX_NAME, written[-1][1], settings.DEFAULT_SITEMAP_S3))
+        for name, digest, key in targets:
+            if _remote_hash(client, bucket, key) != digest:
+                _upload(client, bucket, os.path.join(directory, name), key, digest)
+                uploaded.append(key)
+
+    # shards left over from a run that needed more of them
+    number = len(written)
+    while _exists(client, bucket, _key(prefix, SHARD_NAME % number)):
+        client.delete_object(Bucket=bucket, Key=_key(prefix, SHARD_NAME % number))
+        number += 1
+    logger.info("Sitemap: %s files written, uploaded %s" % (len(written), ', '.join(uploaded) or 'none'))
+    return uploaded
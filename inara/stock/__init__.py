@@ -0,0 +1,2 @@
+# Stock service: guarded single-UPDATE reservations, releases and decrements per order
+from .service import InsufficientStock, commit, release, release_expired, reserve
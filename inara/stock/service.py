@@ -0,0 +1,165 @@
+"""
+Stock reservation and decrement
+
+Every stock change is one UPDATE over all the items of an order, with the per-item quantity
+in a CASE expression and the oversell guard in the WHERE clause:
+
+    UPDATE item SET reservedStock = reservedStock + CASE id WHEN .. THEN .. END
+     WHERE id IN (..) AND (stock IS NULL OR stock - reservedStock >= CASE id WHEN .. END)
+
+If fewer rows match than were asked for, the order's transaction is rolled back with
+InsufficientStock. Placing an order reserves its units, confirming it (saveOrderDB) turns the
+reservation into a decrement, and cancelling it (or the reservation expiring) gives them back.
+Items without a stock figure are not stock managed and always pass.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Value, When
+from django.utils import timezone
+
+from inara import caching, listing
+from inara.models import Item, Order, OrderDescription, StockReservation
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_MINUTES = getattr(settings, 'STOCK_RESERVATION_MINUTES', 30)
+
+
+class InsufficientStock(Exception):
+
+    def __init__(self, skus, quantities=None):
+        super().__init__("Insufficient stock for %s" % ', '.join(skus))
+        self.skus = list(skus)
+        # {item id: units still needed}, set while the failed UPDATE is being rolled back
+        self.quantities = quantities
+
+
+def _quantity_case(quantities):
+    return Case(*[When(id=itemId, then=Value(qty)) for itemId, qty in quantities.items()],
+                output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def _changed(item_ids):
+    # queryset updates send no post_save: refresh the listing rows and cached pages ourselves.
+    # Only these items' pages moved, so the global 'items' tag is left alone.
+    item_ids = list(item_ids)
+    caching.invalidate(*[tag for tag in caching.item_tags(item_ids) if tag != 'items'])
+    transaction.on_commit(lambda: listing.refresh_items(item_ids))
+
+
+def _short_skus(quantities):
+    # which items could not cover quantities on top of what is already reserved
+    rows = Item.objects.filter(id__in=list(quantities)).values('id', 'sku', 'stock', 'reservedStock')
+    short = []
+    for row in rows:
+        if row['stock'] is None:
+            continue
+        if row['stock'] - row['reservedStock'] < quantities[row['id']]:
+            short.append(row['sku'])
+    found = {row['id'] for row in rows}
+    return short + ['#%s' % itemId for itemId in quantities if itemId not in found]
+
+
+def _totals(pairs):
+    quantities = {}
+    for itemId, qty in pairs:
+        quantities[itemId] = quantities.get(itemId, 0) + qty
+    return quantities
+
+
+def reserve(order, quantities):
+    """Hold quantities ({item id: qty}) for order; raises InsufficientStock, holding nothing."""
+    quantities = {itemId: qty for itemId, qty in quantities.items() if qty > 0}
+    if not quantities:
+        return 0
+    case = _quantity_case(quantities)
+    try:
+        with transaction.atomic():
+            updated = (Item.objects.filter(id__in=list(quantities))
+                       .filter(Q(stock__isnull=True) | Q(stock__gte=F('reservedStock') + case))
+                       .update(reservedStock=F('reservedStock') + case))
+            if updated != len(quantities):
+                raise InsufficientStock([])
+            StockReservation.objects.bulk_create([StockReservation(orderId=order, itemId_id=itemId, qty=qty)
+                                                  for itemId, qty in quantities.items()])
+    except InsufficientStock:
+        # name the short items from the rolled back state
+        raise InsufficientStock(_short_skus(quantities))
+    # reservedStock is not shown anywhere cached, so reserving invalidates nothing
+    return updated
+
+
+def _release(reservations):
+    # reservations: queryset of ACTIVE rows; locked so a concurrent release can't count them twice
+    rows = list(reservations.select_for_update().values_list('id', 'itemId', 'qty'))
+    if not rows:
+        return 0
+    quantities = _totals((itemId, qty) for rowId, itemId, qty in rows)
+    case = _quantity_case(quantities)
+    Item.objects.filter(id__in=list(quantities)).update(reservedStock=F('reservedStock') - case)
+    StockReservation.objects.filter(id__in=[rowId for rowId, itemId, qty in rows]).update(status=StockReservation.RELEASED)
+    return len(rows)
+
+
+def release(order_ids):
+    """Give back the units held by the given orders; returns the number of reservations released."""
+    with transaction.atomic():
+        return _release(StockReservation.objects.filter(orderId__in=list(order_ids), status=StockReservation.ACTIVE))
+
+
+def release_expired(minutes=RESERVATION_MINUTES):
+    """
+    Release the holds older than minutes of orders that are still unpaid and neither PENDING
+    nor CONFIRMED. A PENDING order (cash on delivery, waiting for an admin) keeps its units
+    until it is confirmed or cancelled, so its commit() never has to compete for them.
+    """
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    reservations = (StockReservation.objects.filter(status=StockReservation.ACTIVE, timestamp__lt=cutoff)
+                    .filter(Q(orderId__paymentstatus='unpaid') | Q(orderId__paymentstatus__isnull=True))
+                    .exclude(orderId__status__in=[Order.PENDING, Order.CONFIRMED]))
+    with transaction.atomic():
+        return _release(reservations)
+
+
+def _commit(order):
+    with transaction.atomic():
+        reservations = list(StockReservation.objects.select_for_update()
+                            .filter(orderId=order, status=StockReservation.ACTIVE).values_list('id', 'itemId', 'qty'))
+        if not reservations and StockReservation.objects.filter(orderId=order, status=StockReservation.COMMITTED).exists():
+            # confirmed twice: the first commit already took the units out
+            return 0, set()
+        held = _totals((itemId, qty) for rowId, itemId, qty in reservations)
+        lines = OrderDescription.objects.filter(order=order, isDeleted=False).values_list('itemSku', 'itemQty')
+        skus = _totals((sku, qty or 0) for sku, qty in lines)
+        itemIds = dict(Item.objects.filter(sku__in=list(skus)).values_list('sku', 'id'))
+        quantities = _totals((itemIds[sku], qty) for sku, qty in skus.items() if sku in itemIds and qty)
+        # a line removed after placement still has to hand back its reservation
+        itemIdsTouched = set(quantities) | set(held)
+        if not itemIdsTouched:
+            return 0, itemIdsTouched
+        decrement = _quantity_case({itemId: quantities.get(itemId, 0) for itemId in itemIdsTouched})
+        released = _quantity_case({itemId: held.get(itemId, 0) for itemId in itemIdsTouched})
+        updated = (Item.objects.filter(id__in=list(itemIdsTouched))
+                   .filter(Q(stock__isnull=True) | Q(stock__gte=F('reservedStock') + decrement - released))
+                   .update(stock=F('stock') - decrement, reservedStock=F('reservedStock') - released))
+        if updated != len(itemIdsTouched):
+            raise InsufficientStock([], {itemId: qty - held.get(itemId, 0) for itemId, qty in quantities.items()})
+        StockReservation.objects.filter(id__in=[rowId for rowId, itemId, qty in reservations]).update(status=StockReservation.COMMITTED)
+    return updated, itemIdsTouched
+
+
+def commit(order):
+    """
+    Take the order's units out of stock in one UPDATE and drop its reservation. The guard keeps
+    stock - reservedStock >= 0 afterwards, so units held for other orders are never sold.
+    """
+    try:
+        updated, itemIdsTouched = _commit(order)
+    except InsufficientStock as e:
+        raise InsufficientStock(_short_skus(e.quantities))
+    if itemIdsTouched:
+        _changed(itemIdsTouched)
+    return updated
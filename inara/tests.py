@@ -1,3 +1,470 @@
-from django.test import TestCase
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from inara import caching, imagesync, listing, notifications, orders, stock, vouchers
+from inara.caching import tags as caching_tags
+from inara.core.middlewares.externalPOS.Gofrugal_RPOS7.client import POSUnreachable, RPOS7Client
+from inara.core.middlewares.externalPOS.Gofrugal_RPOS7.item import RPOS7ItemSync
+from inara.facets import service as facets_service
+from inara.models import (Category, CategoryItem, EmailOutbox, ImageSyncFailure, Item, ItemGallery, Order, OrderDescription,
+                          StockReservation, User, UserVoucher, Voucher)
+
+
+class _POSHandler(BaseHTTPRequestHandler):
+    # pages answer {"page": n}; /flaky fails once with 503 per page, /offline always answers 424
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        page = int(parse_qs(url.query).get('page', ['1'])[0])
+        server = self.server
+        with server.lock:
+            server.requests.append((url.path, page, self.headers.get('X-Auth-Token')))
+            failFirst = url.path == '/flaky' and page not in server.failed
+            if failFirst:
+                server.failed.add(page)
+        if url.path == '/offline':
+            self._send(424, {})
+        elif failFirst:
+            self._send(503, {})
+        else:
+            self._send(200, {'page': page, 'total_pages': 5})
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class RPOS7ClientTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _POSHandler)
+        cls.server.lock = threading.Lock()
+        cls.server.requests = []
+        cls.server.failed = set()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base = 'http://127.0.0.1:%s' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests.clear()
+        self.server.failed.clear()
+
+    def test_pages_are_yielded_in_order(self):
+        with RPOS7Client(self.base + '/items', 'secret', workers=3, backoff=0) as client:
+            first = client.fetch()
+            pages = list(client.pages(first['total_pages'], start=2))
+        self.assertEqual([pageNo for pageNo, body in pages], [2, 3, 4, 5])
+        self.assertEqual([body['page'] for pageNo, body in pages], [2, 3, 4, 5])
+        self.assertTrue(all(token == 'secret' for path, page, token in self.server.requests))
+
+    def test_retries_server_errors(self):
+        with RPOS7Client(self.base + '/flaky', 'secret', workers=2, backoff=0) as client:
+            pages = dict(client.pages(3))
+        self.assertEqual(sorted(pages), [1, 2, 3])
+        # every page failed once and was fetched again
+        self.assertEqual(len(self.server.requests), 6)
+
+    def test_offline_store_raises(self):
+        with RPOS7Client(self.base + '/offline', 'secret', backoff=0) as client:
+            with self.assertRaises(POSUnreachable):
+                client.fetch()
+            with self.assertRaises(POSUnreachable):
+                list(client.pages(3))
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_ASYNC=False)
+class EmailOutboxTest(TestCase):
+
+    def _enqueue(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return notifications.enqueue(EmailOutbox.ORDER_CONFIRMATION, 'Order placed', [' buyer@example.com ', ''],
+                                         'Thanks', html_body='<p>Thanks</p>')
+
+    def test_enqueue_delivers_after_commit(self):
+        row = self._enqueue()
+        row.refresh_from_db()
+        self.assertEqual(row.status, EmailOutbox.SENT)
+        self.assertEqual(row.attempts, 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertEqual(mail.outbox[0].alternatives, [('<p>Thanks</p>', 'text/html')])
+
+    def test_nothing_is_queued_without_recipients(self):
+        self.assertIsNone(notifications.enqueue(EmailOutbox.ORDER_ALERT, 'Alert', ['', ' '], 'body'))
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_failed_rows_are_retried_until_max_attempts(self):
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=OSError('smtp down')):
+            row = self._enqueue()
+            row.refresh_from_db()
+            self.assertEqual((row.status, row.attempts, row.lastError), (EmailOutbox.PENDING, 1, 'smtp down'))
+            self.assertEqual(notifications.deliver(), (0, 1))
+        self.assertEqual(notifications.deliver(), (1, 0))
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts, row.lastError), (EmailOutbox.SENT, 3, None))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_rows_give_up_after_max_attempts(self):
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=OSError('smtp down')), \
+                mock.patch('inara.notifications.service.MAX_ATTEMPTS', 2):
+            row = self._enqueue()
+            notifications.deliver()
+            row.refresh_from_db()
+            self.assertEqual((row.status, row.attempts), (EmailOutbox.FAILED, 2))
+            # given up rows are no longer picked up
+            self.assertEqual(notifications.deliver(), (0, 0))
+        self.assertEqual(notifications.pending_count(), 0)
+        self.assertEqual(mail.outbox, [])
+
+
+class PlaceOrderTest(TestCase):
+
+    def setUp(self):
+        self.item = Item.objects.create(name='Walnuts', slug='walnuts', sku='WAL-1', extPosId=1, status=Item.ACTIVE,
+                                        mrp=1000, salePrice=900, discount=10, stock=5)
+        self.valueDict = {'name': 'Buyer', 'email': 'buyer@example.com', 'phone': '0300', 'phone2': '',
+                          'city': 'Chitral', 'address': 'Main Bazaar'}
+
+    def _cart(self, price, qty=2):
+        return [{'sku': 'WAL-1', 'qty': qty, 'price': price, 'name': 'Walnuts'}]
+
+    def test_discounted_price_is_accepted(self):
+        order, lines, shipping = orders.place_order(None, self.valueDict, self._cart(810), 1620, 0)
+        self.assertEqual(order.totalItems, 2)
+        self.assertEqual([(line.itemIndPrice, line.itemTotalPrice) for line in lines], [(Decimal(810), Decimal(1620))])
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.reservedStock, 2)
+
+    def test_bill_comes_from_the_priced_lines(self):
+        order, lines, shipping = orders.place_order(None, self.valueDict, self._cart(810), 5, 200)
+        order.refresh_from_db()
+        self.assertEqual((order.totalBill, order.discountedBill, order.deliveryCharges),
+                         (Decimal(1820), Decimal(1820), Decimal(200)))
+
+    def test_free_item_is_accepted(self):
+        Item.objects.filter(id=self.item.id).update(salePrice=0, discount=0)
+        order, lines, shipping = orders.place_order(None, self.valueDict, self._cart(0, qty=1), 0, 0)
+        self.assertEqual(lines[0].itemTotalPrice, 0)
+
+    def test_unknown_price_is_rejected(self):
+        with self.assertRaises(orders.OrderValidationError) as raised:
+            orders.place_order(None, self.valueDict, self._cart(500), 1000, 0)
+        self.assertEqual(raised.exception.skus, ['WAL-1'])
+        self.assertFalse(Order.objects.exists())
+
+
+class _FakeBucket(object):
+    # the list_objects_v2 paginator of an S3 client over {key: last modified}, two keys a page
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        for start in range(0, len(keys), 2):
+            yield {'Contents': [{'Key': key, 'LastModified': self.objects[key]} for key in keys[start:start + 2]]}
+
+
+class ImageReconcileTest(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.first = Item.objects.create(name='First', slug='first', sku='F-1', extPosId=101, status=Item.ACTIVE)
+        self.second = Item.objects.create(name='Second', slug='second', sku='S-1', extPosId=102, status=Item.ACTIVE,
+                                          image='idris/asset/102.jpg')
+        ItemGallery.objects.create(itemId=self.first, image='idris/asset/101_1.png')
+        ItemGallery.objects.create(itemId=self.first, image='idris/asset/101_2.png')
+        self.bucket = _FakeBucket({
+            'idris/asset/': self.now,
+            'idris/asset/101.jpg': self.now,            # main image
+            'idris/asset/101_1.jpg': self.now,          # replaces the .png of the same gallery image
+            'idris/asset/101_3.jpg': self.now,          # new gallery image
+            'idris/asset/999.jpg': self.now,            # no such item
+            'idris/asset/bad(1).jpg': self.now,         # not an image key
+            'deleted/idris/asset/101_2.png': self.now,
+            'deleted/idris/asset/102.jpg': self.now,
+        })
+
+    def test_reconcile_applies_changes_and_records_failures(self):
+        result = imagesync.reconcile(self.bucket, 'bucket')
+        self.assertEqual(result['applied'], 5)
+        self.assertEqual(Item.objects.get(id=self.first.id).image.name, 'idris/asset/101.jpg')
+        self.assertEqual(Item.objects.get(id=self.second.id).image.name, imagesync.service.DEFAULT_IMAGE)
+        self.assertEqual(sorted(ItemGallery.objects.filter(itemId=self.first).values_list('image', flat=True)),
+                         ['idris/asset/101_1.jpg', 'idris/asset/101_3.jpg'])
+        # the bulk writes keep the history
+        self.assertEqual(self.first.history.first().image, 'idris/asset/101.jpg')
+        self.assertEqual(self.second.history.first().image, imagesync.service.DEFAULT_IMAGE)
+        self.assertEqual(dict(ImageSyncFailure.objects.values_list('key', 'reason')),
+                         {'idris/asset/999.jpg': ImageSyncFailure.ITEM_NOT_FOUND,
+                          'idris/asset/bad(1).jpg': ImageSyncFailure.INVALID_NAME})
+        self.assertGreaterEqual(imagesync.get_watermark(), self.now)
+
+    def test_next_run_only_retries_failures_and_new_keys(self):
+        imagesync.reconcile(self.bucket, 'bucket')
+        Item.objects.filter(id=self.second.id).update(extPosId=999)
+        del self.bucket.objects['idris/asset/bad(1).jpg']
+        self.bucket.objects['idris/asset/101_4.jpg'] = timezone.now() + timedelta(seconds=5)
+        result = imagesync.reconcile(self.bucket, 'bucket')
+        self.assertEqual((result['applied'], result['resolved'], result['failures']), (2, 2, {}))
+        self.assertEqual(Item.objects.get(id=self.second.id).image.name, 'idris/asset/999.jpg')
+        self.assertTrue(ItemGallery.objects.filter(itemId=self.first, image='idris/asset/101_4.jpg').exists())
+        self.assertFalse(ImageSyncFailure.objects.exists())
+
+    def test_unresolved_failures_count_attempts(self):
+        imagesync.reconcile(self.bucket, 'bucket')
+        result = imagesync.reconcile(self.bucket, 'bucket')
+        self.assertEqual(result['applied'], 0)
+        self.assertEqual(set(ImageSyncFailure.objects.values_list('attempts', flat=True)), {2})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'facets-test'}})
+class FacetIndexCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        facets_service._local.clear()
+        self.built = []
+
+    def _build(self):
+        self.built.append(len(self.built) + 1)
+        return 'v%s' % self.built[-1]
+
+    def test_stale_index_is_not_kept_under_the_new_version(self):
+        self.assertEqual(facets_service._get_index('scope', ['scope-tag'], self._build), 'v1')
+        caching_tags._bump(['scope-tag'])
+        # another worker is rebuilding: the previous index is served but not kept locally
+        lock = caching_tags.LOCK_KEY % caching_tags._short('scope')
+        cache.add(lock, 'other worker', caching_tags.LOCK_TIMEOUT)
+        self.assertEqual(facets_service._get_index('scope', ['scope-tag'], self._build), 'v1')
+        cache.delete(lock)
+        self.assertEqual(facets_service._get_index('scope', ['scope-tag'], self._build), 'v2')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'catalogue-test'}})
+class CatalogueTagTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(slug='dry-fruits', name='Dry Fruits', status=Category.ACTIVE, appliesOnline=1)
+        self.item = Item.objects.create(name='Almonds', slug='almonds', sku='ALM-1', extPosId=201, status=Item.ACTIVE,
+                                        salePrice=700, stock=10)
+        CategoryItem.objects.create(categoryId=category, itemId=self.item)
+        self._refresh()
+
+    def _refresh(self, **values):
+        Item.objects.filter(id=self.item.id).update(**values)
+        with self.captureOnCommitCallbacks(execute=True):
+            listing.refresh_items([self.item.id])
+        return caching.tag_versions(['listing', 'catalogue'])
+
+    def test_stock_change_within_stock_leaves_the_catalogue(self):
+        listingVersion, catalogueVersion = caching.tag_versions(['listing', 'catalogue'])
+        self.assertEqual(self._refresh(stock=4), [listingVersion + 1, catalogueVersion])
+
+    def test_facet_changes_move_the_catalogue(self):
+        for values in ({'salePrice': 650}, {'stock': 0}, {'status': Item.INACTIVE}):
+            catalogueVersion = caching.tag_versions(['catalogue'])[0]
+            self.assertEqual(self._refresh(**values)[1], catalogueVersion + 1, values)
+
+
+class RPOS7ItemPageTest(TestCase):
+
+    def _row(self, itemId, price=100):
+        return {'itemId': itemId, 'itemName': 'Apricot %s' % itemId, 'detailedDescription': 'd', 'weightGrams': '5',
+                'appliesOnline': 1, 'manufacturer': 'm', 'length': 1.5, 'height': 2, 'weight': 0.1, 'width': 3, 'status': 'R',
+                'stock': [{'stock': 4.0, 'mrp': price, 'salePrice': price, 'others': '{"author":"A","isbn":"I"}', 'Cat1': '', 'Cat2': ''}]}
+
+    def _write(self, rows):
+        sync = RPOS7ItemSync()
+        errors = []
+        stats = sync._writePage(1, rows, dict(Item.objects.values_list('extPosId', 'syncHash')), {},
+                                set(Item.objects.values_list('slug', flat=True)), errors)
+        self.assertEqual(errors, [])
+        return stats
+
+    def test_creates_and_updates_keep_history(self):
+        self.assertEqual(self._write([self._row(1), self._row(2)])['created'], 2)
+        self.assertEqual(Item.history.filter(history_type='+').count(), 2)
+        stats = self._write([self._row(1, price=120), self._row(2)])
+        self.assertEqual((stats['updated'], stats['unchanged']), (1, 1))
+        self.assertEqual(list(Item.history.filter(history_type='~').values_list('extPosId', 'salePrice')), [(1, 120)])
+
+
+class StockReservationTest(TestCase):
+
+    def setUp(self):
+        self.walnuts = Item.objects.create(name='Walnuts', slug='walnuts', sku='WAL-1', extPosId=1, status=Item.ACTIVE,
+                                           mrp=900, salePrice=900, stock=5)
+        self.honey = Item.objects.create(name='Honey', slug='honey', sku='HON-1', extPosId=2, status=Item.ACTIVE,
+                                         mrp=1500, salePrice=1500, stock=3)
+        self.valueDict = {'name': 'Buyer', 'email': 'buyer@example.com', 'phone': '0300', 'phone2': '',
+                          'city': 'Chitral', 'address': 'Main Bazaar'}
+
+    def _order(self, *lines):
+        cart = [{'sku': item.sku, 'qty': qty, 'price': item.salePrice} for item, qty in lines]
+        return orders.place_order(None, self.valueDict, cart, 0, 0)[0]
+
+    def _levels(self, item):
+        item.refresh_from_db()
+        return item.stock, item.reservedStock
+
+    def test_reserve_refuses_to_oversell(self):
+        self._order((self.walnuts, 4))
+        with self.assertRaises(orders.OrderValidationError) as raised:
+            self._order((self.honey, 1), (self.walnuts, 2))
+        self.assertEqual(raised.exception.skus, ['WAL-1'])
+        # the whole second order rolled back, the honey included
+        self.assertEqual(self._levels(self.walnuts), (5, 4))
+        self.assertEqual(self._levels(self.honey), (3, 0))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_commit_turns_the_hold_into_a_decrement_once(self):
+        order = self._order((self.walnuts, 2), (self.honey, 1))
+        self.assertEqual(stock.commit(order), 2)
+        self.assertEqual(self._levels(self.walnuts), (3, 0))
+        self.assertEqual(self._levels(self.honey), (2, 0))
+        # confirming again takes nothing more
+        self.assertEqual(stock.commit(order), 0)
+        self.assertEqual(self._levels(self.walnuts), (3, 0))
+
+    def test_commit_hands_back_a_removed_line(self):
+        order = self._order((self.walnuts, 2), (self.honey, 1))
+        OrderDescription.objects.filter(order=order, itemSku='HON-1').update(isDeleted=True)
+        stock.commit(order)
+        self.assertEqual(self._levels(self.walnuts), (3, 0))
+        self.assertEqual(self._levels(self.honey), (3, 0))
+
+    def test_commit_never_sells_units_held_for_others(self):
+        order = self._order((self.walnuts, 2))
+        self._order((self.walnuts, 3))
+        # the first order was edited up to 3 units after placement; only 2 are free for it
+        OrderDescription.objects.filter(order=order).update(itemQty=3)
+        with self.assertRaises(stock.InsufficientStock) as raised:
+            stock.commit(order)
+        self.assertEqual(raised.exception.skus, ['WAL-1'])
+        self.assertEqual(self._levels(self.walnuts), (5, 5))
+
+    def test_release_gives_the_units_back_once(self):
+        order = self._order((self.walnuts, 2))
+        self.assertEqual(stock.release([order.id]), 1)
+        self.assertEqual(stock.release([order.id]), 0)
+        self.assertEqual(self._levels(self.walnuts), (5, 0))
+
+    def test_expired_holds_of_pending_orders_are_kept(self):
+        unconfirmed = self._order((self.walnuts, 1))
+        pending = self._order((self.walnuts, 2))
+        paid = self._order((self.walnuts, 1))
+        Order.objects.filter(id=pending.id).update(status=Order.PENDING)
+        Order.objects.filter(id=paid.id).update(paymentstatus='paid')
+        StockReservation.objects.update(timestamp=timezone.now() - timedelta(minutes=stock.service.RESERVATION_MINUTES + 1))
+        self.assertEqual(stock.release_expired(), 1)
+        self.assertEqual(list(StockReservation.objects.filter(status=StockReservation.RELEASED).values_list('orderId', flat=True)),
+                         [unconfirmed.id])
+        self.assertEqual(self._levels(self.walnuts), (5, 3))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'voucher-test'}})
+class VoucherRedeemTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        vouchers.service._vouchers = None
+        self.user = User.objects.create(username='buyer', email='buyer@example.com')
+        self.voucher = Voucher.objects.create(name='Eid', code='EID10', discount=10, status=vouchers.service.ACTIVE_STATUS,
+                                              startdate=timezone.now() - timedelta(days=1),
+                                              enddate=timezone.now() + timedelta(days=1))
+
+    def _redeem(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return vouchers.redeem(self.user.id, 'EID10')
+
+    def test_first_redeem_records_the_use(self):
+        self.assertEqual(self._redeem()['id'], self.voucher.id)
+        self.assertEqual(list(UserVoucher.objects.values_list('user', 'voucher', 'vouchercode', 'isused')),
+                         [(self.user.id, self.voucher.id, 'EID10', True)])
+        with self.assertRaises(vouchers.InvalidVoucher) as raised:
+            vouchers.validate('EID10', self.user.id)
+        self.assertEqual(raised.exception.status, 409)
+
+    def test_second_redeem_is_refused(self):
+        self._redeem()
+        with self.assertRaises(vouchers.InvalidVoucher) as raised:
+            self._redeem()
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(UserVoucher.objects.count(), 1)
+
+    def test_unused_row_is_flipped(self):
+        UserVoucher.objects.create(user=self.user, voucher=self.voucher, vouchercode='EID10', isused=False)
+        self._redeem()
+        self.assertEqual(list(UserVoucher.objects.values_list('isused', flat=True)), [True])
+
+
+class VoucherUniqueMigrationTest(TransactionTestCase):
+    before = [('inara', '0009_stockreservation')]
+    after = [('inara', '0010_voucher_unique')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+        self.apps = self.executor.loader.project_state(self.before).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_are_merged_and_renamed(self):
+        Voucher = self.apps.get_model('inara', 'Voucher')
+        UserVoucher = self.apps.get_model('inara', 'UserVoucher')
+        User = self.apps.get_model('inara', 'User')
+        now = timezone.now()
+        values = {'name': 'v', 'discount': 5, 'status': 1, 'startdate': now, 'enddate': now}
+        long = 'X' * 100
+        first = Voucher.objects.create(code='EID', **values)
+        copy = Voucher.objects.create(code='EID', **values)
+        # already holds the code the copy would be renamed to
+        Voucher.objects.create(code='EID-%s' % copy.id, **values)
+        Voucher.objects.create(code=long, **values)
+        longCopy = Voucher.objects.create(code=long, **values)
+        user = User.objects.create(username='buyer', email='buyer@example.com')
+        UserVoucher.objects.create(user=user, voucher=first, isused=False)
+        UserVoucher.objects.create(user=user, voucher=first, isused=True)
+
+        MigrationExecutor(connection).migrate(self.after)
+
+        codes = dict(Voucher.objects.values_list('id', 'code'))
+        self.assertEqual(len(set(codes.values())), len(codes))
+        self.assertEqual(codes[copy.id], 'EID-%s-2' % copy.id)
+        self.assertEqual(codes[longCopy.id], 'X' * (100 - len('-%s' % longCopy.id)) + '-%s' % longCopy.id)
+        self.assertEqual(list(UserVoucher.objects.values_list('isused', flat=True)), [True])
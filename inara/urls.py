@@ -141,6 +141,7 @@ urlpatterns = [
     path('getWebsitePagniatedBundlesForCategory', getWebsitePagniatedBundlesForCategory.as_view(), name = 'getWebsitePagniatedBundlesForCategory'),
     path('getAllWebsitePaginatedItem', getAllWebsitePaginatedItem.as_view(), name = 'getAllWebsitePaginatedItem'),
     path('getAllWebsitePaginatedItems', views.get_all_website_paginated_item, name = 'getAllWebsitePaginatedItem'),
+    path('suggest', views.suggest, name = 'suggest'),
 
 
     path('getBundle',  views.getBundle, name = 'getBundle'),
@@ -272,6 +273,7 @@ urlpatterns = [
     path('getFooterSettings', views.getFooterSettings, name='getFooterSettings'),
     path('getGeneralSetting', views.getGeneralSetting, name='getGeneralSetting'),
     path('getStatistics', views.getStatistics, name='getStatistics'),
+    path('getCacheStats', views.getCacheStats, name='getCacheStats'),
     path('addReviews', views.addReviews, name='addReviews'),
     path('getReviews', views.getAllReviews, name='getReviews'),
     path('addvoucher', views.addVoucher, name='addvoucher'),
@@ -46,9 +46,25 @@ from rest_framework.views import APIView
 from inara.core import error_codes
 from decimal import Decimal
 import traceback
+from django.db import transaction
 from django.db.models import F, Case, When, Value, IntegerField
 import logging
 from django.core.cache import cache
+from inara import blacklist as token_blacklist
+from inara import caching
+from inara import categories as category_tree
+from inara import facets
+from inara import imagesync as image_sync
+from inara import imagevariants as image_variants
+from inara import notifications
+from inara import orders as order_service
+from inara import rollups
+from inara import shipping as shipping_service
+from inara import sitemap
+from inara import stock as stock_service
+from inara import vouchers as voucher_service
+from inara import listing
+from inara.pagination import KeysetPaginationMixin
 from django.conf import settings
 from django.contrib.auth.hashers import make_password
 from django.db.models import Q
@@ -83,7 +99,7 @@ from ecommerce_backend.settings import IMAGE_PROCESSING_RECIPIENTS as IMAGE_PROC
 from django.contrib.postgres.search import SearchQuery, SearchVector, TrigramSimilarity
 from django.db.models import Q
 from rest_framework_simplejwt.views import TokenRefreshView
-from .authentication import JWTAuthentication
+from .authentication import JWTAuthentication, principal_changed
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.token_blacklist.models import OutstandingToken, BlacklistedToken
 import decimal
@@ -133,13 +149,8 @@ def is_admin(view):
        
             return JsonResponse(status)
         else:
-            user = None
-            try:
-                user = User.objects.get(id=request.user.id, status=User.ACTIVE, role__in=[User.SUPER_ADMIN,User.ADMIN])
-            except User.DoesNotExist:
-                pass
-
-            if user:
+            # role and status come with the cached principal, no query needed
+            if request.user.status == User.ACTIVE and request.user.role in [User.SUPER_ADMIN,User.ADMIN]:
                 return view(request, *args, **kwargs)
             else:
                 status = {'ErrorCode': error_codes.ERROR, 'ErrorMsg': error_codes.RSTRCTD_CALL_MSG}
@@ -195,6 +206,16 @@ class BlogResultsSetPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+# ?cursor= switches these to keyset paging on the listed ordering; without it they page as before
+class OrderKeysetPagination(KeysetPaginationMixin, CustomResultsSetPagination):
+    keyset_ordering = ('-timestamp', 'id')
+
+class ItemKeysetPagination(KeysetPaginationMixin, CustomResultsSetPagination):
+    keyset_ordering = ('-newArrivalTill', '-isFeatured', '-stock', 'id')
+
+class CustomerKeysetPagination(KeysetPaginationMixin, AdminResultsSetPagination):
+    keyset_ordering = ('-id',)
+
 ###### Pagination Setup End ########
 def class_for_name(module_name, class_name):
     # load the module, will raise ImportError if module cannot be loaded
@@ -310,6 +331,7 @@ def getPublishedBlogMeta(request):
 
 @api_view(["GET"])
 @permission_classes((AllowAny,))
+@caching.etag_by_version("getPublishedBlogs", tags=["blogs"], period=300)
 def getPublishedBlogs(request):
     blogs_qs = _published_blog_queryset_for_list(request)
 
@@ -380,8 +402,7 @@ class BlacklistRefreshView(APIView):
     def post(self, request):
         token = RefreshToken(request.data.get('refresh'))
         token.blacklist()
-        accessToken = RefreshToken(request.data.get('accessToken'))
-        TokenBlacklist.objects.create(token=accessToken, blacklisted_at=currentDateTime.now())
+        token_blacklist.add(request.data.get('accessToken'))
         return Response("Success")
 
 
@@ -396,15 +417,10 @@ def apiSignOut(request):
         accessToken = request.data['accessToken']
         user = request.data['userId']
         try:
-            outstandingTokenObject = OutstandingToken.objects.filter(user_id=user).values('id')
-            for value in outstandingTokenObject:
-                token = OutstandingToken.objects.get(id=value['id'])
-                if(BlacklistedToken.objects.filter(token=token).exists()):
-                    pass
-                else:
-                    BlacklistedToken.objects.create(token=token)
+            outstandingTokenIds = OutstandingToken.objects.filter(user_id=user).values_list('id', flat=True)
+            BlacklistedToken.objects.bulk_create([BlacklistedToken(token_id=tokenId) for tokenId in outstandingTokenIds], ignore_conflicts=True)
             logger.info("%s " %(str(request.data)))
-            TokenBlacklist.objects.create(token=accessToken, blacklisted_at=currentDateTime.now())
+            token_blacklist.add(accessToken)
             result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": error_codes.ACCESS_TOKEN_BLACKLIST_MSG}
             context.update(result)
             # logger.info("%s " %(str(result)))
@@ -559,11 +575,12 @@ def syncCategories():
 def getProductCategories(request):
     parentList = []
     try:
-        parentLevelCategories = Category.objects.filter(appliesOnline=1 , parentId=None).values('id','name','icon')
+        tree = category_tree.get_tree()
+        parentLevelCategories = [cat for cat in tree.roots if cat['parentId'] is None and cat['appliesOnline'] == 1]
         for parent in parentLevelCategories:
             childs =[]
             parents = {'label':parent['name'], 'icon':parent['icon'],'value':parent['id'], 'disabled':False}
-            childCategory = Category.objects.filter(appliesOnline=1 , parentId=parent['id']).values('id','name','slug','icon')
+            childCategory = [cat for cat in tree.children(parent['id']) if cat['appliesOnline'] == 1]
             if childCategory:
                 for child in childCategory:
                     childs.append({'label':child['name'],'value':child['id'], 'children':[],'disabled':False})
@@ -575,74 +592,52 @@ def getProductCategories(request):
     return JsonResponse(parentList, safe=False)
 
 
-def getNavCategories(request):
-    cache_key = 'getNavCategories'
-    
-    # Try to get from cache first
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return JsonResponse(cached_data, safe=False)
-    
+def buildNavCategories():
     parentList = []
-    try:
-        # Optimized: Fetch all categories in one query to avoid N+1 queries
-        all_categories = Category.objects.filter(
-            status=Category.ACTIVE,
-            isBrand=False
-        ).values('id', 'name', 'icon', 'slug', 'parentId')
-        
-        # Organize categories by parentId for efficient lookup
-        categories_by_parent = {}
-        parent_categories = []
-        
-        for cat in all_categories:
-            parent_id = cat['parentId']
-            if parent_id is None:
-                parent_categories.append(cat)
-            else:
-                if parent_id not in categories_by_parent:
-                    categories_by_parent[parent_id] = []
-                categories_by_parent[parent_id].append(cat)
-        
-        # Build the navigation structure
-        for parent in parent_categories:
-            childs = []
-            parent_id = parent['id']
-            
-            # Get children of this parent
-            children = categories_by_parent.get(parent_id, [])
-            for child in children:
-                subChilds = []
-                child_id = child['id']
-                
-                # Get sub-children of this child
-                sub_children = categories_by_parent.get(child_id, [])
-                for sub in sub_children:
+    tree = category_tree.get_tree()
+    isVisible = lambda cat: cat['status'] == Category.ACTIVE and not cat['isBrand']
+    
+    # Build the navigation structure from the cached category tree
+    for parent in tree.roots:
+        if parent['parentId'] is not None or not isVisible(parent):
+            continue
+        childs = []
+        for child in tree.children(parent['id']):
+            if not isVisible(child):
+                continue
+            subChilds = []
+            for sub in tree.children(child['id']):
+                if isVisible(sub):
                     subChilds.append({
                         'title': sub['name'],
                         "href": "/category/" + sub['slug']
                     })
-                
-                childs.append({
-                    "title": child['name'],
-                    "slug": parent['slug'],
-                    "href": "/category/" + child['slug'],
-                    "subCategories": subChilds
-                })
             
-            parents = {
-                "title": parent['name'],
+            childs.append({
+                "title": child['name'],
                 "slug": parent['slug'],
-                "icon": parent['icon'],
-                "id": parent['id'],
-                "menuComponent": "MegaMenu1",
-                "href": "/category/" + parent['slug'],
-                "menuData": {"categories": childs}
-            }
-            parentList.append(parents)
+                "href": "/category/" + child['slug'],
+                "subCategories": subChilds
+            })
         
-        # Cache the result for 10 minutes
-        cache.set(cache_key, parentList, settings.CACHE_TIMEOUT.get('nav_categories', 600))
+        parents = {
+            "title": parent['name'],
+            "slug": parent['slug'],
+            "icon": parent['icon'],
+            "id": parent['id'],
+            "menuComponent": "MegaMenu1",
+            "href": "/category/" + parent['slug'],
+            "menuData": {"categories": childs}
+        }
+        parentList.append(parents)
+    return parentList
+
+@caching.etag_by_version('getNavCategories', tags=['categories'])
+@caching.cached_response('getNavCategories', tags=['categories'])
+def getNavCategories(request):
+    parentList = []
+    try:
+        parentList = buildNavCategories()
     except Exception as e:
         logger.error("Exception in getNavCategories: %s " %(str(e)))
     return JsonResponse(parentList, safe=False)
@@ -658,15 +653,17 @@ def showAllNavCategories(request):
     slug = request.GET.get('slug')
     parentList = []
     try:
-        parentLevelCategories = Category.objects.filter(parentId=None, isBrand=False, slug=slug, status=Category.ACTIVE).values('id','name','icon','slug')
+        tree = category_tree.get_tree()
+        root = tree.by_slug(slug)
+        parentLevelCategories = [root] if root and root['parentId'] is None and not root['isBrand'] and root['status'] == Category.ACTIVE else []
         for parent in parentLevelCategories:
             childs =[]
             parents = {"title":parent['name'],"slug":parent['slug'], "icon":parent['icon'],"id":parent['id'], "menuComponent":"MegaMenu1","href":"/category/"+parent['slug']}
-            childCategory = Category.objects.filter(parentId=parent['id'], status=Category.ACTIVE).values('id','name','slug','icon')
+            childCategory = [cat for cat in tree.children(parent['id']) if cat['status'] == Category.ACTIVE]
             if childCategory:
                 for child in childCategory:
                     subChilds =[]
-                    subCategory = Category.objects.filter(parentId=child['id'], status=Category.ACTIVE).values('id','name','slug','icon')
+                    subCategory = [cat for cat in tree.children(child['id']) if cat['status'] == Category.ACTIVE]
                     if subCategory:
                         for sub in subCategory:
                             subChilds.append({'title':sub['name'],"href":"/category/"+sub['slug']})
@@ -712,11 +709,12 @@ def getmyCategories(request):
     returnList = []
     
     try:
-        parentLevelCategories = Category.objects.filter(appliesOnline=1 , parentId=None).values('id','name','icon')
+        tree = category_tree.get_tree()
+        parentLevelCategories = [cat for cat in tree.roots if cat['parentId'] is None and cat['appliesOnline'] == 1]
         for parent in parentLevelCategories:
             parents = {'name':parent['name'], 'icon':parent['icon'],'id':parent['id']}
-            childCategory = Category.objects.filter(appliesOnline=1 , parentId=parent['id']).values('id','name','slug','icon')
-            parents['menuData']= {'categories':list(childCategory)}
+            childCategory = [{'id':cat['id'],'name':cat['name'],'slug':cat['slug'],'icon':cat['icon']} for cat in tree.children(parent['id']) if cat['appliesOnline'] == 1]
+            parents['menuData']= {'categories':childCategory}
             returnList.append(parents)
     except Exception as e:
         logger.error("Exception in getmyCategories: %s " %(str(e)))
@@ -879,27 +877,31 @@ def getCategoryDetail(request):
     return JsonResponse(categorySerialized, safe=False)
 
 ############## Paginations ####################
+
+def includeDescendants(request):
+    # include_descendants=1 merges the listings of every category below the requested one
+    params = request.GET if request.method == 'GET' else request.data
+    return str(params.get('include_descendants', '')).lower() in ('1', 'true')
+
+def listingTags(request, slug):
+    # a subtree listing changes with any item or category below it
+    if includeDescendants(request):
+        return ['items', 'categories']
+    return ['category:' + slug]
+
 # @api_view(['GET', 'POST'])
 @permission_classes((AllowAny,))
 # @csrf_exempt
 class PaginatedCategory(generics.ListCreateAPIView):
-    serializer_class = ItemSerializer
+    serializer_class = CategoryListingSerializer
     pagination_class = StandardResultsSetPagination
 
     def get_queryset(self):
-        itemObject={}
+        itemObject = CategoryListing.objects.none()
         slug = self.request.query_params['slug']
         try:
             categoryObject = Category.objects.get(slug=slug)
-            # Optimized: Use values_list directly instead of loop
-            itemList = list(CategoryItem.objects.filter(categoryId=categoryObject.pk).values_list("itemId", flat=True).distinct())
-            # Optimized: Add prefetch_related to avoid N+1 queries
-            # Note: manufacturer is a CharField, not a ForeignKey, so we can't use select_related
-            itemObject = Item.objects.filter(
-                id__in=itemList,
-                status=Item.ACTIVE,
-                appliesOnline=1
-            ).prefetch_related('itemgallery_set').order_by("-newArrivalTill","-isFeatured","-stock")
+            itemObject = listing.listing_queryset(categoryObject.pk, online_only=True)
         except Exception as e:
             logger.error("Exception in PaginatedCategory: %s " %(str(e)))
         return itemObject
@@ -907,44 +909,48 @@ class PaginatedCategory(generics.ListCreateAPIView):
 @api_view(['GET', 'POST'])
 @permission_classes((AllowAny,))
 @csrf_exempt
+@caching.etag_by_version('get_all_paginated_items', tags=lambda request: listingTags(request, request.GET.get('slug', '')))
 def get_all_paginated_items(request):
     slug = request.GET.get('slug', '')
     page = request.GET.get('page', 1)
     page_size = request.GET.get('pageSize', 9)
     sort_option = request.GET.get('sort', '')  # Get the sort option
+    cursor = request.GET.get('cursor')  # keyset paging, opt-in: pass cursor= (empty) for the first page
+    include_descendants = includeDescendants(request)
+    data = {'results': [], 'count': 0}
 
     try:
         categoryObject = Category.objects.get(slug=slug)
-
-        # Optimized: Use values_list directly instead of loop
-        itemList = list(CategoryItem.objects.filter(
-            categoryId=categoryObject.pk, 
-            status=CategoryItem.ACTIVE
-        ).values_list("itemId", flat=True).distinct())
-
-        # Optimized: Add prefetch_related to avoid N+1 queries
-        # Note: manufacturer is a CharField, not a ForeignKey, so we can't use select_related
-        itemObject = Item.objects.filter(
-            id__in=itemList, 
-            status=Item.ACTIVE
-        ).prefetch_related('itemgallery_set')
-        
-        # Apply sorting
-        if sort_option == 'price_asc':
-            itemObject = itemObject.order_by("salePrice")  
-        elif sort_option == 'price_desc':
-            itemObject = itemObject.order_by("-salePrice") 
+        order = sort_option if sort_option in ('price_asc', 'price_desc') else 'default'
+
+        # Filters (price_min/max, manufacturer, in_stock, new_arrival, featured) and facet counts
+        # come from the category's facet index; the page rows are then loaded by primary key
+        filters = facets.filters_from_params(request.GET)
+        if filters is not None:
+            result = facets.category_page(categoryObject.pk, filters, order, page, page_size, include_descendants)
+            rows = CategoryListing.objects.in_bulk(result['ids'])
+            data = {
+                'results': CategoryListingSerializer([rows[rowId] for rowId in result['ids'] if rowId in rows], many=True).data,
+                'count': result['count'],
+                'facets': result['facets']
+            }
+        # One range scan on the category listing read model instead of CategoryItem ids + Item id__in
+        elif cursor is not None:
+            rows, next_cursor = listing.page(categoryObject.pk, order, cursor, int(page_size), include_descendants=include_descendants)
+            data = {
+                'results': CategoryListingSerializer(rows, many=True).data,
+                'count': listing.listing_count(categoryObject.pk, include_descendants=include_descendants),
+                'next': next_cursor
+            }
         else:
-            itemObject = itemObject.order_by("-newArrivalTill", "-isFeatured", "-stock")
-
-        paginator = Paginator(itemObject, page_size)
-        page_obj = paginator.get_page(page)
+            paginator = Paginator(listing.listing_queryset(categoryObject.pk, order, include_descendants=include_descendants), page_size)
+            page_obj = paginator.get_page(page)
 
-        serializer = ItemSerializer(page_obj, many=True)
-        data = {
-            'results': serializer.data,
-            'count': paginator.count
-        }
+            serializer = CategoryListingSerializer(page_obj, many=True)
+            data = {
+                'results': serializer.data,
+                'count': paginator.count
+            }
     except Exception as e:
         print(e)
         logger.error("Exception in get_all_paginated_items: %s " % (str(e)))
@@ -1041,6 +1047,7 @@ def checkCategoryChange(request):
         # if(SectionSequence.objects.filter(child8_id=data['id']).exists):
         #     SectionSequence.objects.filter(child8_id=data['id']).update(child8_slug = data['slug'], child8_name = data['name'])
         
+        caching.invalidate('homepage')
         result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": error_codes.SUCCESS_MSG}
     except Exception as e:
         logger.error("Exception in checkCategoryChange: %s " %(str(e)))
@@ -1054,7 +1061,7 @@ def checkCategoryChange(request):
 # @method_decorator(is_admin, name='dispatch')
 class getAllCustomers(generics.ListCreateAPIView):
     serializer_class = UserSerializer
-    pagination_class = AdminResultsSetPagination
+    pagination_class = CustomerKeysetPagination
     filter_backends = [filters.SearchFilter]
     search_fields = ['name', 'username','mobile','address']
 
@@ -1077,18 +1084,9 @@ def syncItems():
     return JsonResponse(context)
 
 def getAllItems(request):
-    cache_key = 'getAllItems'
-    
-    # Try to get from cache first
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return JsonResponse(cached_data, safe=False)
-    
     itemObject = {}
     try:
-        itemObject = list(Item.objects.filter(appliesOnline=1).values('id','sku','slug','extPosId','name','description','mrp','salePrice','stock','aliasCode','status','manufacturer', 'image').order_by('extPosId')[:100])
-        # Cache the result for 5 minutes
-        cache.set(cache_key, itemObject, settings.CACHE_TIMEOUT.get('products', 300))
+        itemObject = caching.get_or_set('getAllItems', ['items'], lambda: list(Item.objects.filter(appliesOnline=1).values('id','sku','slug','extPosId','name','description','mrp','salePrice','stock','aliasCode','status','manufacturer', 'image').order_by('extPosId')[:100]))
     except Exception as e:
             logger.error("Exception in getAllItems: %s " %(str(e)))
     return JsonResponse(itemObject, safe=False)
@@ -1098,7 +1096,7 @@ def getAllItems(request):
 # @method_decorator(is_admin, name='dispatch')
 class getAllPaginatedItems(generics.ListCreateAPIView):
     serializer_class = ItemSerializer
-    pagination_class = CustomResultsSetPagination
+    pagination_class = ItemKeysetPagination
     filter_backends = [DjangoFilterBackend,filters.SearchFilter]
     # filterset_fields = {'author': ['startswith'],'manufacturer': ['startswith']}
     filterset_fields = ['author','manufacturer']
@@ -1214,9 +1212,11 @@ def getSearchItem(request):
 @api_view(['GET', 'POST'])
 @permission_classes((AllowAny,))
 @csrf_exempt
+@caching.etag_by_version('getItemDetail', tags=lambda request: ['item-slug:' + request.GET.get('slug', '')])
 def getItemDetail(request):
     returnList=[]
-    slug = request.data['slug']
+    # GET ?slug= is accepted as well so browsers and the CDN can revalidate with If-None-Match
+    slug = request.data['slug'] if 'slug' in request.data else request.GET.get('slug', '')
     publisherFlag = False
     try:
         itemObject = Item.objects.get(slug=slug)
@@ -1259,6 +1259,11 @@ class updateItem(generics.UpdateAPIView):
         parser_classes = (MultiPartParser, FormParser)
         permission_classes = [IsAuthenticated,]
 
+        def perform_update(self, serializer):
+            item = serializer.save()
+            if 'image' in serializer.validated_data:
+                image_variants.queue('item', [item.id])
+
 @api_view(['GET', 'POST'])
 @permission_classes((IsAuthenticated,))
 @is_admin
@@ -1269,8 +1274,11 @@ def updateItemGallery(request,pk):
     listImages = request.FILES.getlist('image')
     try:
         itemObject = Item.objects.get(id=pk)
+        galleryIds = []
         for i in listImages:
             galleryObj = ItemGallery.objects.create(image=i,itemId=itemObject)
+            galleryIds.append(galleryObj.id)
+        image_variants.queue('gallery', galleryIds)
     except Exception as e:
             logger.error("Exception in updateItemGallery: %s " %(str(e)))
 
@@ -1428,6 +1436,7 @@ def updatePriorityBundleItem(request):
         try:
             for i in priority:
                 BundleItem.objects.filter(bundleId_id=i['bundleId'], itemId_id=i['itemId']).update(priority=i['priority'])
+            caching.invalidate('bundles')
             result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": error_codes.UPDATE_MSG}
             context.update(result)
         except Exception as e:
@@ -1539,6 +1548,7 @@ def updateBundlePriority(request):
             else:
                 for i in priority['tasks']:
                     Bundle.objects.filter(id=i['id']).update(priority=i['priority'])
+            caching.invalidate('bundles', 'categories')
             result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": error_codes.UPDATE_MSG}
             context.update(result)
         except Exception as e:
@@ -1697,6 +1707,7 @@ def updateBundleItem(request):
             # else:
             #     itemObject = Item.objects.get(id=item['id'])
             #     BundleItem.objects.create(itemId=itemObject,quantity=item['quantity'],bundleId=bundleObject)
+        caching.invalidate('bundles')
     except Exception as e:
             logger.error("Exception in updateBundleItem: %s " %(str(e)))
     
@@ -1794,6 +1805,7 @@ def updateAdmin(request):
         logger.info("Request %s " %(str(request.data)))
         try:
             userObject = User.objects.filter(id=valueDict['id']).update(name=valueDict['name'],email=valueDict['email'],mobile=valueDict['mobile'],status=valueDict['status'])
+            principal_changed(valueDict['id'])
             userSerialized = UserSerializer(userObject).data
             result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": error_codes.UPDATE_MSG, "Update Admin":userSerialized}
             context.update(result)
@@ -1941,80 +1953,43 @@ def syncCustomers(request):
 @csrf_exempt
 def addOrder(request):
         context = {}
-        shipObj={}
         valueDict = request.data['valueDict']
         userid=request.data['userid']
         cartList = request.data['cartList']
         totalPrice = request.data['totalPrice']
         deliveryfee = request.data['deliveryFee']
-
-        totalItemQty = 0
-        name=valueDict['name']
         logger.info("Request: %s" %(request.data))
-        date = datetime.date.today()
-        formatedDate = date.strftime("%Y""%m""%d")
-        sh=UserShippingDetail.objects.filter(user=userid,area=valueDict['city'],city=valueDict['city'],address=valueDict['address']).values()
         try:
-            orderObj = Order.objects.create(custId=userid,custName=valueDict['name'], custEmail=valueDict['email'], custPhone=valueDict['phone'], cust_phone2=valueDict['phone2'], custCity=valueDict['city'], shippingAddress=valueDict['address'], shippingCity=valueDict['city'], totalBill=totalPrice, deliveryCharges=deliveryfee, discountedBill=totalPrice, paymentMethod='COD')
-            formatedOrderNo = str(formatedDate)+str(orderObj.pk)  
-            if(User.objects.filter(id=userid).exists()):
-                if sh.exists():
-                    shipObj={}
-                else:
-                    shipObj=   UserShippingDetail.objects.create(user=User.objects.get(id=userid),area=valueDict['city'],city=valueDict['city'],address=valueDict['address'])
-            else:
-                shipObj=   UserShippingDetail.objects.create(area=valueDict['city'],city=valueDict['city'],address=valueDict['address'])
-            for cart in cartList:
-                # print('In Cart List')
-                totalItemQty = cart['qty'] + totalItemQty
-                itemTotalPrice = cart['qty'] * cart['price']
-                orderDescObj = OrderDescription.objects.create(item_type=1, itemSku=cart['sku'], itemName=cart['name'], itemUnit='each', itemMinQty=1,mrp=cart['mrp'],salePrice=cart['salePrice'],itemIndPrice=cart['price'], itemTotalPrice=itemTotalPrice, itemQty=cart['qty'], isStockManaged=True,order=orderObj)
-
-            Order.objects.filter(id=orderObj.pk).update(totalItems=totalItemQty,orderNo=formatedOrderNo)
-            OrderObject = Order.objects.get(id=orderObj.id)
-            orderno=Order.objects.values('orderNo')
-            orderSerialized = OrderSerializer(OrderObject).data
-            shipSerialized=ShippingSerializers(shipObj).data
-            order=orderSerialized
-            ship=[order]
-            detail=order
-            host=HostDomain
-            sitesetting=SiteSettings.objects.values()
-
-            sitesettingname = sitesetting[0]
-
-            sitename = sitesettingname['site_name']
-
-            imageurl=ImageUrl
-          
-
-            context = {"addOrder":orderSerialized,"ship":shipSerialized}
-
-            subject = f"{sitename} Order #{formatedOrderNo} - Order Confirmation"
-            email_template = 'email_template.html'
-            message = f'{context}'
-            email_from = settings.EMAIL_HOST_USER
-            recipient_list = [valueDict['email'], ]
-            email_body = render_to_string(email_template,{'ship':ship,'order':cartList,'detail':detail,'host':host,'sitesetting':sitesetting,'imageurl':ImageUrl})
-           
-            msg = EmailMultiAlternatives(subject=subject, from_email=email_from,
-                             to=recipient_list, body=email_body)
-            msg.attach_alternative(email_body, "text/html")
-            msg.send()
+            with transaction.atomic():
+                # order, lines and shipping detail in one transaction (order_service), then the
+                # confirmation mail is queued in the same transaction and sent after commit
+                orderObj, lines, shipObj = order_service.place_order(userid, valueDict, cartList, totalPrice, deliveryfee)
+                orderSerialized = OrderSerializer(orderObj).data
+                shipSerialized = ShippingSerializers(shipObj if shipObj is not None else {}).data
+                sitesetting = list(SiteSettings.objects.values()[:1])
+                sitename = sitesetting[0]['site_name'] if sitesetting else ''
+
+                context = {"addOrder":orderSerialized,"ship":shipSerialized}
+
+                subject = f"{sitename} Order #{orderObj.orderNo} - Order Confirmation"
+                email_template = 'email_template.html'
+                email_from = settings.EMAIL_HOST_USER
+                recipient_list = [valueDict['email'], ]
+                email_body = render_to_string(email_template,{'ship':[orderSerialized],'order':cartList,'detail':orderSerialized,'host':HostDomain,'sitesetting':sitesetting,'imageurl':ImageUrl})
+                notifications.enqueue(EmailOutbox.ORDER_CONFIRMATION, subject, recipient_list, email_body,
+                                      html_body=email_body, from_email=email_from, order=orderObj)
             result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": "Order Added Successfully"}
             context.update(result)
-        
+
+        except order_service.OrderValidationError as e:
+            result = {"ErrorCode": error_codes.ERROR, "ErrorMsg": e.message, "skus": e.skus}
+            context.update(result)
         except Exception as e:
             result = {"ErrorCode": error_codes.ERROR, "ErrorMsg": "Order Not Added "}
-         
             context.update(result)
-            # result = {"ErrorCode": error_codes.ERROR, "ErrorMsg": error_codes.NOT_ADD_MSG}
             print("Exception in Add Order View ", str(e))
             logger.error("Exception in addOrder: %s " %(str(e)))
-            # traceback.print_exc()
-        # return result
-     
-       
+
         return JsonResponse(context, safe=False)
 
 # @api_view(['GET', 'POST'])
@@ -2034,7 +2009,7 @@ def addOrder(request):
 class getAllOrder(generics.ListCreateAPIView):
     serializer_class = OrderSerializer
     queryset = Order.objects.filter().order_by('-timestamp')
-    pagination_class = CustomResultsSetPagination
+    pagination_class = OrderKeysetPagination
     filter_backends = [filters.SearchFilter]
     search_fields = ['orderNo','custName','custPhone','shippingAddress','shippingCity','timestamp','status']
 
@@ -2133,6 +2108,8 @@ def updateOrder(request):
                     msg.attach_alternative(email_body, "text/html")
                     msg.send()   
                 Order.objects.filter(orderNo=orderNo).update(deliveryCharges=deliveryCharges,totalBill=totalBill,discountedBill=totalBill,status=status)
+                if(status=='CANCELLED'):
+                    stock_service.release([orderObj.id])
             for update in updatedProduct:
                 totalItemQty = int(update['qty']) + totalItemQty
                 if "id" in update:
@@ -2144,6 +2121,7 @@ def updateOrder(request):
                 OrderDescription.objects.get(id=delete['id']).delete()
 
             Order.objects.filter(id=orderObj.pk).update(totalItems=totalItemQty,shippingAddress=shippingAddress)
+            rollups.orders_changed([orderObj.pk])
             logger.info("%s " %(str(orderSerialized)))
             result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": error_codes.UPDATE_MSG, "updateOrder":orderSerialized}
             context.update(result)
@@ -2209,6 +2187,7 @@ def getOrderSentToPosDetails(request):
         if 'result' in json_data:
             if(json_data['result']['status'] == "success"):
                 Order.objects.filter(orderNo=orderNo).update(status='PENDING',orderPKPos=json_data['result']['id'])
+                rollups.orders_changed([orderObject.id])
                 result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": error_codes.UPDATE_MSG}
                 context.update(result)
         else:
@@ -2240,25 +2219,16 @@ def saveOrderDB(request):
     # orderNo = 2022112315
     try:
         orderObject = Order.objects.get(orderNo=orderNo)
-        NumOfItems = OrderDescription.objects.filter(order=orderObject).count()
-        
-        child =[]
-        
-        orderDetailObject = OrderDescription.objects.filter(order=orderObject).values('id','itemSku','itemName','mrp','salePrice','itemIndPrice','itemTotalPrice','itemQty')
-        for index,record in enumerate(orderDetailObject):
-            orderDetailList = {'rowNo':index+1,'itemId':record['itemSku'],'itemName':record['itemName'],'itemReferenceCode':record['itemSku'],'salePrice':str(record['salePrice']),'quantity':record['itemQty'],'itemAmount':str(record['mrp']),'taxPercentage':0.0}
-            child.append(orderDetailList)
-            
-            Order.objects.filter(orderNo=orderNo).update(status='CONFIRMED')
-            
-            item = Item.objects.get(sku=record['itemSku'])
-            item.stock -= record['itemQty']
-
-            item.save()
-            
-            result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": error_codes.UPDATE_MSG}
-            context.update(result)
-    
+        with transaction.atomic():
+            # the status flip is the lock: a second confirmation of the same order changes nothing
+            if Order.objects.filter(id=orderObject.id).exclude(status=Order.CONFIRMED).update(status=Order.CONFIRMED):
+                stock_service.commit(orderObject)
+                rollups.orders_changed([orderObject.id])
+        result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": error_codes.UPDATE_MSG}
+        context.update(result)
+    except stock_service.InsufficientStock as e:
+        result = {"ErrorCode": error_codes.ERROR, "ErrorMsg": str(e), "skus": e.skus}
+        context.update(result)
     except Exception as e:
             result = {"ErrorCode": error_codes.ERROR, "ErrorMsg": error_codes.NOT_SENT_TO_POS_MSG}
             context.update(result)
@@ -2366,86 +2336,17 @@ def getOrderDetails(request):
 @api_view(['GET', 'POST'])
 @permission_classes((AllowAny,))
 @csrf_exempt
+@caching.cached_response('getItemSearchCategory', tags=lambda request: listingTags(request, itemSearchCategorySlug(request)), vary=lambda request: [itemSearchCategorySlug(request), includeDescendants(request)])
 def getItemSearchCategory(request):
-    # Support both GET and POST requests
-    if request.method == 'GET':
-        slug = request.GET.get('id', '')
-    else:
-        slug = request.data.get('id', '') or request.POST.get('id', '')
+    slug = itemSearchCategorySlug(request)
     
     if not slug:
         logger.warning("getItemSearchCategory called without 'id' parameter")
         return JsonResponse([], safe=False)
     
-    cache_key = f'getItemSearchCategory_{slug}'
-    
-    # Try to get from cache first
-    try:
-        cached_data = cache.get(cache_key)
-        if cached_data is not None and len(cached_data) > 0:
-            return JsonResponse(cached_data, safe=False)
-    except Exception as cache_error:
-        logger.warning(f"Cache error in getItemSearchCategory: {str(cache_error)}")
-    
     serialized_data = []
     try:
-        categoryObject = Category.objects.get(slug=slug)
-        logger.info(f"Found category '{slug}' with ID: {categoryObject.id}")
-        
-        # Check CategoryItem relationships
-        categoryItemList = list(CategoryItem.objects.filter(
-            categoryId=categoryObject,
-            status=CategoryItem.ACTIVE
-        ).values_list("itemId",flat=True))
-        
-        logger.info(f"Found {len(categoryItemList)} CategoryItem relationships for category '{slug}'")
-        
-        if not categoryItemList:
-            # No items in this category, return empty array
-            logger.warning(f"No CategoryItem relationships found for category '{slug}' (ID: {categoryObject.id})")
-            return JsonResponse(serialized_data, safe=False)
-        
-        # Optimized query with prefetch_related to avoid N+1 queries
-        # Note: manufacturer is a CharField, not a ForeignKey, so we can't use select_related
-        # Order by featured first, then new arrivals, then stock quantity
-        # Filter by appliesOnline=1 to match PaginatedCategory behavior
-        items = Item.objects.filter(
-            id__in=categoryItemList,
-            status=Item.ACTIVE,
-            appliesOnline=1
-        ).prefetch_related('itemgallery_set').order_by("-isFeatured", "-newArrivalTill", "-stock")
-        
-        item_count = items.count()
-        logger.info(f"Query found {item_count} active items for category '{slug}'")
-        
-        if item_count == 0:
-            logger.warning(f"No active items found in category '{slug}' - checking if items exist but are filtered out")
-            # Check if items exist but are inactive or not online
-            inactive_count = Item.objects.filter(id__in=categoryItemList).exclude(status=Item.ACTIVE).count()
-            not_online_count = Item.objects.filter(id__in=categoryItemList, status=Item.ACTIVE).exclude(appliesOnline=1).count()
-            logger.info(f"Found {inactive_count} inactive items and {not_online_count} items with appliesOnline != 1 in category '{slug}'")
-        
-        # Limit to 30 items for homepage performance (reduced from 100)
-        items = items[:30]
-        serialized_data = ItemSerializer(items, many=True).data
-        
-        logger.info(f"Serialized {len(serialized_data)} products for category '{slug}'")
-        
-        if len(serialized_data) == 0 and item_count > 0:
-            logger.error(f"Serialization issue: Found {item_count} items but serialized 0 products for category '{slug}'")
-        elif len(serialized_data) == 0:
-            # Log detailed diagnostic info when no products are returned
-            total_items_in_category = Item.objects.filter(id__in=categoryItemList).count()
-            active_not_online = Item.objects.filter(id__in=categoryItemList, status=Item.ACTIVE).exclude(appliesOnline=1).count()
-            inactive_items = Item.objects.filter(id__in=categoryItemList).exclude(status=Item.ACTIVE).count()
-            logger.warning(f"Category '{slug}' diagnostic: Total items={total_items_in_category}, Active but not online={active_not_online}, Inactive={inactive_items}")
-        
-        # Cache the result if we have data
-        if serialized_data:
-            try:
-                cache.set(cache_key, serialized_data, settings.CACHE_TIMEOUT.get('products', 300))
-            except Exception as cache_error:
-                logger.warning(f"Failed to cache results: {str(cache_error)}")
+        serialized_data = buildItemSearchCategory(slug, includeDescendants(request))
     except Category.DoesNotExist:
         logger.error(f"Category with slug '{slug}' not found in getItemSearchCategory")
         serialized_data = []
@@ -2458,19 +2359,30 @@ def getItemSearchCategory(request):
     return JsonResponse(serialized_data, safe=False)
 
 
-def getAllSectionSequence(request):
-    cache_key = 'getAllSectionSequence'
+def itemSearchCategorySlug(request):
+    # Support both GET and POST requests
+    if request.method == 'GET':
+        return request.GET.get('id', '')
+    return request.data.get('id', '') or request.POST.get('id', '')
+
+def buildItemSearchCategory(slug, include_descendants=False):
+    categoryObject = Category.objects.get(slug=slug)
     
-    # Try to get from cache first
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return JsonResponse(cached_data, safe=False)
+    # Featured first, then new arrivals, then stock; online items only.
+    # Limit to 30 items for homepage performance (reduced from 100)
+    rows = list(listing.listing_queryset(categoryObject.pk, 'featured', online_only=True, include_descendants=include_descendants)[:30])
+    serialized_data = CategoryListingSerializer(rows, many=True).data
     
+    if len(serialized_data) == 0:
+        logger.warning(f"No active online items found in category '{slug}' (ID: {categoryObject.id})")
+    return serialized_data
+
+
+@caching.cached_response('getAllSectionSequence', tags=['homepage'])
+def getAllSectionSequence(request):
     itemObject = {}
     try:
         itemObject = list(SectionSequence.objects.values())
-        # Cache for 10 minutes
-        cache.set(cache_key, itemObject, settings.CACHE_TIMEOUT.get('nav_categories', 600))
     except Exception as e:
             logger.error("Exception in getAllSectionSequence: %s " %(str(e)))
             itemObject = []
@@ -2686,48 +2598,39 @@ class PostListDetailfilter(generics.ListAPIView):
 @api_view(['GET', 'POST'])
 @permission_classes((AllowAny,))
 @csrf_exempt
+@caching.cached_response('getBrandBundels', tags=['bundles', 'categories'])
 def getBrandBundels(request):
-    cache_key = 'getBrandBundels'
-    
-    # Try to get from cache first
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return JsonResponse(cached_data, safe=False)
-    
     bundelSerialized = {}
     try:
-        bundleid=list(Bundle.objects.filter(bundleType="BRAND").values_list("categoryId",flat=True))
-        cid=Category.objects.filter(id__in=bundleid).order_by('priority')
-        bundelSerialized = CategorySerializer(cid,many=True).data
-        # Cache for 10 minutes
-        cache.set(cache_key, bundelSerialized, settings.CACHE_TIMEOUT.get('nav_categories', 600))
+        bundelSerialized = buildBrandBundels()
     except Exception as e:
         logger.error("Exception in getBrandBundels: %s " %(str(e)))
         bundelSerialized = []
 
     return JsonResponse(bundelSerialized, safe=False)
+
+def buildBrandBundels():
+    bundleid=list(Bundle.objects.filter(bundleType="BRAND").values_list("categoryId",flat=True))
+    cid=Category.objects.filter(id__in=bundleid).order_by('priority')
+    return CategorySerializer(cid,many=True).data
+
 @api_view(['GET', 'POST'])
 @permission_classes((AllowAny,))
 @csrf_exempt
+@caching.cached_response('getProductBundels', tags=['bundles', 'items'])
 def getProductBundels(request):
-    cache_key = 'getProductBundels'
-    
-    # Try to get from cache first
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return JsonResponse(cached_data, safe=False)
-    
     bundelSerialized = {}
     try:
-        bundleid=Bundle.objects.filter(bundleType="PRODUCT",status=Bundle.ACTIVE).order_by('priority')
-        bundelSerialized = BundleSerializer(bundleid,many=True).data
-        # Cache for 10 minutes
-        cache.set(cache_key, bundelSerialized, settings.CACHE_TIMEOUT.get('nav_categories', 600))
+        bundelSerialized = buildProductBundels()
     except Exception as e:
         logger.error("Exception in getProductBundels: %s " %(str(e)))
         bundelSerialized = []
     return JsonResponse(bundelSerialized, safe=False)
 
+def buildProductBundels():
+    bundleid=Bundle.objects.filter(bundleType="PRODUCT",status=Bundle.ACTIVE).order_by('priority')
+    return BundleSerializer(bundleid,many=True).data
+
 @api_view(['GET', 'POST'])
 @permission_classes((AllowAny,))
 @csrf_exempt
@@ -2787,6 +2690,8 @@ from django.core.paginator import Paginator
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector,TrigramSimilarity
+from django.db.models.query import QuerySet
+from inara import search as item_search
 
 # @api_view(['GET', 'POST'])
 # @permission_classes((AllowAny,))
@@ -2836,56 +2741,31 @@ def get_all_website_paginated_item(request):
     logger.info("Product Query: %s" % (search))
     
     try:
-        vector = SearchVector('name', 'author', 'manufacturer')
-        query = SearchQuery(search)
-        words = search.split()
-        condition = Q()
-        for word in words:
-            condition &= Q(name__icontains=word)
-        # Get the items that match the search query
-        # searched_items = Item.objects.annotate(rank=SearchRank(vector, query)).filter(
-        #     condition,
-        #     status=Item.ACTIVE
-        # ).order_by('-rank')
-
-        # Get the items that are similar to the search query
-        # similar_items = Item.objects.annotate(rank=SearchRank(vector, query),similarity=TrigramSimilarity('name', search)+ TrigramSimilarity('author', search) + TrigramSimilarity('manufacturer', search)).filter(status=Item.ACTIVE).order_by('-rank','-similarity')
-        items = Item.objects.annotate(
-            rank=Case(
-                When(condition, then=SearchRank(vector, query)),
-                default=Value(0),
-                output_field=models.FloatField(),
-            ),
-            rank2=Case(
-                When(condition, then=SearchRank(vector, query)),
-                default=Value(0.7),
-                output_field=models.FloatField(),
-            ),
-            similarity=Case(
-                When(condition, then=Value(1.0)),  # Set similarity to 1 for items that match the search query
-                default=TrigramSimilarity('name', search) + TrigramSimilarity('author', search) + TrigramSimilarity('manufacturer', search),
-                output_field=models.FloatField(),
-            ),
-        ).filter(Q(rank__gte=0.4) | Q(rank2__gte=0.6) | Q(similarity__gt=0.6),status=Item.ACTIVE).order_by('-rank','-rank2', '-similarity')
-        # Combine the searched items and similar items
-        products =items
-    
-        # Order the products based on relevance, similarity, and rank
-        # products = products.order_by(
-        #     Case(
-        #         When(Q(name__icontains=search), then=Value(0)),
-        #         default=Value(1),
-        #         output_field=IntegerField()
-        #     ),
-        #     '-rank'
-        # )
-        if sort_option == 'asc':
-            products = products.order_by('salePrice') 
-        elif sort_option == 'desc':
-            products = products.order_by('-salePrice')  
+        filters = facets.filters_from_params(request.GET)
+        if filters is not None:
+            # filtered search: the ranked hits are intersected with the catalogue facet index
+            hits = item_search.search_item_ids(search) if search.strip() else None
+            order = {'asc': 'price_asc', 'desc': 'price_desc'}.get(sort_option, 'default')
+            result = facets.search_page(filters, hits, order, page, page_size)
+            return Response({
+                'results': ItemSerializer(item_search.items_in_order(result['ids']), many=True).data,
+                'count': result['count'],
+                'facets': result['facets']
+            })
+        if not search.strip():
+            products = Item.objects.filter(status=Item.ACTIVE).order_by("-newArrivalTill", "-isFeatured", "-stock")
+        else:
+            # ranked ids from the search index (tsvector + trigram on Postgres, in-memory otherwise)
+            products = item_search.search_item_ids(search)
+        if sort_option in ('asc', 'desc'):
+            if not isinstance(products, QuerySet):
+                products = Item.objects.filter(id__in=products)
+            products = products.order_by('salePrice' if sort_option == 'asc' else '-salePrice')
 
         paginator = Paginator(products, page_size)
         page_obj = paginator.get_page(page)
+        if not isinstance(products, QuerySet):
+            page_obj = item_search.items_in_order(page_obj.object_list)
 
         serializer = ItemSerializer(page_obj, many=True)
         data = {
@@ -2899,6 +2779,21 @@ def get_all_website_paginated_item(request):
     return Response(data)
 
 
+@api_view(['GET'])
+@permission_classes((AllowAny,))
+def suggest(request):
+    # typeahead: served from the per-worker prefix index, no database query per keystroke
+    prefix = request.GET.get('q', '')
+    data = {'products': [], 'categories': [], 'brands': []}
+    try:
+        limit = min(int(request.GET.get('limit', 8)), 20)
+        result = item_search.suggest(prefix, limit)
+        data = {'products': result['product'], 'categories': result['category'], 'brands': result['brand']}
+    except Exception as e:
+        logger.error("Exception in suggest: %s " % (str(e)))
+    return JsonResponse(data, safe=False)
+
+
 
 # def get_all_website_paginated_item(request):
 #     search = request.GET.get('search', '')
@@ -3319,6 +3214,8 @@ def IndividualBoxOrder_Update(request):
                     pass
     except Exception as e:
         logger.error("Exception in IndividualBoxOrder_Update: %s " %(str(e)))
+    # queryset .update() sends no signals, bump the homepage tag here
+    caching.invalidate('homepage')
     return JsonResponse(result, safe=False)
 
 # ==============================================================================================================================================
@@ -3327,24 +3224,28 @@ def IndividualBoxOrder_Update(request):
 @api_view(['GET', 'POST'])
 @permission_classes((AllowAny,))
 @csrf_exempt
+@caching.cached_response('BoxOrder_all', tags=['homepage'])
 def BoxOrder(request):
-    cache_key = 'BoxOrder_all'
-    
-    # Try to get from cache first
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return JsonResponse(cached_data, safe=False)
-    
     itemObject = {}
     try:
         itemObject = list(Individual_BoxOrder.objects.values().order_by('sequenceNo'))
-        # Cache for 10 minutes
-        cache.set(cache_key, itemObject, settings.CACHE_TIMEOUT.get('nav_categories', 600))
     except Exception as e:
         logger.error("Exception in BoxOrder: %s " %(str(e)))
         itemObject = []
     return JsonResponse(itemObject, safe=False)
 
+@api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+@is_admin
+@csrf_exempt
+def getCacheStats(request):
+    result = {}
+    try:
+        result = caching.stats()
+    except Exception as e:
+        logger.error("Exception in getCacheStats: %s " %(str(e)))
+    return JsonResponse(result, safe=False)
+
 # ======================================   Sync Images of Items from Bucket  ===============================================================================================
 from django.core.exceptions import ObjectDoesNotExist
 def SetDefaultItemImage():
@@ -3359,157 +3260,19 @@ def SyncObjectStorageItemImages():
         "endpoint_url": env('AWS_S3_CUSTOM_DOMAIN'),
     }
     client = boto3.client("s3", **linode_obj_config)
-    itemPrefix = 'idris/asset/'
-    deletePrefix = 'deleted/idris/asset/'
-    defaultImage ='idris/asset/default-item-image.jpg'
-    excepCount = 0
-    exceptionImages = []
+    # keys that can't be applied land in ImageSyncFailure and are retried, the watermark always moves on
+    result = image_sync.reconcile(client, env('AWS_STORAGE_BUCKET_NAME'))
     deleteImages = []
-    try:
-        confValue = Configuration.objects.get(name="last_sync_time_item_images")
-        if confValue:
-            # 1900-03-02 00:00:00+00:00
-            last_sync_time = Configuration.objects.filter(name="last_sync_time_item_images").values_list('value',flat=True).first()
-            last_sync_time=datetime.datetime.fromisoformat(last_sync_time)
-    except ObjectDoesNotExist:
-        try:
-            last_sync_time = datetime.datetime(1900, 3, 2, 0, 0, 0, tzinfo=datetime.timezone.utc)
-            Configuration.objects.create(name="last_sync_time_item_images",value=last_sync_time)
-        except Exception as e:
-            logger.error("Configuration for last_sync_time_item_images not created: %s " %(str(e)))
-    
-
-    paginator = client.get_paginator('list_objects_v2')
-    deletedPages = paginator.paginate(Bucket=env('AWS_STORAGE_BUCKET_NAME'), Prefix=deletePrefix)
-    for page in deletedPages:
-        for object in page['Contents']:
-            # print("objects is : ",object)
-            if object['LastModified'] > last_sync_time:
-                if '(' in object['Key']:
-                    logger.error("Invalid image name, cannot process it. Delete it %s: %s" %(object['Key'],"Invalid naming convention"))
-                    deleteImages.append(object['Key'])
-                    excepCount = excepCount+1
-                elif "_" in object['Key']:
-                    # print("Gallery image: ",object['Key'])
-                    imageNameWithoutPrefix = object['Key'].split(deletePrefix)
-                    # print("imageNameWithoutPrefix: ",imageNameWithoutPrefix)
-                    itemId = imageNameWithoutPrefix[1].split("_")
-                    # print("itemId: ",itemId)
-                    try:
-                        item = Item.objects.get(extPosId=int(itemId[0]))
-                        # print(item)
-                        if item:
-                            imageName = object['Key'].split(".")
-                            # print("imageName: ",imageName)
-                            galleryItems = ItemGallery.objects.filter(itemId=item)
-                            # print("galleryItems: ",galleryItems)
-                            if galleryItems:
-                                for gItem in galleryItems:
-                                    # print("gItem.image: ",gItem.image)
-                                    # print("gItem.image.name: ",gItem.image.name)
-                                    if imageNameWithoutPrefix[1] in gItem.image.name:
-                                        gItem.delete()
-                                        logger.info("Image deleted : %s " %(str(object['Key'])))
-                                        # print("Deleted a gallery image")
-                    except ObjectDoesNotExist:
-                        # print("Image for said item does not exist: deleting ...")
-                        deleteImages.append(object['Key'])
-                        logger.error("Image for this item does not exist: delete it %s: " %(object['Key']))
-                    except Exception as e:
-                        # print("Delete Image Exception: ",object['Key'], ". Exception: ",e)
-                        excepCount = excepCount+1
-                        exceptionImages.append(object['Key'])
-                        logger.error("Exception in processing this image %s: %s " %(object['Key'],str(e)))
-                        pass
-                else:
-                    # print("single item image: ",object['Key'])
-                    if object['Key'] == deletePrefix:
-                        print("root object")
-                    else:
-                        imageKey = object['Key'].split(".")
-                        imageName = imageKey[0].split(deletePrefix)
-                        # print(imageName)
-                        try:
-                            item = Item.objects.get(extPosId=int(imageName[1]))
-                            if item:
-                                item.image = defaultImage
-                                item.save()
-                        except ObjectDoesNotExist:
-                            # print("Image for said item does not exist: deleting ...")
-                            logger.error("Image for this item does not exist: delete it %s: " %(object['Key']))
-                            deleteImages.append(object['Key'])
-                        except Exception as e:
-                            # print("Delete Image Exception: ",object['Key'], ". Exception: ",e)
-                            logger.error("Exception in processing this image %s: %s " %(object['Key'],str(e)))
-                            excepCount = excepCount+1
-                            exceptionImages.append(object['Key'])
-                            pass
-    # print("objects in this bucket")
-    paginator = client.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=env('AWS_STORAGE_BUCKET_NAME'), Prefix=itemPrefix)
-    
-    # print("Total pages ",(pages))
-    for page in pages:
-        for object in page['Contents']:
-            if object['LastModified'] > last_sync_time:
-                if '(' in object['Key']:
-                    logger.error("Invalid image name, cannot process it. Delete it %s: %s" %(object['Key'],"Invalid naming convention"))
-                    deleteImages.append(object['Key'])
-                    excepCount = excepCount+1
-                if "_" in object['Key']:
-                    print("Gallery image: ",object['Key'])
-                    imageNameWithoutPrefix = object['Key'].split(itemPrefix)
-                    print("imageNameWithoutPrefix: ",imageNameWithoutPrefix)
-                    itemId = imageNameWithoutPrefix[1].split("_")
-                    print("itemId: ",itemId)
-                    try:
-                        item = Item.objects.get(extPosId=int(itemId[0]))
-                        print(item)
-                        if item:
-                            imageName = object['Key'].split(".")
-                            print("imageName: ",imageName)
-                            galleryItems = ItemGallery.objects.filter(itemId=item)
-                            print("galleryItems: ",galleryItems)
-                            found = False
-                            if galleryItems:
-                                for gItem in galleryItems:
-                                    print("gItem: ",gItem)
-                                    print("gItem: ",gItem.image.name)
-                                    if imageName[0] in gItem.image.name:
-                                        gItem.image = object['Key']
-                                        gItem.save()
-                                        found=True
-                                        break
-                                    
-                            if found == False:
-                                # print("create new gallery item")
-                                ItemGallery.objects.create(itemId=item,image=object['Key'])
-                    except Exception as e:
-                        # print("Exception: ",object['Key'], ". Exception: ",e)
-                        excepCount = excepCount+1
-                        deleteImages.append(object['Key'])
-                        pass
-                else:
-                    # print("single item image")
-                    imageKey = object['Key'].split(".")
-                    imageName = imageKey[0].split(itemPrefix)
-                    # print(imageName)
-                    try:
-                        item = Item.objects.get(extPosId=int(imageName[1]))
-                        if item:
-                            item.image = object['Key']
-                            item.save()
-                    except Exception as e:
-                        # print("item does not exist in db : ",object['Key'], ". Exception: ",e)
-                        excepCount = excepCount+1
-                        deleteImages.append(object['Key'])
-                        pass
-    # print("Total exceptions: ",excepCount )
+    exceptionImages = []
+    for key, (action, reason, detail, modified) in result['failures'].items():
+        if reason == ImageSyncFailure.ERROR:
+            exceptionImages.append(key)
+        else:
+            deleteImages.append(key)
     logger.info("Delete Images : %s" %(deleteImages))
     logger.info("Exception in Images : %s" %(exceptionImages))
     subject = 'Image Processing Status'
     email_template = 's3_email_template.html'
-    message = f'{context}'
     email_from = EMAIL_HOST_USER
     # recipient_list = env("IMAGE_PROCESSING_RECIPIENTS")
     recipient_list = IMAGE_PROCESSING_RECIPIENTS
@@ -3519,9 +3282,6 @@ def SyncObjectStorageItemImages():
                         to=recipient_list, body=email_body)
     msg.attach_alternative(email_body, "text/html")
     msg.send()
-
-    if excepCount == 0:
-        Configuration.objects.filter(name="last_sync_time_item_images").update(value=datetime.datetime.now(pytz.utc))
     return JsonResponse({"ErrorMsg":"Success"}, safe=False)
 
 ########## SiteMap Functions ##############
@@ -3537,99 +3297,8 @@ def DynamicSiteMapGenerator():
             "endpoint_url": env('AWS_S3_CUSTOM_DOMAIN'),
         }
         client = boto3.client("s3", **linode_obj_config)
-        itemObject      = list(Item.objects.filter(status=Item.ACTIVE,appliesOnline=1).values_list('slug',flat=True))
-        categoryObject  = list(Category.objects.filter(status=Category.ACTIVE,isBrand=False).values_list('slug',flat=True))
-        bundleObject    = list(Bundle.objects.filter(status=Bundle.ACTIVE).values_list('slug',flat=True))
-        brandObject    = list(Category.objects.filter(status=Category.ACTIVE,isBrand=True).values_list('slug',flat=True))
-
-        _url = HostDomain  # <-- Your website domain.
-        dt = datetime.datetime.now().strftime("%Y-%m-%d")  # <-- Get current date and time.
-        schema_loc = ("http://www.sitemaps.org/schemas/sitemap/0.9 "
-                    "http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd")
-
-        root = ET.Element("urlset")
-        root.attrib['xmlns:xsi'] = 'http://www.w3.org/2001/XMLSchema-instance'
-        root.attrib['xsi:schemaLocation'] = schema_loc
-        root.attrib['xmlns'] = "http://www.sitemaps.org/schemas/sitemap/0.9"
-
-        doc = ET.SubElement(root, "url")
-        ET.SubElement(doc, "loc").text = _url
-        ET.SubElement(doc, "lastmod").text = dt
-        ET.SubElement(doc, "changefreq").text = 'daily'
-        ET.SubElement(doc, "priority").text = "1.0"
-
-        doc = ET.SubElement(root, "url")
-        ET.SubElement(doc, "loc").text = (f"{_url}login")
-        ET.SubElement(doc, "lastmod").text = dt
-        ET.SubElement(doc, "changefreq").text = 'weekly'
-        ET.SubElement(doc, "priority").text = "0.6"
-
-        for product in itemObject:
-            doc = ET.SubElement(root, "url")
-            ET.SubElement(doc, "loc").text = f"{_url}product/{product}"
-            ET.SubElement(doc, "lastmod").text = dt
-            ET.SubElement(doc, "changefreq").text = 'weekly'
-            ET.SubElement(doc, "priority").text = "0.8"
-
-        for category in categoryObject:
-            doc = ET.SubElement(root, "url")
-            ET.SubElement(doc, "loc").text = f"{_url}category/{category}"
-            ET.SubElement(doc, "lastmod").text = dt
-            ET.SubElement(doc, "changefreq").text = 'weekly'
-            ET.SubElement(doc, "priority").text = "0.8"
-
-        for bundle in bundleObject:
-            doc = ET.SubElement(root, "url")
-            ET.SubElement(doc, "loc").text = f"{_url}bundle/{bundle}"
-            ET.SubElement(doc, "lastmod").text = dt
-            ET.SubElement(doc, "changefreq").text = 'weekly'
-            ET.SubElement(doc, "priority").text = "0.8"
-
-        for brand in brandObject:
-            doc = ET.SubElement(root, "url")
-            ET.SubElement(doc, "loc").text = f"{_url}brand/{brand}"
-            ET.SubElement(doc, "lastmod").text = dt
-            ET.SubElement(doc, "changefreq").text = 'weekly'
-            ET.SubElement(doc, "priority").text = "0.8"
-                
-        doc = ET.SubElement(root, "url")
-        ET.SubElement(doc, "loc").text = f"{_url}signup"
-        ET.SubElement(doc, "lastmod").text = dt
-        ET.SubElement(doc, "changefreq").text = 'weekly'
-        ET.SubElement(doc, "priority").text = "0.6"
-
-        doc = ET.SubElement(root, "url")
-        ET.SubElement(doc, "loc").text = (f"{_url}return-policy")
-        ET.SubElement(doc, "lastmod").text = dt
-        ET.SubElement(doc, "changefreq").text = 'weekly'
-        ET.SubElement(doc, "priority").text = "0.6"
-
-        doc = ET.SubElement(root, "url")
-        ET.SubElement(doc, "loc").text = (f"{_url}about-us")
-        ET.SubElement(doc, "lastmod").text = dt
-        ET.SubElement(doc, "changefreq").text = 'weekly'
-        ET.SubElement(doc, "priority").text = "0.6"
-
-        doc = ET.SubElement(root, "url")
-        ET.SubElement(doc, "loc").text = (f"{_url}privacy-policy")
-        ET.SubElement(doc, "lastmod").text = dt
-        ET.SubElement(doc, "changefreq").text = 'weekly'
-        ET.SubElement(doc, "priority").text = "0.6"
-
-        doc = ET.SubElement(root, "url")
-        ET.SubElement(doc, "loc").text = (f"{_url}contact-us")
-        ET.SubElement(doc, "lastmod").text = dt
-        ET.SubElement(doc, "changefreq").text = 'weekly'
-        ET.SubElement(doc, "priority").text = "0.6"
-    
-        tree = ET.ElementTree(root)
-        tree.write(DEFAULT_SITEMAP_LOCAL,
-                    encoding='utf-8', xml_declaration=True)
-        client.upload_file(         
-            Filename=DEFAULT_SITEMAP_LOCAL,
-            Bucket=env('AWS_STORAGE_BUCKET_NAME'),
-            Key=DEFAULT_SITEMAP_S3,
-            ExtraArgs={'ACL':'public-read'})
+        # streamed into 50k-URL shards plus sitemap_index.xml; unchanged files are not re-uploaded
+        sitemap.publish(client, env('AWS_STORAGE_BUCKET_NAME'), env('AWS_BASE_URL'))
     except Exception as e:
         logger.error("Exception in DynamicSiteMapGenerator: %s " %(str(e)))
     
@@ -3665,14 +3334,19 @@ def PublisherFlag():
     print(subCat)
     return subCat
 
+# bucket listing has no model signal to hang off, so keep a ttl as well as the 'sliders' tag
+@caching.cached_response('getSlidersFromCloud', tags=['sliders'], timeout=settings.CACHE_TIMEOUT.get('sliders', 3600))
 def getSlidersFromCloud(request):
-    cache_key = 'getSlidersFromCloud'
-    
-    # Try to get from cache first
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return JsonResponse(cached_data, safe=False)
-    
+    slidersList = []
+    try:
+        slidersList = listSlidersFromCloud()
+    except Exception as e:
+        print(e)
+        logger.error("getSlidersFromCloud : %s " %(str(e)))
+        slidersList = []
+    return JsonResponse(slidersList, safe=False)
+
+def listSlidersFromCloud():
     linode_obj_config = {
         "aws_access_key_id": env('AWS_ACCESS_KEY_ID'),
         "aws_secret_access_key": env('AWS_SECRET_ACCESS_KEY'),
@@ -3682,20 +3356,13 @@ def getSlidersFromCloud(request):
     sliderPrefix = 'idris/sliders/'
     slidersList = []
     unwantedData = ['Thumbs.db',sliderPrefix]
-    try:
-        paginator = client.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket=env('AWS_STORAGE_BUCKET_NAME'), Prefix=sliderPrefix)
-        for page in pages:
-            for object in page['Contents']:
-                if object['Key'] not in unwantedData:
-                    slidersList.append(env('AWS_BASE_URL')+object['Key'])
-        # Cache for 1 hour (sliders don't change frequently)
-        cache.set(cache_key, slidersList, 3600)
-    except Exception as e:
-        print(e)
-        logger.error("getSlidersFromCloud : %s " %(str(e)))
-        slidersList = []
-    return JsonResponse(slidersList, safe=False)
+    paginator = client.get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=env('AWS_STORAGE_BUCKET_NAME'), Prefix=sliderPrefix)
+    for page in pages:
+        for object in page['Contents']:
+            if object['Key'] not in unwantedData:
+                slidersList.append(env('AWS_BASE_URL')+object['Key'])
+    return slidersList
 
 
 @api_view(['GET', 'POST'])
@@ -3877,7 +3544,8 @@ def getLocalCategory(request):
 def getLocalParentCategories(request):
     categoryObject = {}
     try:
-        categoryObject = list(Category.objects.filter(parentId__isnull=True).values('id','parentId','name').order_by('name'))
+        tree = category_tree.get_tree()
+        categoryObject = sorted(({'id':cat['id'],'parentId':cat['parentId'],'name':cat['name']} for cat in tree.nodes.values() if cat['parentId'] is None), key=lambda cat: cat['name'])
     except Exception as e:
         logger.error("Exception in getParentCategories: %s " %(str(e)))
     return JsonResponse(categoryObject, safe=False)
@@ -3891,7 +3559,8 @@ def getLocalParentCategories(request):
 def getLocalSubCategories(request):
     categoryObject = {}
     try:
-        categoryObject = list(Category.objects.filter(parentId__isnull=False).values('id','parentId','name').order_by('name'))
+        tree = category_tree.get_tree()
+        categoryObject = sorted(({'id':cat['id'],'parentId':cat['parentId'],'name':cat['name']} for cat in tree.nodes.values() if cat['parentId'] is not None), key=lambda cat: cat['name'])
     except Exception as e:
         logger.error("Exception in getSubCategories: %s " %(str(e)))
     return JsonResponse(categoryObject, safe=False)
@@ -3935,9 +3604,12 @@ def addItemGallery(request):
         item_id = request.query_params.get('itemId')
         images = request.FILES.getlist('image')
 
+        galleryIds = []
         for image in images:
             item_gallery = ItemGallery(itemId_id=item_id, image=image)
             item_gallery.save()
+            galleryIds.append(item_gallery.id)
+        image_variants.queue('gallery', galleryIds)
 
         return JsonResponse({'success': True, 'item_id': item_id})
     else:
@@ -4012,6 +3684,7 @@ def addItem(request):
             discount=discount,
         )
         item.save()
+        image_variants.queue('item', [item.id])
 
         res = {
             'success': True,
@@ -4299,18 +3972,10 @@ def addSiteSetting(request):
 @permission_classes((AllowAny,))
 # @is_admin
 @csrf_exempt
+@caching.cached_response('getGeneralSetting', tags=['site_settings'])
 def getGeneralSetting(request):
-    cache_key = 'getGeneralSetting'
-    
-    # Try to get from cache first
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return JsonResponse(cached_data, safe=False)
-    
     try:
         generalObject = list(SiteSettings.objects.values())
-        # Cache for 30 minutes (settings change infrequently)
-        cache.set(cache_key, generalObject, 1800)
     except Exception as e:
         logger.error("Exception in getGeneralSetting: %s " %(str(e)))
         generalObject = []
@@ -4318,20 +3983,10 @@ def getGeneralSetting(request):
     
 @api_view(['GET', 'POST'])
 @permission_classes((AllowAny,))
-
+@caching.cached_response('getLocalSlider', tags=['site_settings'])
 def getLocalSlider(request):
-    cache_key = 'getLocalSlider'
-    
-    # Try to get from cache first
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return JsonResponse(cached_data, safe=False)
-    
     try:
-        slider_set = SiteImage.objects.order_by('-id')[:5]
-        sliderObject = list(slider_set.values())
-        # Cache for 1 hour (sliders don't change frequently)
-        cache.set(cache_key, sliderObject, 3600)
+        sliderObject = list(SiteImage.objects.order_by('-id')[:5].values())
     except Exception as e:
         logger.error("Exception in getsliderimage: %s " %(str(e)))
         sliderObject = []
@@ -4340,7 +3995,7 @@ def getLocalSlider(request):
 
 @api_view(['GET', 'POST'])
 @permission_classes((AllowAny,))
-
+@caching.etag_by_version('getFooterSettings', tags=['site_settings'])
 def getFooterSettings(request):
     site_settings = SiteSettings.objects.first()
     
@@ -4400,93 +4055,16 @@ def getFooterSettings(request):
 def getStatistics(request):
     stat_type = request.GET.get('type')
 
-    
-    current_date = timezone.now()
-    thirty_days_ago = current_date - timedelta(days=30)
-    week_ago = current_date - timedelta(days=7)
-
-
-    if stat_type == 'currentmonth':
-        orders = Order.objects.filter(timestamp__year=current_date.year, timestamp__month=current_date.month)
-    elif stat_type == 'last30days':
-        orders = Order.objects.filter(timestamp__gte=thirty_days_ago)
-    else:
-        orders = Order.objects.filter(timestamp__gte=thirty_days_ago)
-
-
-
-        #############################Current Month##########
-
-    current_monthsale=Order.objects.filter(timestamp__year=current_date.year, timestamp__month=current_date.month,status='CONFIRMED')
-    current_month_sale =current_monthsale.aggregate(total_sale=Sum('totalBill')- Sum('deliveryCharges'))['total_sale']
-    current_monthorder=current_monthsale.count()
-
-##################Monthly############################
-    # monthlysale = Order.objects.filter(timestamp__gte=thirty_days_ago,status='CONFIRMED')
-    # total_monthly_sale = monthlysale.aggregate(total_sale=Sum('totalBill')- Sum('deliveryCharges'))['total_sale']
-    # monthly_saleitem=monthlysale.count()
-    monthlysale = Order.objects.filter(timestamp__gte=thirty_days_ago, status='CONFIRMED')
-    total_monthly_sale = monthlysale.aggregate(total_sale=Sum('totalBill') - Sum('deliveryCharges'))['total_sale']
-    monthly_saleitem = monthlysale.aggregate(total_quantity_sold=Sum('order_description_id__itemQty'))['total_quantity_sold']
-    monthly_order=monthlysale.count()
-
-###################################Weekly#################################
-
-    # weeklysale = Order.objects.filter(timestamp__gte=week_ago,status='CONFIRMED')
-    # total_weekly_sale = weeklysale.aggregate(total_sale=Sum('totalBill')- Sum('deliveryCharges'))['total_sale']
-    # weekly_saleitem=weeklysale.count()
-    weeklysale = Order.objects.filter(timestamp__gte=week_ago, status='CONFIRMED')
-    total_weekly_sale = weeklysale.aggregate(total_sale=Sum('totalBill') - Sum('deliveryCharges'))['total_sale']
-    weekly_saleitem = weeklysale.aggregate(total_quantity_sold=Sum('order_description_id__itemQty'))['total_quantity_sold']
-    weekly_saleorder=weeklysale.count()
-
-
-###################################All Sale ################################
-    
-    # total_sale = Order.objects.filter(status='CONFIRMED').aggregate(total_sale=Sum('totalBill')- Sum('deliveryCharges'))['total_sale']
-    # total_saleItem=Order.objects.filter(status='CONFIRMED').count()
-    total_sale = Order.objects.filter(status='CONFIRMED').aggregate(total_sale=Sum('totalBill') - Sum('deliveryCharges'))['total_sale']
-    total_saleItem = OrderDescription.objects.filter(order__status='CONFIRMED').aggregate(total_quantity_sold=Sum('itemQty'))['total_quantity_sold']
-
-
-    
-    total_order=Order.objects.count()
-    orderSerialized = OrderSerializer(orders, many=True).data
-
-    # existing_entry = DashboardStatistics.objects.filter(name=name, stat_type=stat_type).first()
-
-    # if existing_entry:
-    #     existing_entry.value = total_statistic
-    #     existing_entry.updatetime = timezone.now()
-    #     existing_entry.save()
-    # else:
-    #     DashboardStatistics.objects.create(name=name, value=total_statistic, stat_type=stat_type)
-
+    # sales figures come from the daily rollups (inara.rollups), stock from Item
+    statistics = rollups.dashboard()
     stock_items = Item.objects.filter(stock=0).values('id','name','stock', 'salePrice')[:5]
-    
     total_outstock=Item.objects.filter(stock=0).count()
-    # most_sold_item =Order.objects.filter(order_description_id__item_type=OrderDescription.PRODUCT).values('id', 'order_description_id__itemName', 'order_description_id__salePrice').annotate(Count('order_description_id__itemSku')).order_by('-item_quantity').first()
-    # most_sold_items = OrderDescription.objects.annotate(item_quantity=Sum('itemQty'),).filter(item_type=OrderDescription.PRODUCT).values('id', 'itemName', 'salePrice').distinct().annotate(Count('itemSku')).order_by('-item_quantity')[:5]
-    # most_sold_items = OrderDescription.objects.filter(item_type=OrderDescription.PRODUCT, isDeleted=False).values('itemSku', 'itemName', 'salePrice') .annotate(total_quantity_sold=Sum('itemQty'), item_count=Count('id')) .order_by('-total_quantity_sold') .distinct()[:5]
-    most_sold_items = OrderDescription.objects.filter(item_type=OrderDescription.PRODUCT, isDeleted=False) .filter(order__status=Order.CONFIRMED).values('itemSku', 'itemName', 'salePrice') .annotate(total_quantity_sold=Sum('itemQty'), item_count=Count('id')) .order_by('-total_quantity_sold') .distinct()[:5]
-    return JsonResponse({
-        "current_month_sale":current_month_sale,
-        "mostsold_item": list(most_sold_items),
-        "monthly_order":monthly_order,
-        "current_monthorder":current_monthorder,
-        "monthly_sales":total_monthly_sale,
-        "monthy_saleitem":monthly_saleitem,
-        "total_weekly_sale":total_weekly_sale,
-        "weekly_saleitem":weekly_saleitem,
-        "weekly_saleorder":weekly_saleorder,
-        # "orders":orderSerialized,
+    statistics.update({
         "type": stat_type,
-        "total_order": total_order,
-        "total_sale":total_sale,
-        'total_saleItem':total_saleItem,
         "stock_items": list(stock_items) ,
         "total_outstock": total_outstock,
     })
+    return JsonResponse(statistics)
 
 
 @permission_classes((IsAuthenticated,))
@@ -4528,34 +4106,27 @@ def addReviews(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 @permission_classes((AllowAny,))
+@caching.cached_response('getAllReviews', tags=['reviews', 'items'])
 def getAllReviews(request):
-    cache_key = 'getAllReviews'
-    
-    # Try to get from cache first
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return JsonResponse(cached_data, safe=False)
-    
     try:
-        # Limit to recent 50 reviews for performance
-        allrequest_list = list(ProductReview.objects.values().order_by('-id')[:50])
-        
-        # Get unique item IDs from reviews
-        item_ids = list(set([review.get('itemid_id') for review in allrequest_list if review.get('itemid_id')]))
-        
-        # Fetch items in one query
-        items = list(Item.objects.filter(id__in=item_ids).values('id', 'name', 'image')) if item_ids else []
-       
-        result = {"Reviews": allrequest_list, "items": items}
-        
-        # Cache for 10 minutes
-        cache.set(cache_key, result, settings.CACHE_TIMEOUT.get('nav_categories', 600))
-        
+        result = buildAllReviews()
         return JsonResponse(result, safe=False)
 
     except Exception as e:
         logger.error("Exception in getAllReviews: %s " %(str(e)))
         return JsonResponse({'error': str(e)}, status=500)
+
+def buildAllReviews():
+    # Limit to recent 50 reviews for performance
+    allrequest_list = list(ProductReview.objects.values().order_by('-id')[:50])
+    
+    # Get unique item IDs from reviews
+    item_ids = list(set([review.get('itemid_id') for review in allrequest_list if review.get('itemid_id')]))
+    
+    # Fetch items in one query
+    items = list(Item.objects.filter(id__in=item_ids).values('id', 'name', 'image')) if item_ids else []
+   
+    return {"Reviews": allrequest_list, "items": items}
     
     
 @permission_classes((IsSuperAdmin,))
@@ -4657,41 +4228,16 @@ def checkVoucherValidity(request):
     coupon_code = request.data.get("couponCode")
     userid=request.data.get("userid")
     try:
-        voucher = Voucher.objects.get(code=coupon_code)
-        if voucher.status == 1:
-            currentdate = timezone.now()
-            if currentdate <= voucher.enddate:
-                try:
-                    checkvoucher=UserVoucher.objects.get(user=userid,vouchercode=coupon_code)
-                    print(checkvoucher.isused)
-                    if checkvoucher:
-                        if checkvoucher.isused==False:
-                            return JsonResponse({"isValid": True, "couponData": {
-                                "code": voucher.code,
-                                "discount": voucher.discount,
-                                'id':voucher.id,
-                            }})
-                        else:
-                            return JsonResponse({"isValid": False, "message": "Coupon Code is already used",'status':'409'},status=409)
-                    else:
-                        return JsonResponse({"isValid": True, "couponData": {
-                                "code": voucher.code,
-                                "discount": voucher.discount,
-                                'id':voucher.id,
-                            }})
-                except:
-                    return JsonResponse({"isValid": True, "couponData": {
-                                "code": voucher.code,
-                                "discount": voucher.discount,
-                                'id':voucher.id,
-                            }})
-            
-            else:
-                return JsonResponse({"isValid": False, "message": "Coupon code is expired"})
-        else:
-            return JsonResponse({"isValid": False, "message": "Coupon code is inactive"})
-    except Voucher.DoesNotExist:
-        return JsonResponse({"isValid": False, "message": "Coupon code not found"})
+        voucher = voucher_service.validate(coupon_code, userid)
+    except voucher_service.InvalidVoucher as e:
+        if e.status:
+            return JsonResponse({"isValid": False, "message": e.message, 'status': str(e.status)}, status=e.status)
+        return JsonResponse({"isValid": False, "message": e.message})
+    return JsonResponse({"isValid": True, "couponData": {
+                        "code": voucher['code'],
+                        "discount": voucher['discount'],
+                        'id':voucher['id'],
+                    }})
 
 @api_view(['GET', 'POST'])
 def saveVoucherData(request):
@@ -4700,16 +4246,13 @@ def saveVoucherData(request):
     voucherid=request.data.get("voucherid")
     vouchercode=request.data.get("vouchercode")
 
-    user=User.objects.get(id=userid)
-    voucher=Voucher.objects.get(id=voucherid)
-
     try:
-
-        newdata=UserVoucher.objects.create(user=user,voucher=voucher,vouchercode=vouchercode,isused=True)
+        voucher_service.redeem(userid, code=vouchercode, voucher_id=voucherid)
         return JsonResponse({"Msg":"Data Sucessfully Added"})
-    
-    
+    except voucher_service.InvalidVoucher as e:
+        return JsonResponse({'error': e.message}, status=e.status or 400)
     except Exception as e:
+        logger.error("Exception in saveVoucherData: %s " %(str(e)))
         return JsonResponse({'error': str(e)}, status=500)
 
 
@@ -4906,6 +4449,7 @@ def deleteCity(request):
             # traceback.print_exc()
         return JsonResponse(context, safe=False)
 
+@caching.etag_by_version('getWebsiteCountries', tags=['countries'])
 def getWebsiteCountries(request):
 
     try:
@@ -5164,53 +4708,21 @@ class updateChargesConfiguration(generics.UpdateAPIView):
 @permission_classes((AllowAny,))
 @csrf_exempt
 def calculateWeight(request):
-
-    cart= request.data['cartList']
-    print(cart)
-    city=request.data.get("city")
-    addOnFlag = True
-    totalWeight = 0
-    shippingCharges = 0
     context = {}
-
-    cityType=City.objects.get(name=city)
-
-
-    for item in cart:
-        slug = item["slug"]
-        qty = item["qty"]
-
-        try:
-            product = Item.objects.get(slug=slug)
-            totalWeight += float(product.weight) * float(qty)
-        except Item.DoesNotExist:
-            pass
-
-    totalWeight = totalWeight/1000
-
     try:
-        courierObj = CourierConfiguration.objects.filter(cityType=cityType.type, addOn=False).values('id','cityType','weight','price','addOn','status').order_by('weight')
-        for charges in courierObj:
-            if(charges['weight']>totalWeight):
-                shippingCharges = charges['price']
-                addOnFlag = False
-                break
-
-
-        if addOnFlag:
-            generalPrice = CourierConfiguration.objects.get(cityType=cityType.type, weight=1)
-            shippingCharges += generalPrice.price
-            remainingWeight = totalWeight - 1
-            remainingWeight = math.ceil(remainingWeight)
-            addOnPrice = CourierConfiguration.objects.get(cityType=cityType.type, addOn=True)
-            shippingCharges += addOnPrice.price*remainingWeight
-        result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": error_codes.UPDATE_MSG, "shippingCharges":shippingCharges, "totalWeight":totalWeight}
+        cart = request.data['cartList']
+        city = request.data.get("city")
+        totalWeight = shipping_service.cart_weight(cart)
+        quotes = shipping_service.quotes(city, totalWeight)
+        if not quotes:
+            raise ValueError("No courier rates configured for %s" % city)
+        result = {"ErrorCode": error_codes.SUCCESS, "ErrorMsg": error_codes.UPDATE_MSG, "shippingCharges": quotes[0]['shippingCharges'],
+                  "totalWeight": totalWeight, "quotes": quotes}
         context.update(result)
     except Exception as e:
-            result = {"ErrorCode": error_codes.ERROR, "ErrorMsg": error_codes.NOT_SENT_TO_POS_MSG}
-            context.update(result)
-            logger.error("Exception in getShippingChargesAgainstCity: %s " %(str(e)))
-            print(e)
+        result = {"ErrorCode": error_codes.ERROR, "ErrorMsg": error_codes.NOT_SENT_TO_POS_MSG}
+        context.update(result)
+        logger.error("Exception in getShippingChargesAgainstCity: %s " %(str(e)))
     return JsonResponse(context, safe=False)
 
 
@@ -5225,7 +4737,13 @@ def cancelUnpaidOrder():
             Q(timestamp__gte=thirty_minutes_ago)
         )
 
-        orders_to_cancel.update(status=Order.CANCELLED)
+        with transaction.atomic():
+            orderIds = list(orders_to_cancel.exclude(status=Order.CANCELLED).values_list('id', flat=True))
+            Order.objects.filter(id__in=orderIds).update(status=Order.CANCELLED)
+            rollups.orders_changed(orderIds)
+            stock_service.release(orderIds)
+        # holds of orders that were neither paid for nor confirmed in time
+        stock_service.release_expired()
 
         return JsonResponse({"success": True, "message": "Orders successfully cancelled"})
     except Exception as e:
@@ -0,0 +1,2 @@
+# Voucher validation and redemption backed by cached voucher and usage lookups
+from .service import InvalidVoucher, get_vouchers, load_vouchers, redeem, used_vouchers, validate
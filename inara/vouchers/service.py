@@ -0,0 +1,104 @@
+"""
+Voucher validation and redemption
+
+validate() answers a coupon check from memory: the vouchers are a per-process snapshot keyed on
+the 'vouchers' cache tag (bumped by every Voucher save/delete) and the ids a customer has
+already used are cached per user. redeem() is a single INSERT .. ON CONFLICT against the
+unique (user, voucher) index, so two concurrent redemptions of the same voucher by the same
+customer can't both succeed.
+"""
+import logging
+import threading
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from inara import caching
+from inara.models import UserVoucher, Voucher
+
+logger = logging.getLogger(__name__)
+
+VOUCHER_TAG = 'vouchers'
+# Voucher.status is stored as 1 / 0 by the admin screens
+ACTIVE_STATUS = 1
+
+_vouchers = None
+_vouchersVersion = None
+_lock = threading.Lock()
+
+
+class InvalidVoucher(Exception):
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _user_tag(userid):
+    return 'user-vouchers:%s' % userid
+
+
+def load_vouchers():
+    codes = {}
+    for voucher in Voucher.objects.values('id', 'code', 'discount', 'status', 'startdate', 'enddate'):
+        codes[voucher['code']] = voucher
+    return {'codes': codes, 'ids': {voucher['id']: code for code, voucher in codes.items()}}
+
+
+def get_vouchers():
+    """The voucher snapshot of this process, rebuilt after any voucher change."""
+    global _vouchers, _vouchersVersion
+    version = caching.tag_versions([VOUCHER_TAG])[0]
+    if _vouchers is not None and _vouchersVersion == version:
+        return _vouchers
+    with _lock:
+        if _vouchers is None or _vouchersVersion != version:
+            _vouchers = load_vouchers()
+            _vouchersVersion = version
+    return _vouchers
+
+
+def used_vouchers(userid):
+    """Ids of the vouchers userid has redeemed."""
+    return set(caching.get_or_set(_user_tag(userid), [_user_tag(userid)], lambda: list(
+        UserVoucher.objects.filter(user_id=userid, isused=True).values_list('voucher_id', flat=True))))
+
+
+def validate(code, userid=None):
+    """The voucher for code if userid may use it now; raises InvalidVoucher otherwise."""
+    voucher = get_vouchers()['codes'].get(code)
+    if voucher is None:
+        raise InvalidVoucher("Coupon code not found")
+    if voucher['status'] != ACTIVE_STATUS:
+        raise InvalidVoucher("Coupon code is inactive")
+    if timezone.now() > voucher['enddate']:
+        raise InvalidVoucher("Coupon code is expired")
+    if userid and voucher['id'] in used_vouchers(userid):
+        raise InvalidVoucher("Coupon Code is already used", 409)
+    return voucher
+
+
+def _upsert(userid, voucher):
+    # inserts the usage row, or flips an unused one; touches nothing if it is already used
+    table = UserVoucher._meta.db_table
+    columns = {name: connection.ops.quote_name(UserVoucher._meta.get_field(name).column)
+               for name in ('user', 'voucher', 'vouchercode', 'isused')}
+    sql = ("INSERT INTO {table} ({user}, {voucher}, {vouchercode}, {isused}) VALUES (%s, %s, %s, %s) "
+           "ON CONFLICT ({user}, {voucher}) DO UPDATE SET {isused} = %s WHERE {table}.{isused} = %s").format(
+        table=connection.ops.quote_name(table), **columns)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [userid, voucher['id'], voucher['code'], True, True, False])
+        return cursor.rowcount
+
+
+def redeem(userid, code=None, voucher_id=None):
+    """Record that userid used the voucher (by code, or by id); raises InvalidVoucher if they can't."""
+    if voucher_id:
+        code = get_vouchers()['ids'].get(int(voucher_id))
+    voucher = validate(code)
+    with transaction.atomic():
+        if not _upsert(userid, voucher):
+            raise InvalidVoucher("Coupon Code is already used", 409)
+        caching.invalidate(_user_tag(userid))
+    return voucher